@@ -0,0 +1,169 @@
+import datetime
+
+import numpy as np
+import psycopg2
+
+import Backend as backend
+from Cache import MISS
+import Instrumentation as instrumentation
+
+# --- SETTINGS ---
+
+# Rows fetched from the server per round trip; memory use is bounded by this, not by the user's history
+ANALYTICS_CHUNK_SIZE = 50000
+# Weeks start on Monday; workouts are bucketed by whole weeks since this Monday
+WEEK_EPOCH = datetime.date(1970, 1, 5)
+
+# Every exercise row of one user with its workout's day number. No ORDER BY: every
+# aggregate below is order-independent, so the server can stream rows as it finds them.
+EXERCISE_ROWS_SQL = f"""
+SELECT E.exercise_key,
+       W.workout_date - DATE '{WEEK_EPOCH.isoformat()}',
+       COALESCE(E.sets, 0),
+       COALESCE(E.reps, 0),
+       COALESCE(E.weight_kg, 0)::float8
+FROM Workouts W
+JOIN Exercises E ON E.workout_id = W.workout_id AND E.workout_date = W.workout_date
+WHERE W.user_id = %s;
+"""
+
+# --- STREAMING ---
+
+def stream_exercise_chunks(user_id, chunk_size=ANALYTICS_CHUNK_SIZE):
+    """Yields a user's exercise rows as columnar NumPy chunks of at most `chunk_size` rows.
+
+    Each chunk is (names, days, sets, reps, weights); days count from WEEK_EPOCH.
+    Rows come from a server-side cursor, so only one chunk is ever held in memory.
+    """
+    conn, cur = None, None
+    try:
+        conn = backend.get_read_connection(user_id)
+        if not conn: return
+        cur = backend.server_cursor(conn, chunk_size)
+        cur.execute(EXERCISE_ROWS_SQL, (user_id,))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            names, days, sets, reps, weights = zip(*rows)
+            yield (
+                np.array(names),
+                np.array(days, dtype=np.int64),
+                np.array(sets, dtype=np.float64),
+                np.array(reps, dtype=np.float64),
+                np.array(weights, dtype=np.float64),
+            )
+    finally:
+        backend.close_db_connection(conn, cur)
+
+# --- AGGREGATES ---
+
+def estimated_one_rep_max(weights, reps):
+    """Epley estimate of the one-rep max, weight * (1 + reps / 30); a single rep is its own max."""
+    e1rm = np.where(reps > 1, weights * (1 + reps / 30), weights)
+    return np.where((reps > 0) & (weights > 0), e1rm, 0.0)
+
+def _best_per_exercise(codes, values, days):
+    """Returns the row index of each exercise's largest value, the earliest such row on ties."""
+    order = np.lexsort((-days, values, codes))
+    last_of_group = np.flatnonzero(np.diff(codes[order], append=codes.size))
+    return order[last_of_group]
+
+def _merge_record(records, name, value, day):
+    best = records.get(name)
+    if value > 0 and (best is None or value > best[0] or (value == best[0] and day < best[1])):
+        records[name] = (value, day)
+
+class _Accumulator:
+    """Per-(exercise, week) and per-exercise totals, updated one chunk at a time."""
+
+    def __init__(self):
+        self.rows = 0
+        self.weekly_volume = {}    # (exercise, week) -> sum of sets * reps * weight
+        self.weekly_e1rm = {}      # (exercise, week) -> best estimated 1RM
+        self.total_volume = {}     # exercise -> sum of sets * reps * weight
+        self.max_weight = {}       # exercise -> (weight, day first lifted)
+        self.best_e1rm = {}        # exercise -> (estimated 1RM, day first reached)
+
+    def add(self, names, days, sets, reps, weights):
+        self.rows += names.size
+        exercises, codes = np.unique(names, return_inverse=True)
+        weeks = days // 7
+        volume = sets * reps * weights
+        e1rm = estimated_one_rep_max(weights, reps)
+
+        # Encode (exercise, week) as one integer so a single np.unique groups both
+        first_week = weeks.min()
+        span = int(weeks.max() - first_week) + 1
+        pairs, group = np.unique(codes * span + (weeks - first_week), return_inverse=True)
+        group_volume = np.bincount(group, weights=volume, minlength=pairs.size)
+        group_e1rm = np.zeros(pairs.size)
+        np.maximum.at(group_e1rm, group, e1rm)
+        for pair, pair_volume, pair_e1rm in zip(pairs.tolist(), group_volume.tolist(), group_e1rm.tolist()):
+            key = (str(exercises[pair // span]), int(first_week) + pair % span)
+            self.weekly_volume[key] = self.weekly_volume.get(key, 0.0) + pair_volume
+            if pair_e1rm > self.weekly_e1rm.get(key, 0.0):
+                self.weekly_e1rm[key] = pair_e1rm
+
+        exercise_volume = np.bincount(codes, weights=volume, minlength=exercises.size)
+        for name, name_volume in zip(exercises.tolist(), exercise_volume.tolist()):
+            self.total_volume[name] = self.total_volume.get(name, 0.0) + name_volume
+        for values, records in ((weights, self.max_weight), (e1rm, self.best_e1rm)):
+            for row in _best_per_exercise(codes, values, days).tolist():
+                _merge_record(records, str(names[row]), float(values[row]), int(days[row]))
+
+def _week_start(week):
+    return WEEK_EPOCH + datetime.timedelta(weeks=week)
+
+def _day(day):
+    return WEEK_EPOCH + datetime.timedelta(days=day)
+
+@instrumentation.traced
+def read_training_analytics(user_id, chunk_size=ANALYTICS_CHUNK_SIZE):
+    """R: Computes a user's training trends from the exercise history kept in the database.
+
+    Returns a dict with
+      "weekly_volume":    [(week_start, exercise, sets * reps * weight_kg)]
+      "e1rm_progression": [(week_start, exercise, best estimated 1RM that week)]
+      "personal_records": [(exercise, max_weight, date, best_e1rm, date, total_volume)]
+      "rows":             the number of exercise rows read
+    or None on failure. Exercises are grouped by their normalized name (Exercises.exercise_key).
+    Months moved out by Backend.archive_partitions are not included.
+    """
+    key = ("workouts", user_id, "analytics")
+    analytics, version = backend._cache.lookup(key)
+    if analytics is not MISS: return analytics
+    totals = _Accumulator()
+    try:
+        for chunk in stream_exercise_chunks(user_id, chunk_size):
+            totals.add(*chunk)
+        analytics = {
+            "weekly_volume": [
+                (_week_start(week), name, round(volume, 2))
+                for (name, week), volume in sorted(totals.weekly_volume.items(), key=lambda item: (item[0][1], item[0][0]))
+            ],
+            "e1rm_progression": [
+                (_week_start(week), name, round(e1rm, 2))
+                for (name, week), e1rm in sorted(totals.weekly_e1rm.items(), key=lambda item: (item[0][1], item[0][0]))
+                if e1rm > 0
+            ],
+            "personal_records": [
+                (
+                    name,
+                    totals.max_weight[name][0] if name in totals.max_weight else None,
+                    _day(totals.max_weight[name][1]) if name in totals.max_weight else None,
+                    round(totals.best_e1rm[name][0], 2) if name in totals.best_e1rm else None,
+                    _day(totals.best_e1rm[name][1]) if name in totals.best_e1rm else None,
+                    round(totals.total_volume[name], 2),
+                )
+                for name in sorted(totals.total_volume)
+            ],
+            "rows": totals.rows,
+        }
+        backend._cache.store(key, analytics, version)
+        return analytics
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error reading training analytics")
+        return None
+    finally:
+        backend._cache.release(key, version)
@@ -0,0 +1,576 @@
+import asyncio
+import atexit
+import contextlib
+import functools
+import threading
+import time
+import weakref
+
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+import Backend as backend
+from Cache import MISS, SharedCache
+import Instrumentation as instrumentation
+
+# --- ASYNC CONNECTION POOL & EVENT LOOP ---
+# Reads are implemented here, on psycopg's asyncio driver, so a page can gather them
+# concurrently; Backend's read functions are thin wrappers that run these coroutines
+# on the background event loop. Writes are implemented once in Backend, with its
+# transactional helpers, and run here in a worker thread.
+
+class InstrumentedAsyncCursor(psycopg.AsyncCursor):
+    """An async cursor that records the time and row count of every statement."""
+
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            instrumentation.record_statement(query, params, (time.perf_counter() - start) * 1000, self.rowcount)
+
+_pool = None
+_replica_pools = {}   # replica settings -> its pool; Backend.configure_replicas may swap the settings
+# Held while a pool is opened or the pools are closed, so reads gathered on a cold start open one pool
+_pool_lock = asyncio.Lock()
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+_returned_at = weakref.WeakKeyDictionary()   # connection -> when a read last gave it back
+
+async def _check_connection(conn):
+    """Checks a connection before a checkout; like Backend.ConnectionPool, pings only one idle past the interval."""
+    if conn.closed:
+        raise psycopg.OperationalError("the connection is closed")
+    if time.monotonic() - _returned_at.get(conn, 0) >= backend.POOL_HEALTH_CHECK_INTERVAL:
+        await AsyncConnectionPool.check_connection(conn)
+
+async def _open_pool(config, **settings):
+    config = backend._connection_settings(config)
+    config["dbname"] = config.pop("database")
+    settings = dict({
+        "min_size": backend.POOL_MIN_SIZE,
+        "max_size": backend.POOL_MAX_SIZE,
+        "timeout": backend.POOL_CHECKOUT_TIMEOUT,
+    }, **settings)
+    pool = AsyncConnectionPool(
+        make_conninfo(**config),
+        max_lifetime=backend.POOL_MAX_LIFETIME,
+        check=_check_connection,
+        # Only reads run here and all of them are hot, so each is prepared on its first
+        # execution (prepare_threshold=0) instead of psycopg's default fifth. They run in
+        # autocommit: each statement reads its own snapshot, as under READ COMMITTED, and
+        # no BEGIN and COMMIT round trips are spent around it
+        kwargs={
+            "autocommit": True,
+            "cursor_factory": InstrumentedAsyncCursor,
+            "prepare_threshold": 0 if backend.PREPARE_STATEMENTS else None,
+        },
+        open=False,
+        **settings,
+    )
+    await pool.open()
+    return pool
+
+async def get_pool():
+    """Returns the async connection pool, opening it on first use."""
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await _open_pool(backend.DB_CONFIG)
+    return _pool
+
+async def get_replica_pool(index):
+    """Returns the async connection pool of one of Backend.REPLICA_CONFIGS, opening it on first use."""
+    config = dict(backend.DB_CONFIG, connect_timeout=backend.REPLICA_CONNECT_TIMEOUT, **backend.REPLICA_CONFIGS[index])
+    key = tuple(sorted(config.items()))
+    pool = _replica_pools.get(key)
+    if pool is None:
+        async with _pool_lock:
+            pool = _replica_pools.get(key)
+            if pool is None:
+                pool = _replica_pools[key] = await _open_pool(config, min_size=0, timeout=backend.REPLICA_CONNECT_TIMEOUT)
+    return pool
+
+async def close_pool():
+    """Closes the async connection pool and the replica pools; the next read opens them with the current settings."""
+    global _pool
+    async with _pool_lock:
+        pools = [_pool] + list(_replica_pools.values())
+        _pool = None
+        _replica_pools.clear()
+    for pool in pools:
+        if pool:
+            await pool.close()
+
+def reset_pools():
+    """Closes the pools from synchronous code; Backend.close_pool() calls this when the settings change."""
+    if _loop is not None:
+        run(close_pool())
+
+def _get_loop():
+    """Returns the background event loop that owns the pool, starting it on first use."""
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="async-backend", daemon=True)
+            _loop_thread.start()
+            atexit.register(_shutdown)
+        return _loop
+
+def _shutdown():
+    """Closes the pool and stops the background event loop at interpreter exit."""
+    run(close_pool())
+    _loop.call_soon_threadsafe(_loop.stop)
+
+def run(coro):
+    """Runs a coroutine on the backend event loop and returns its result; for synchronous callers.
+
+    The caller's instrumentation request summary follows the coroutine onto the loop.
+    Coroutines on the loop must await each other instead, since this would wait forever there.
+    """
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("AsyncBackend.run() was called from the backend event loop; await the coroutine instead")
+    summary = instrumentation.current_request()
+
+    async def in_request():
+        if summary is not None:
+            instrumentation.attach_request(summary)
+        return await coro
+    return asyncio.run_coroutine_threadsafe(in_request(), _get_loop()).result()
+
+def run_all(*coros):
+    """Runs several coroutines concurrently and returns their results in order; for synchronous callers."""
+    async def gather():
+        return await asyncio.gather(*coros)
+    return run(gather())
+
+def _connection_errors(pool):
+    """Returns how many times a pool has failed to open a connection."""
+    return pool.get_stats().get("connections_errors", 0)
+
+@contextlib.asynccontextmanager
+async def _read_connection(owner=None):
+    """Checks out a connection for read-only queries on behalf of `owner`.
+
+    Routes like Backend.get_read_connection: to a replica in turn, or to the primary
+    when none is healthy or the owner has just written.
+    """
+    index = backend._choose_replica(owner)
+    while True:
+        pool = await get_pool() if index is None else await get_replica_pool(index)
+        errors = _connection_errors(pool)
+        start = time.perf_counter()
+        try:
+            conn = await pool.getconn()
+            break
+        except PoolTimeout as e:
+            if index is None:
+                raise
+            # The pool connects in the background, so a timeout is all a reader sees;
+            # only one the pool failed to connect during is the replica's fault
+            if _connection_errors(pool) > errors:
+                instrumentation.logger.warning("Error connecting to replica %d, reading from another server: %s", index, e)
+                backend._mark_replica_down(index)
+                index = backend._choose_replica(owner)
+            else:
+                backend._count_busy_replica(index, e)
+                index = None
+        finally:
+            instrumentation.record_acquire((time.perf_counter() - start) * 1000)
+    backend._count_read(index)
+    try:
+        yield conn
+    finally:
+        if conn.closed and index is not None:
+            backend._mark_replica_down(index)
+        _returned_at[conn] = time.monotonic()
+        await pool.putconn(conn)
+
+async def _fetch(sql, params, one=False, owner=None):
+    """Executes a read-only statement on behalf of `owner` and returns its rows."""
+    async with _read_connection(owner) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchone() if one else await cur.fetchall()
+
+async def _merge_archived_workouts(user_id, workouts, limit, before):
+    """Backend._merge_archived_workouts, reading the archive files in a worker thread when there are any."""
+    if not backend._load_manifest(backend.ARCHIVE_DIR):
+        return workouts
+    return await asyncio.to_thread(backend._merge_archived_workouts, user_id, workouts, limit, before)
+
+async def _cache_lookup(key):
+    """Backend._cache.lookup; a shared cache can wait on another process's load, so it runs in a worker thread."""
+    if isinstance(backend._cache, SharedCache):
+        return await asyncio.to_thread(backend._cache.lookup, key)
+    return backend._cache.lookup(key)
+
+async def _cache_store(key, value, version):
+    """Backend._cache.store, in a worker thread for a shared cache, whose stores go over the network."""
+    if isinstance(backend._cache, SharedCache):
+        await asyncio.to_thread(backend._cache.store, key, value, version)
+    else:
+        backend._cache.store(key, value, version)
+
+async def _cache_release(key, version):
+    """Backend._cache.release, in a worker thread for a shared cache; call it in a finally after a miss."""
+    if isinstance(backend._cache, SharedCache):
+        await asyncio.to_thread(backend._cache.release, key, version)
+    else:
+        backend._cache.release(key, version)
+
+def _write(func):
+    """Wraps a synchronous Backend write function as a coroutine that runs it in a worker thread."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
+# --- USER PROFILE & FRIENDS (CRUD) ---
+
+create_user = _write(backend.create_user)
+update_user_profile = _write(backend.update_user_profile)
+add_friend = _write(backend.add_friend)
+remove_friend = _write(backend.remove_friend)
+
+@instrumentation.traced
+async def read_user(user_id):
+    """R: Reads a user profile by ID."""
+    key = ("user", user_id)
+    user, version = await _cache_lookup(key)
+    if user is not MISS: return user
+    try:
+        user = await _fetch(backend.USER_BY_ID_SQL, (user_id,), one=True, owner=user_id)
+        if user: await _cache_store(key, user, version)
+        return user
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading user")
+        return None
+    finally:
+        await _cache_release(key, version)
+
+@instrumentation.traced
+async def read_user_by_email(email):
+    """R: Reads a user profile by email."""
+    key = ("user", email)
+    user, version = await _cache_lookup(key)
+    if user is not MISS: return user
+    try:
+        user = await _fetch(backend.USER_BY_EMAIL_SQL, (email,), one=True, owner=email)
+        if user: await _cache_store(key, user, version)
+        return user
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading user")
+        return None
+    finally:
+        await _cache_release(key, version)
+
+@instrumentation.traced
+async def read_friend_ids(user_id, include_self=False):
+    """R: Reads the IDs of a user's friends, optionally with the user's own ID first."""
+    key = ("friends", user_id, "ids", include_self)
+    friend_ids, version = await _cache_lookup(key)
+    if friend_ids is not MISS: return friend_ids
+    try:
+        rows = await _fetch(backend.FRIEND_IDS_SQL + ";", (user_id, user_id), owner=user_id)
+        friend_ids = [row[0] for row in rows]
+        if include_self: friend_ids.insert(0, user_id)
+        await _cache_store(key, friend_ids, version)
+        return friend_ids
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading friend IDs")
+        return []
+    finally:
+        await _cache_release(key, version)
+
+@instrumentation.traced
+async def read_friends(user_id, limit=None, after=None):
+    """R: Reads one page of a user's friends, ordered by user ID.
+
+    Same contract as Backend.read_friends.
+    """
+    key = ("friends", user_id, limit, after)
+    page, version = await _cache_lookup(key)
+    if page is not MISS: return page
+    try:
+        friends = await _fetch(backend.FRIEND_PAGE_SQL, (user_id, after or 0, user_id, after or 0, limit + 1 if limit else None),
+                              owner=user_id)
+        next_cursor = None
+        if limit and len(friends) > limit:
+            friends = friends[:limit]
+            next_cursor = friends[-1][0]
+        page = friends, next_cursor
+        await _cache_store(key, page, version)
+        return page
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading friends")
+        return [], None
+    finally:
+        await _cache_release(key, version)
+
+# --- WORKOUTS & EXERCISES (CRUD) ---
+
+create_workout_with_exercises = _write(backend.create_workout_with_exercises)
+delete_workout = _write(backend.delete_workout)
+bulk_create_workouts = _write(backend.bulk_create_workouts)
+
+@instrumentation.traced
+async def read_workouts(user_id, limit=None, before=None):
+    """R: Reads one page of a user's workouts, newest first.
+
+    Same contract as Backend.read_workouts.
+    """
+    key = ("workouts", user_id, limit, before)
+    page, version = await _cache_lookup(key)
+    if page is not MISS: return page
+    try:
+        if before:
+            workouts = await _fetch(
+                backend.WORKOUT_PAGE_BEFORE_SQL,
+                (user_id, before[0], before[0], before[1], limit + 1 if limit else None), owner=user_id
+            )
+        else:
+            workouts = await _fetch(
+                backend.WORKOUT_PAGE_SQL,
+                (user_id, limit + 1 if limit else None), owner=user_id
+            )
+        workouts = await _merge_archived_workouts(user_id, workouts, limit, before)
+        next_cursor = None
+        if limit and len(workouts) > limit:
+            workouts = workouts[:limit]
+            next_cursor = (workouts[-1][1], workouts[-1][0])
+        page = workouts, next_cursor
+        await _cache_store(key, page, version)
+        return page
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading workouts")
+        return [], None
+    finally:
+        await _cache_release(key, version)
+
+@instrumentation.traced
+async def read_exercises_for_workout(workout_id, user_id=None):
+    """R: Reads exercises for a specific workout.
+
+    Same contract as Backend.read_exercises_for_workout.
+    """
+    try:
+        exercises = await _fetch(
+            backend.WORKOUT_EXERCISES_SQL,
+            (workout_id,), owner=user_id
+        )
+        if not exercises and backend._load_manifest(backend.ARCHIVE_DIR):
+            exercises = (await asyncio.to_thread(backend._read_archived_exercises, [workout_id])).get(workout_id, [])
+        return exercises
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading exercises")
+        return []
+
+@instrumentation.traced
+async def read_workout_history(user_id, limit=20, before=None):
+    """R: Reads one page of a user's workout history with each workout's exercises nested.
+
+    Same contract as Backend.read_workout_history.
+    """
+    key = ("workouts", user_id, "history", limit, before)
+    page, version = await _cache_lookup(key)
+    if page is not MISS: return page
+    try:
+        async with _read_connection(user_id) as conn:
+            async with conn.cursor() as cur:
+                if before:
+                    await cur.execute(backend.WORKOUT_PAGE_BEFORE_SQL, (user_id, before[0], before[0], before[1], limit + 1))
+                else:
+                    await cur.execute(backend.WORKOUT_PAGE_SQL, (user_id, limit + 1))
+                workouts = await _merge_archived_workouts(user_id, await cur.fetchall(), limit, before)
+                # One row past the page says whether an older page exists
+                next_cursor = None
+                if len(workouts) > limit:
+                    workouts = workouts[:limit]
+                    next_cursor = (workouts[-1][1], workouts[-1][0])
+                exercises = {workout[0]: [] for workout in workouts}
+                if exercises:
+                    await cur.execute(backend.WORKOUT_PAGE_EXERCISES_SQL, (list(exercises), workouts[-1][1], workouts[0][1]))
+                    for workout_id, name, sets, reps, weight in await cur.fetchall():
+                        exercises[workout_id].append((name, sets, reps, weight))
+        missing = [workout for workout in workouts if not exercises[workout[0]]]
+        if missing and backend._load_manifest(backend.ARCHIVE_DIR):
+            exercises.update(await asyncio.to_thread(
+                backend._read_archived_exercises,
+                [workout[0] for workout in missing], {backend._month_start(workout[1]) for workout in missing}
+            ))
+        page = [(workout_id, date, duration, exercises[workout_id]) for workout_id, date, duration in workouts], next_cursor
+        await _cache_store(key, page, version)
+        return page
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading workout history")
+        return [], None
+    finally:
+        await _cache_release(key, version)
+
+@instrumentation.traced
+async def read_personal_records(user_id, exercise_name=None):
+    """R: Reads a user's per-exercise totals and personal records, or those of one exercise.
+
+    Same contract as Backend.read_personal_records.
+    """
+    exercise_key = backend.normalize_exercise_name(exercise_name) if exercise_name is not None else None
+    key = ("workouts", user_id, "records", exercise_key)
+    records, version = await _cache_lookup(key)
+    if records is not MISS: return records
+    try:
+        if exercise_key is None:
+            records = await _fetch(
+                backend.PERSONAL_RECORDS_SQL,
+                (user_id,), owner=user_id
+            )
+        else:
+            records = await _fetch(
+                backend.EXERCISE_RECORDS_SQL,
+                (user_id, exercise_key), owner=user_id
+            )
+        await _cache_store(key, records, version)
+        return records
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading personal records")
+        return []
+    finally:
+        await _cache_release(key, version)
+
+# --- GOALS (CRUD) ---
+
+create_goal = _write(backend.create_goal)
+update_goal = _write(backend.update_goal)
+delete_goal = _write(backend.delete_goal)
+evaluate_goals = _write(backend.evaluate_goals)
+
+@instrumentation.traced
+async def read_goals(user_id, limit=None, after=None):
+    """R: Reads one page of a user's goals, open ones first, then by end date.
+
+    Same contract as Backend.read_goals.
+    """
+    key = ("goals", user_id, limit, after)
+    page, version = await _cache_lookup(key)
+    if page is not MISS: return page
+    try:
+        if after:
+            goals = await _fetch(
+                backend.GOAL_PAGE_AFTER_SQL,
+                (user_id, after[0], after[1], after[2], limit + 1 if limit else None), owner=user_id
+            )
+        else:
+            goals = await _fetch(
+                backend.GOAL_PAGE_SQL,
+                (user_id, limit + 1 if limit else None), owner=user_id
+            )
+        next_cursor = None
+        if limit and len(goals) > limit:
+            goals = goals[:limit]
+            next_cursor = (goals[-1][3], goals[-1][6], goals[-1][0])
+        page = goals, next_cursor
+        await _cache_store(key, page, version)
+        return page
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading goals")
+        return [], None
+    finally:
+        await _cache_release(key, version)
+
+# --- LEADERBOARDS ---
+
+@instrumentation.traced
+async def read_leaderboard(user_id, period="week", periods_ago=0, scope="friends", limit=None):
+    """R: Reads a leaderboard by workout minutes as [(rank, user_id, name, total_minutes)].
+
+    Same contract as Backend.read_leaderboard.
+    """
+    if scope not in backend.LEADERBOARD_SCOPES:
+        raise ValueError(f"scope must be one of {backend.LEADERBOARD_SCOPES}, not {scope!r}")
+    first_day, last_day = backend.leaderboard_window(period, periods_ago)
+    if scope == "global":
+        limit = limit or backend.LEADERBOARD_TOP_K
+    key = ("leaderboard", user_id if scope == "friends" else "global", scope, period, first_day, limit)
+    leaderboard, version = await _cache_lookup(key)
+    if leaderboard is not MISS: return leaderboard
+    try:
+        if scope == "friends":
+            leaderboard = await _fetch(
+                backend.FRIENDS_LEADERBOARD_SQL + ";",
+                (user_id, user_id, user_id, backend._rollup_period(period), first_day, last_day, limit), owner=user_id
+            )
+        else:
+            leaderboard = await _fetch(backend.GLOBAL_LEADERBOARD_SQL + ";", (period, first_day, limit), owner=user_id)
+        await _cache_store(key, leaderboard, version)
+        return leaderboard
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading leaderboard")
+        return []
+    finally:
+        await _cache_release(key, version)
+
+@instrumentation.traced
+async def read_leaderboard_rank(user_id, period="week", periods_ago=0, scope="global"):
+    """R: Reads a user's place on a leaderboard as (rank, total_minutes, ranked_of, ranked_at).
+
+    Same contract as Backend.read_leaderboard_rank.
+    """
+    if scope not in backend.LEADERBOARD_SCOPES:
+        raise ValueError(f"scope must be one of {backend.LEADERBOARD_SCOPES}, not {scope!r}")
+    if scope == "friends":
+        return backend._friends_place(user_id, await read_leaderboard(user_id, period, periods_ago, "friends"))
+    first_day, _ = backend.leaderboard_window(period, periods_ago)
+    key = ("leaderboard", user_id, "rank", period, first_day)
+    place, version = await _cache_lookup(key)
+    if place is not MISS: return place
+    try:
+        place = await _fetch(backend.GLOBAL_LEADERBOARD_RANK_SQL + ";", (user_id, period, first_day), one=True, owner=user_id)
+        await _cache_store(key, place, version)
+        return place
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading leaderboard rank")
+        return None
+    finally:
+        await _cache_release(key, version)
+
+# --- ACTIVITY FEED ---
+
+@instrumentation.traced
+async def read_activity_feed(user_id, limit=backend.FEED_PAGE_SIZE, before=None):
+    """R: Reads one page of a user's friends' workouts as (workout_id, workout_date, user_id, name, duration_minutes).
+
+    Same contract as Backend.read_activity_feed.
+    """
+    key = ("feed", user_id, limit, before)
+    page, version = await _cache_lookup(key)
+    if page is not MISS: return page
+    try:
+        async with _read_connection(user_id) as conn:
+            async with conn.cursor() as cur:
+                cursor = tuple(before) if before else backend.FEED_NEWEST
+                await cur.execute(backend.INBOX_HORIZON_SQL, (user_id,))
+                inbox = await cur.fetchone()
+                feed = []
+                if inbox:
+                    horizon = backend.FEED_OLDEST if inbox[0] is None else inbox
+                    if cursor > horizon:
+                        await cur.execute(backend.INBOX_FEED_SQL + ";", (user_id, cursor[0], cursor[1], horizon[0], horizon[1], limit + 1))
+                        feed = await cur.fetchall()
+                    cursor = min(cursor, horizon)
+                if len(feed) <= limit and cursor > backend.FEED_OLDEST:
+                    wanted = limit + 1 - len(feed)
+                    await cur.execute(backend.FRIENDS_FEED_SQL + ";", (user_id, user_id, cursor[0], cursor[0], cursor[1], wanted, wanted))
+                    feed += await cur.fetchall()
+        page = backend._feed_page(feed, limit)
+        await _cache_store(key, page, version)
+        return page
+    except psycopg.Error:
+        instrumentation.logger.exception("Error reading activity feed")
+        return [], None
+    finally:
+        await _cache_release(key, version)
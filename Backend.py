@@ -1,31 +1,680 @@
 import psycopg2
+from psycopg2.pool import PoolError
+import csv
 import datetime
+import decimal
+import gzip
+import io
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from Cache import LRUCache, SharedCache, open_store
+import Instrumentation as instrumentation
 
 # --- DATABASE CONNECTION & HELPER FUNCTIONS ---
+# Defaults for a local development database; see CONFIGURATION below for overriding
+# them (and the settings that follow) from a file or the environment.
+DB_CONFIG = {
+    "host": "localhost",
+    "database": "Personal Fitness Tracker",
+    "user": "postgres",
+    "password": "1234",
+    "port": "5432",
+}
+
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+POOL_CHECKOUT_TIMEOUT = 10.0       # seconds a caller waits for a free connection
+POOL_HEALTH_CHECK_INTERVAL = 30.0  # idle seconds after which a checkout pings the connection
+POOL_MAX_LIFETIME = 3600.0         # seconds before a connection is recycled
+
+STATEMENT_TIMEOUT_MS = 30000       # the server cancels statements running longer; 0 disables
+APPLICATION_NAME = "fitness-tracker"  # shown in pg_stat_activity and the server logs
+PREPARE_STATEMENTS = True          # prepare hot statements once per connection (see PREPARED STATEMENTS)
+CURSOR_ITERSIZE = 2000             # rows per round trip for server-side cursors
+
+# Queue logged workouts in QUEUE_PATH instead of writing them while the user waits (see WRITE-BEHIND SUBMISSIONS)
+WRITE_BEHIND = False
+QUEUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queue", "workouts.sqlite3")
+# Share the read-through cache between processes: redis://host:6379/0 or a SQLite file
+# path for processes on one host; empty keeps a cache per process (see READ-THROUGH CACHE)
+CACHE_URL = ""
+
+
+class ConnectionPool:
+    """A thread-safe pool of reusable database connections.
+
+    `connect` is any zero-argument callable returning a DB-API connection, so the
+    pool can be pointed at a local Postgres or an in-process stand-in.
+    """
+
+    def __init__(self, connect, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 timeout=POOL_CHECKOUT_TIMEOUT, health_check_interval=POOL_HEALTH_CHECK_INTERVAL,
+                 max_lifetime=POOL_MAX_LIFETIME):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1.")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.max_lifetime = max_lifetime
+        self._cond = threading.Condition()
+        self._idle = []      # (conn, returned_at); the most recently returned is checked out first
+        self._born = {}      # id(conn) -> creation time
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_discarded": 0,
+            "failed_health_checks": 0,
+            "checkout_time_total": 0.0,
+            "checkout_time_max": 0.0,
+        }
+        for _ in range(min_size):
+            with self._cond:
+                self._size += 1
+            self._idle.append((self._open(), time.monotonic()))
+
+    def _open(self):
+        """Opens a new physical connection; the caller has already reserved a slot."""
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self._stats["connections_created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        """Closes a connection and frees its slot in the pool."""
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._size -= 1
+            self._stats["connections_discarded"] += 1
+            self._cond.notify()
+
+    def _is_healthy(self, conn, returned_at):
+        """Checks an idle connection before handing it out."""
+        if conn.closed:
+            return False
+        if time.monotonic() - self._born.get(id(conn), 0) > self.max_lifetime:
+            return False
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._stats["failed_health_checks"] += 1
+            return False
+
+    def getconn(self):
+        """Checks out a connection, waiting up to `timeout` seconds for one to be free."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("connection pool is closed")
+                    if self._idle:
+                        conn, returned_at = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn, returned_at = None, None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolError(f"timed out after {self.timeout}s waiting for a connection")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if conn is None:
+                conn = self._open()
+            elif not self._is_healthy(conn, returned_at):
+                self._discard(conn)
+                continue
+
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self._stats["checkouts"] += 1
+                self._stats["checkout_time_total"] += elapsed
+                self._stats["checkout_time_max"] = max(self._stats["checkout_time_max"], elapsed)
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """Returns a connection to the pool, recycling it if it is broken."""
+        if discard or conn.closed or self._closed:
+            self._discard(conn)
+            return
+        try:
+            # Never hand out a connection with a half-finished transaction.
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        """Closes every idle connection; checked-out ones are closed when returned."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        """Returns a snapshot of the pool metrics."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+            })
+        stats["checkout_time_avg"] = (
+            stats["checkout_time_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        )
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# id(conn) -> (replica index, or None for the primary, pool) for every connection on loan,
+# so it goes back to the pool it came from even if close_pool() or configure() replaced it
+_checked_out = {}
+
+def _connection_settings(config):
+    """Adds the session settings every connection starts with to DB_CONFIG-style settings."""
+    settings = dict(config, application_name=APPLICATION_NAME)
+    if STATEMENT_TIMEOUT_MS:
+        settings["options"] = f"-c statement_timeout={int(STATEMENT_TIMEOUT_MS)}"
+    return settings
+
+def _connect():
+    """Opens a new physical connection whose cursors record every statement."""
+    return psycopg2.connect(connection_factory=PreparingConnection, cursor_factory=PreparingCursor,
+                            **_connection_settings(DB_CONFIG))
+
+def _pool_settings(**overrides):
+    """The current POOL_* settings, which configure() may have changed since ConnectionPool was defined."""
+    return dict({
+        "min_size": POOL_MIN_SIZE,
+        "max_size": POOL_MAX_SIZE,
+        "timeout": POOL_CHECKOUT_TIMEOUT,
+        "health_check_interval": POOL_HEALTH_CHECK_INTERVAL,
+        "max_lifetime": POOL_MAX_LIFETIME,
+    }, **overrides)
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(_connect, **_pool_settings())
+        return _pool
+
+def configure_pool(connect=None, **settings):
+    """Replaces the process-wide pool, e.g. to change its size or point it at a stand-in database."""
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, ConnectionPool(connect or _connect, **_pool_settings(**settings))
+    if old:
+        old.close()
+    return _pool
+
+def close_pool():
+    """Closes the process-wide pool and the replica pools, and AsyncBackend's pools if it is loaded."""
+    global _pool, _replicas
+    with _pool_lock:
+        old, _pool = _pool, None
+    with _replica_lock:
+        replicas, _replicas = _replicas, None
+    for pool in [old] + (replicas or []):
+        if pool:
+            pool.close()
+    _reset_async_pools()
+
+def _reset_async_pools():
+    """Closes AsyncBackend's pools, which read the same settings, so its next read reopens them."""
+    # While AsyncBackend is still importing this module it has no pools and no reset_pools yet
+    reset_pools = getattr(sys.modules.get("AsyncBackend"), "reset_pools", None)
+    if reset_pools is not None:
+        reset_pools()
+
 def get_db_connection():
-    """Establishes and returns a connection to the PostgreSQL database."""
+    """Checks out a pooled connection to the PostgreSQL database."""
+    start = time.perf_counter()
     try:
-        conn = psycopg2.connect(
-            host="localhost",
-            database="Personal Fitness Tracker",
-            user="postgres",
-            password="1234",
-            port="5432"
-        )
+        pool = get_pool()
+        conn = pool.getconn()
+        _checked_out[id(conn)] = (None, pool)
         return conn
-    except psycopg2.Error as e:
-        print(f"Error connecting to the database: {e}")
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error connecting to the database")
         return None
+    finally:
+        instrumentation.record_acquire((time.perf_counter() - start) * 1000)
 
 def close_db_connection(conn, cursor):
-    """Closes the database connection and cursor."""
+    """Closes the cursor and returns the connection to the pool it came from."""
     if cursor:
         cursor.close()
     if conn:
-        conn.close()
+        index, pool = _checked_out.pop(id(conn), (None, None))
+        if pool is None:
+            pool = get_pool()
+        elif index is not None and conn.closed:
+            # The replica dropped the connection mid-read
+            _mark_replica_down(index)
+        pool.putconn(conn)
+
+# --- READ REPLICAS ---
+# Read-only functions can be served by streaming replicas of the primary, taken in
+# turn. Writes mark the cache owners they touch (user IDs and emails, see _invalidate),
+# and reads on behalf of those owners stay on the primary for READ_YOUR_WRITES_WINDOW
+# seconds so a replica that has not replayed the write yet cannot hide it. The window
+# is per process, like the cache, and should exceed the replicas' usual lag.
+
+REPLICA_CONFIGS = []             # DB_CONFIG overrides per replica, e.g. [{"port": "5433"}]
+READ_YOUR_WRITES_WINDOW = 5.0    # seconds an owner's reads stay on the primary after a write
+REPLICA_RETRY_INTERVAL = 30.0    # seconds a failed replica is skipped before it is tried again
+REPLICA_CONNECT_TIMEOUT = 2      # seconds to wait for a replica before reading from another server
+
+_replicas = None                 # one ConnectionPool per entry of REPLICA_CONFIGS
+_replica_lock = threading.Lock()
+_replica_down_until = {}         # replica index -> when it may be tried again
+_recent_writes = {}              # cache owner -> when it was last written
+_next_replica = itertools.count()
+_routing_stats = {
+    "primary_reads": 0,
+    "replica_reads": 0,
+    "sticky_reads": 0,
+    "replica_failures": 0,
+    "replica_busy": 0,
+}
+
+def _replica_connect(config):
+    settings = _connection_settings(dict(DB_CONFIG, connect_timeout=REPLICA_CONNECT_TIMEOUT, **config))
+    return lambda: psycopg2.connect(connection_factory=PreparingConnection, cursor_factory=PreparingCursor, **settings)
+
+def get_replica_pools():
+    """Returns one connection pool per configured replica, creating them on first use."""
+    global _replicas
+    with _replica_lock:
+        if _replicas is None:
+            # min_size=0, so a replica that is down at startup only costs its reads a fallback
+            _replicas = [ConnectionPool(_replica_connect(config), **_pool_settings(min_size=0)) for config in REPLICA_CONFIGS]
+        return _replicas
+
+def configure_replicas(configs, **settings):
+    """Routes reads to a new set of replicas, given as DB_CONFIG overrides; [] reads from the primary again."""
+    global _replicas
+    settings = _pool_settings(**dict({"min_size": 0}, **settings))
+    pools = [ConnectionPool(_replica_connect(config), **settings) for config in configs]
+    with _replica_lock:
+        REPLICA_CONFIGS[:] = configs
+        old, _replicas = _replicas, pools
+        _replica_down_until.clear()
+    for pool in old or []:
+        pool.close()
+    _reset_async_pools()
+    return pools
+
+def _note_writes(owners):
+    """Keeps the owners' reads on the primary for the next READ_YOUR_WRITES_WINDOW seconds."""
+    if not REPLICA_CONFIGS:
+        return
+    now = time.monotonic()
+    with _replica_lock:
+        for owner in owners:
+            _recent_writes[owner] = now
+        if len(_recent_writes) > 4096:
+            for owner, written_at in list(_recent_writes.items()):
+                if now - written_at >= READ_YOUR_WRITES_WINDOW:
+                    del _recent_writes[owner]
+
+def _choose_replica(owner=None):
+    """Picks the replica that should serve a read on behalf of `owner`, or None for the primary."""
+    pools = get_replica_pools()
+    if not pools:
+        return None
+    now = time.monotonic()
+    with _replica_lock:
+        written_at = _recent_writes.get(owner)
+        if written_at is not None and now - written_at < READ_YOUR_WRITES_WINDOW:
+            _routing_stats["sticky_reads"] += 1
+            return None
+        first = next(_next_replica)
+        for offset in range(len(pools)):
+            index = (first + offset) % len(pools)
+            if _replica_down_until.get(index, 0) <= now:
+                return index
+    return None
+
+def _mark_replica_down(index):
+    """Sends reads elsewhere for REPLICA_RETRY_INTERVAL seconds after a replica failed."""
+    with _replica_lock:
+        _replica_down_until[index] = time.monotonic() + REPLICA_RETRY_INTERVAL
+        _routing_stats["replica_failures"] += 1
+
+def _count_busy_replica(index, error):
+    """Notes a read that found a replica's pool exhausted; the replica is not down, so it stays in turn."""
+    instrumentation.logger.warning("No free connection on replica %d, reading from the primary: %s", index, error)
+    with _replica_lock:
+        _routing_stats["replica_busy"] += 1
+
+def _count_read(index):
+    with _replica_lock:
+        _routing_stats["primary_reads" if index is None else "replica_reads"] += 1
+
+def get_read_connection(owner=None):
+    """Checks out a connection for read-only queries on behalf of `owner` (a user ID or email).
+
+    Returns a replica connection unless no replica is configured and healthy or the
+    owner wrote within READ_YOUR_WRITES_WINDOW, in which case it returns a primary one.
+    A replica that cannot be reached is skipped for REPLICA_RETRY_INTERVAL; one whose
+    pool is exhausted only sends this read to the primary.
+    """
+    while True:
+        index = _choose_replica(owner)
+        if index is None:
+            _count_read(None)
+            return get_db_connection()
+        pool = get_replica_pools()[index]
+        start = time.perf_counter()
+        conn = None
+        try:
+            conn = pool.getconn()
+        except PoolError as e:
+            # Timed out waiting for a free connection, or the pool was closed by configure()
+            _count_busy_replica(index, e)
+        except psycopg2.Error as e:
+            instrumentation.logger.warning("Error connecting to replica %d, reading from another server: %s", index, e)
+            _mark_replica_down(index)
+            continue
+        finally:
+            instrumentation.record_acquire((time.perf_counter() - start) * 1000)
+        if conn is None:
+            _count_read(None)
+            return get_db_connection()
+        _checked_out[id(conn)] = (index, pool)
+        _count_read(index)
+        return conn
+
+def replica_stats():
+    """Returns how reads were routed, and which replicas are currently skipped."""
+    now = time.monotonic()
+    with _replica_lock:
+        stats = dict(_routing_stats)
+        stats["replicas"] = len(REPLICA_CONFIGS)
+        stats["replicas_down"] = sorted(index for index, until in _replica_down_until.items() if until > now)
+    return stats
+
+# --- CONFIGURATION ---
+# The connection and session settings above can be overridden from a JSON file and
+# from environment variables, which win over the file:
+#
+#     {"host": "db.internal", "password": "...", "pool_max_size": 20, "statement_timeout_ms": 5000}
+#     FITNESS_DB_HOST=db.internal FITNESS_POOL_MAX_SIZE=20 streamlit run Frontend.py
+#
+# The file is named by FITNESS_CONFIG. Both are read once when Backend is imported;
+# scripts call configure(**load_config(path)) to use another file.
+
+CONFIG_FILE_ENV = "FITNESS_CONFIG"
+
+# Setting -> (environment variable, type). Database settings go to DB_CONFIG, the
+# others replace the module setting of the same name in capitals.
+CONFIG_SETTINGS = {
+    "host": ("FITNESS_DB_HOST", str),
+    "port": ("FITNESS_DB_PORT", str),
+    "database": ("FITNESS_DB_NAME", str),
+    "user": ("FITNESS_DB_USER", str),
+    "password": ("FITNESS_DB_PASSWORD", str),
+    "statement_timeout_ms": ("FITNESS_STATEMENT_TIMEOUT_MS", int),
+    "application_name": ("FITNESS_APPLICATION_NAME", str),
+    "pool_min_size": ("FITNESS_POOL_MIN_SIZE", int),
+    "pool_max_size": ("FITNESS_POOL_MAX_SIZE", int),
+    "pool_checkout_timeout": ("FITNESS_POOL_CHECKOUT_TIMEOUT", float),
+    "pool_health_check_interval": ("FITNESS_POOL_HEALTH_CHECK_INTERVAL", float),
+    "pool_max_lifetime": ("FITNESS_POOL_MAX_LIFETIME", float),
+    "prepare_statements": ("FITNESS_PREPARE_STATEMENTS", bool),
+    "cursor_itersize": ("FITNESS_CURSOR_ITERSIZE", int),
+    "write_behind": ("FITNESS_WRITE_BEHIND", bool),
+    "queue_path": ("FITNESS_QUEUE_PATH", str),
+    "cache_url": ("FITNESS_CACHE_URL", str),
+}
+DB_SETTINGS = ("host", "port", "database", "user", "password")
+
+def _parse_setting(name, value):
+    kind = CONFIG_SETTINGS[name][1]
+    if kind is bool and isinstance(value, str):
+        if value.strip().lower() not in ("1", "true", "yes", "on", "0", "false", "no", "off"):
+            raise ValueError(f"{name} must be true or false, not {value!r}")
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return kind(value)
+
+def load_config(path=None, environ=None):
+    """Reads the settings from a JSON file (default: the one named by FITNESS_CONFIG) and the environment.
+
+    Returns {setting: value} holding only what was set, ready for configure().
+    Raises ValueError for unknown settings or values of the wrong type.
+    """
+    environ = os.environ if environ is None else environ
+    path = path or environ.get(CONFIG_FILE_ENV)
+    config = {}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            config.update(json.load(f))
+    for name, (variable, _) in CONFIG_SETTINGS.items():
+        if variable in environ:
+            config[name] = environ[variable]
+    unknown = sorted(set(config) - set(CONFIG_SETTINGS))
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(unknown)}")
+    return {name: _parse_setting(name, value) for name, value in config.items()}
+
+def configure(**settings):
+    """Applies settings from load_config() (or given by hand) and reopens the pools with them.
+
+    AsyncBackend reads the same settings when its own pool is opened.
+    """
+    unknown = sorted(set(settings) - set(CONFIG_SETTINGS))
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(unknown)}")
+    if not settings:
+        return
+    for name, value in settings.items():
+        if name in DB_SETTINGS:
+            DB_CONFIG[name] = value
+        else:
+            globals()[name.upper()] = value
+    # Open pools, here and in AsyncBackend, hold connections made with the old settings
+    close_pool()
+    # When Backend is imported the cache is created after this, with the new URL already
+    if "cache_url" in settings and "_cache" in globals():
+        configure_cache()
+
+# --- PREPARED STATEMENTS & SERVER-SIDE CURSORS ---
+# The statements behind every page load and every logged workout are run with
+# cur.execute_prepared: their first use on a connection PREPAREs them, later uses only
+# EXECUTE, so Postgres skips parsing and, once it settles on a generic plan, planning.
+# Prepared statements belong to the session and survive rollbacks, so each connection
+# keeps the set it has prepared. Turn PREPARE_STATEMENTS off behind a transaction-mode
+# PgBouncer, where consecutive statements may reach different sessions.
+
+_prepared_names = {}             # SQL text -> its statement name, the same on every connection
+_prepared_lock = threading.Lock()
+_PARAMETER = re.compile(r"%%|%s")
+_cursor_names = itertools.count(1)
+
+def _prepared_name(sql):
+    with _prepared_lock:
+        if sql not in _prepared_names:
+            _prepared_names[sql] = f"fitness_stmt_{len(_prepared_names) + 1}"
+        return _prepared_names[sql]
+
+def _as_prepared_body(sql):
+    """Rewrites a statement's %s placeholders as $1, $2, ... for PREPARE."""
+    count = itertools.count(1)
+    return _PARAMETER.sub(lambda match: "%" if match.group() == "%%" else f"${next(count)}", sql)
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """A connection that remembers which statements have been prepared on it."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+class PreparingCursor(instrumentation.InstrumentedCursor):
+    """An instrumented cursor that can run hot statements as prepared statements."""
+
+    def execute_prepared(self, query, vars=()):
+        """Executes `query` (positional %s parameters only) through a statement prepared once per connection.
+
+        Statistics are recorded under `query` itself rather than the EXECUTE.
+        """
+        if not PREPARE_STATEMENTS:
+            return self.execute(query, vars)
+        name = _prepared_name(query)
+        if name not in self.connection.prepared:
+            self.execute(f"PREPARE {name} AS {_as_prepared_body(query)}")
+            self.connection.prepared.add(name)
+        arguments = f" ({', '.join(['%s'] * len(vars))})" if vars else ""
+        return self.execute_as(f"EXECUTE {name}{arguments};", query, vars)
+
+def server_cursor(conn, itersize=None):
+    """Opens a server-side (named) cursor that fetches `itersize` rows per round trip as it is iterated.
+
+    Use it for reads whose size grows with a user's history, so the client holds one
+    batch at a time instead of the whole result. It lives inside conn's transaction.
+    """
+    cur = conn.cursor(name=f"fitness_cursor_{next(_cursor_names)}")
+    cur.itersize = itersize or CURSOR_ITERSIZE
+    return cur
+
+def stream_rows(sql, params=None, owner=None, itersize=None):
+    """R: Yields the rows of a large read-only query as they arrive, through a server-side cursor.
+
+    Reads on behalf of `owner` like every other read, and holds the connection until
+    the generator is exhausted or closed. Errors are raised to the caller, since a
+    stream that silently stopped would look complete.
+    """
+    conn, cur = None, None
+    try:
+        conn = get_read_connection(owner)
+        if not conn:
+            raise psycopg2.OperationalError("no database connection available")
+        cur = server_cursor(conn, itersize)
+        cur.execute(sql, params)
+        yield from cur
+    finally:
+        close_db_connection(conn, cur)
+
+configure(**load_config())
+
+# --- READ-THROUGH CACHE ---
+# Each process caches in memory by default. Several processes serving the app (e.g.
+# Streamlit processes behind a load balancer, which keeps each session on one of them)
+# share one cache when CACHE_URL is set:
+#
+#     FITNESS_CACHE_URL=redis://localhost:6379/0 streamlit run Frontend.py --server.port 8501
+#     FITNESS_CACHE_URL=redis://localhost:6379/0 streamlit run Frontend.py --server.port 8502
+#
+# Writes then invalidate an owner's entries for every process, and a hot key that
+# expires is reloaded by one caller while the others wait for it (see Cache.SharedCache).
+
+CACHE_MAX_ENTRIES = 2048
+# Seconds an entry of each namespace may be served before it is read again
+CACHE_TTLS = {
+    "user": 300,
+    "friends": 120,
+    "goals": 120,
+    "workouts": 60,
+    "leaderboard": 60,
+    "feed": 60,
+}
+
+def configure_cache(max_entries=CACHE_MAX_ENTRIES, ttls=None, url=None):
+    """Replaces the read-through cache; max_entries=0 disables caching.
+
+    With a `url` (default: the CACHE_URL setting) the cache lives in that shared
+    store and max_entries only decides whether to cache at all.
+    """
+    global _cache
+    url = CACHE_URL if url is None else url
+    ttls = dict(CACHE_TTLS, **(ttls or {}))
+    if url and max_entries > 0:
+        _cache = SharedCache(open_store(url), ttls)
+    else:
+        _cache = LRUCache(max_entries, ttls)
+    return _cache
+
+_cache = configure_cache()
+
+def cache_stats():
+    """Returns the cache's hit/miss counters, for sizing it."""
+    return _cache.stats()
+
+def _invalidate(namespaces, owners):
+    """Drops the cached entries of every owner in every namespace.
+
+    Writes call this after they commit, so it also keeps the owners' reads off the
+    replicas until those have caught up.
+    """
+    _note_writes(owners)
+    _cache.invalidate_many(namespaces, owners)
+
+def _read_member_ids(cur, user_id):
+    """Reads a user's ID plus their friends' IDs inside the caller's transaction."""
+    cur.execute_prepared(MEMBER_IDS_SQL + ";", (user_id, user_id, user_id))
+    return [row[0] for row in cur.fetchall()]
+
+# --- READS ---
+# Every read is implemented once, as a coroutine in AsyncBackend, so pages can gather
+# them. The read functions here are thin wrappers that run it on AsyncBackend's event
+# loop and pool and wait for the result, for callers that are not async themselves.
+
+def _run_async(name, *args):
+    """Runs AsyncBackend's coroutine function `name` with `args` and returns its result."""
+    import AsyncBackend as async_backend   # it imports this module, so only once both are loaded
+    return async_backend.run(getattr(async_backend, name)(*args))
 
 # --- USER PROFILE & FRIENDS (CRUD) ---
 
+@instrumentation.traced
 def create_user(name, email, weight):
     """C: Creates a new user profile."""
     conn, cur = None, None
@@ -39,29 +688,28 @@ def create_user(name, email, weight):
         )
         user_id = cur.fetchone()[0]
         conn.commit()
+        _note_writes([user_id, email])
         return user_id
-    except psycopg2.Error as e:
-        print(f"Error creating user: {e}")
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error creating user")
         if conn: conn.rollback()
         return None
     finally:
         close_db_connection(conn, cur)
 
+# A user profile by ID, or by email
+USER_BY_ID_SQL = "SELECT user_id, name, email, weight_kg FROM Users WHERE user_id = %s;"
+USER_BY_EMAIL_SQL = "SELECT user_id, name, email, weight_kg FROM Users WHERE email = %s;"
+
+def read_user(user_id):
+    """R: Reads a user profile by ID."""
+    return _run_async("read_user", user_id)
+
 def read_user_by_email(email):
     """R: Reads a user profile by email."""
-    conn, cur = None, None
-    try:
-        conn = get_db_connection()
-        if not conn: return None
-        cur = conn.cursor()
-        cur.execute("SELECT user_id, name, email, weight_kg FROM Users WHERE email = %s;", (email,))
-        return cur.fetchone()
-    except psycopg2.Error as e:
-        print(f"Error reading user: {e}")
-        return None
-    finally:
-        close_db_connection(conn, cur)
+    return _run_async("read_user_by_email", email)
 
+@instrumentation.traced
 def update_user_profile(user_id, name, email, weight):
     """U: Updates an existing user profile."""
     conn, cur = None, None
@@ -70,18 +718,27 @@ def update_user_profile(user_id, name, email, weight):
         if not conn: return False
         cur = conn.cursor()
         cur.execute(
-            "UPDATE Users SET name = %s, email = %s, weight_kg = %s WHERE user_id = %s;",
+            "UPDATE Users U SET name = %s, email = %s, weight_kg = %s FROM Users old WHERE U.user_id = %s AND old.user_id = U.user_id RETURNING old.email;",
             (name, email, weight, user_id)
         )
+        old = cur.fetchone()
+        if not old:
+            conn.rollback()
+            return False
+        # Friends see the new name in their friends lists, leaderboards and feeds
+        member_ids = _read_member_ids(cur, user_id)
         conn.commit()
-        return cur.rowcount > 0
-    except psycopg2.Error as e:
-        print(f"Error updating user profile: {e}")
+        _invalidate(["user"], [user_id, old[0], email])
+        _invalidate(["friends", "leaderboard", "feed"], member_ids)
+        return True
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error updating user profile")
         if conn: conn.rollback()
         return False
     finally:
         close_db_connection(conn, cur)
 
+@instrumentation.traced
 def add_friend(user_id, friend_email):
     """C: Adds a new friend connection."""
     conn, cur = None, None
@@ -100,33 +757,51 @@ def add_friend(user_id, friend_email):
             "INSERT INTO Friends (user_id_1, user_id_2) VALUES (%s, %s);",
             (id1, id2)
         )
+        _link_inboxes(cur, id1, id2)
         conn.commit()
+        _invalidate(["friends", "leaderboard", "feed"], [id1, id2])
         return True
-    except psycopg2.Error as e:
-        print(f"Error adding friend: {e}")
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error adding friend")
         if conn: conn.rollback()
         return False
     finally:
         close_db_connection(conn, cur)
 
-def read_friends(user_id):
-    """R: Reads all friends of a user."""
-    conn, cur = None, None
-    try:
-        conn = get_db_connection()
-        if not conn: return []
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT U.user_id, U.name, U.email FROM Friends F JOIN Users U ON F.user_id_1 = U.user_id OR F.user_id_2 = U.user_id WHERE (F.user_id_1 = %s OR F.user_id_2 = %s) AND U.user_id != %s;",
-            (user_id, user_id, user_id)
-        )
-        return cur.fetchall()
-    except psycopg2.Error as e:
-        print(f"Error reading friends: {e}")
-        return []
-    finally:
-        close_db_connection(conn, cur)
+# Friendships are stored once with the smaller ID first, so a user's friends are the
+# union of both directions. Each branch is a plain equality lookup served by its own
+# index (UNIQUE (user_id_1, user_id_2) and friends_user2_idx), unlike an OR join.
+FRIEND_IDS_SQL = "SELECT user_id_2 AS friend_id FROM Friends WHERE user_id_1 = %s UNION ALL SELECT user_id_1 FROM Friends WHERE user_id_2 = %s"
+# The user plus their friends; takes the user ID three times.
+MEMBER_IDS_SQL = f"SELECT %s AS member_id UNION ALL {FRIEND_IDS_SQL}"
+# One page of friends in ID order after a given friend ID; takes (user_id, after) twice, then the limit.
+# Each branch is an ordered range scan of its index, so a page costs the same at any depth.
+FRIEND_PAGE_SQL = """
+    SELECT U.user_id, U.name, U.email
+    FROM (
+        SELECT user_id_2 AS friend_id FROM Friends WHERE user_id_1 = %s AND user_id_2 > %s
+        UNION ALL
+        SELECT user_id_1 FROM Friends WHERE user_id_2 = %s AND user_id_1 > %s
+        ORDER BY friend_id
+        LIMIT %s
+    ) F
+    JOIN Users U ON U.user_id = F.friend_id
+    ORDER BY U.user_id;
+"""
+
+def read_friend_ids(user_id, include_self=False):
+    """R: Reads the IDs of a user's friends, optionally with the user's own ID first."""
+    return _run_async("read_friend_ids", user_id, include_self)
+
+def read_friends(user_id, limit=None, after=None):
+    """R: Reads one page of a user's friends as (user_id, name, email), ordered by user ID.
 
+    Returns (friends, next_cursor). Pass next_cursor back as `after` for the
+    following page; it is None on the last page. `limit=None` reads every friend.
+    """
+    return _run_async("read_friends", user_id, limit, after)
+
+@instrumentation.traced
 def remove_friend(user_id, friend_id):
     """D: Deletes a friend connection."""
     conn, cur = None, None
@@ -140,158 +815,925 @@ def remove_friend(user_id, friend_id):
             "DELETE FROM Friends WHERE user_id_1 = %s AND user_id_2 = %s;",
             (id1, id2)
         )
+        removed = cur.rowcount > 0
+        _unlink_inboxes(cur, id1, id2)
         conn.commit()
-        return cur.rowcount > 0
-    except psycopg2.Error as e:
-        print(f"Error removing friend: {e}")
+        _invalidate(["friends", "leaderboard", "feed"], [id1, id2])
+        return removed
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error removing friend")
         if conn: conn.rollback()
         return False
     finally:
         close_db_connection(conn, cur)
 
+# --- WORKOUT MINUTES ROLLUP ---
+
+# Windows kept in WorkoutMinutesRollup; each is a valid date_trunc() field. Rolling
+# leaderboard windows are summed from the 'day' rows, which are only kept for the last
+# DAY_ROLLUP_DAYS days (older ones are skipped by writes and pruned by refresh_leaderboards).
+ROLLUP_PERIODS = ("day", "week", "month")
+DAY_ROLLUP_DAYS = 92
+
+MINUTES_ROLLUP_SQL = """
+    INSERT INTO WorkoutMinutesRollup (user_id, period, period_start, total_minutes, workout_count)
+    SELECT W.user_id, P.period, date_trunc(P.period, W.workout_date)::date,
+           %s * COALESCE(SUM(W.duration_minutes), 0), %s * COUNT(*)
+    FROM unnest(%s::int[], %s::date[], %s::int[]) AS W (user_id, workout_date, duration_minutes)
+    CROSS JOIN unnest(%s::text[]) AS P (period)
+    WHERE P.period <> 'day' OR W.workout_date >= %s
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (user_id, period, period_start) DO UPDATE
+    SET total_minutes = WorkoutMinutesRollup.total_minutes + EXCLUDED.total_minutes,
+        workout_count = WorkoutMinutesRollup.workout_count + EXCLUDED.workout_count;
+"""
+
+def _minutes_rollup_params(workouts, sign):
+    """Builds the MINUTES_ROLLUP_SQL parameters for a list of (user_id, workout_date, duration_minutes)."""
+    user_ids, dates, durations = (list(column) for column in zip(*workouts))
+    # Imported and queued workouts carry ISO date strings, which the prepared statement's date[] refuses
+    dates = [datetime.date.fromisoformat(date) if isinstance(date, str) else date for date in dates]
+    return (sign, sign, user_ids, dates, durations, list(ROLLUP_PERIODS), _day_rollup_cutoff())
+
+def _day_rollup_cutoff():
+    """Returns the first day whose 'day' rollup rows are kept."""
+    return datetime.date.today() - datetime.timedelta(days=DAY_ROLLUP_DAYS - 1)
+
+def _update_minutes_rollup(cur, workouts, sign=1):
+    """Adds (sign=1) or subtracts (sign=-1) workouts' minutes in the rollup, inside the caller's transaction.
+
+    `workouts` is a list of (user_id, workout_date, duration_minutes) tuples.
+    """
+    if not workouts:
+        return
+    cur.execute_prepared(MINUTES_ROLLUP_SQL, _minutes_rollup_params(workouts, sign))
+
+# --- EXERCISE STATS ---
+
+# The SQL function trims only these, but its \s+ also collapses vertical tabs and form feeds.
+# Other Unicode spaces and letters follow the database's LC_CTYPE, so only ASCII names are
+# guaranteed to get the same key here.
+_SQL_TRIMMED = " \t\r\n"
+_SQL_WHITESPACE = re.compile(r"[ \t\n\r\v\f]+")
+_PLURAL_S = re.compile(r"([^s])s$")
+
+def normalize_exercise_name(name):
+    """Mirrors the SQL normalize_exercise_name() behind Exercises.exercise_key: "  Back  Squats " -> "back squat"."""
+    return _PLURAL_S.sub(r"\1", _SQL_WHITESPACE.sub(" ", name.strip(_SQL_TRIMMED)).lower())
+
+EXERCISE_STATS_COLUMNS = """
+    user_id, exercise_key, exercise_name, entry_count, total_sets, total_reps, total_volume,
+    best_weight_kg, best_weight_date, best_e1rm_kg, best_e1rm_date, last_performed
+"""
+
+# ExerciseStats rows for the exercises matching {where}, aggregated per (user_id, exercise_key).
+# The display name is the alphabetically first spelling; ties on a record keep the earliest date.
+EXERCISE_STATS_SELECT = r"""
+    SELECT W.user_id, E.exercise_key, MIN(regexp_replace(btrim(E.exercise_name), '\s+', ' ', 'g')), COUNT(*),
+           COALESCE(SUM(E.sets), 0), COALESCE(SUM(E.sets * E.reps), 0), COALESCE(SUM(E.sets * E.reps * E.weight_kg), 0),
+           MAX(E.weight_kg) FILTER (WHERE E.weight_kg > 0),
+           (array_agg(W.workout_date ORDER BY E.weight_kg DESC, W.workout_date) FILTER (WHERE E.weight_kg > 0))[1],
+           MAX(X.e1rm),
+           (array_agg(W.workout_date ORDER BY X.e1rm DESC, W.workout_date) FILTER (WHERE X.e1rm IS NOT NULL))[1],
+           MAX(W.workout_date)
+    FROM Exercises E
+    JOIN Workouts W ON W.workout_id = E.workout_id AND W.workout_date = E.workout_date
+    CROSS JOIN LATERAL (
+        SELECT CASE WHEN E.weight_kg > 0 AND E.reps > 1 THEN round(E.weight_kg * (1 + E.reps / 30.0), 2)
+                    WHEN E.weight_kg > 0 AND E.reps = 1 THEN E.weight_kg END AS e1rm
+    ) X
+    WHERE {where}
+    GROUP BY W.user_id, E.exercise_key
+"""
+
+# Folds stats rows from {select} into {table}: totals add up, records keep the better value
+FOLD_EXERCISE_STATS_SQL = """
+    INSERT INTO {table} AS S ({columns})
+    {select}
+    ORDER BY 1, 2
+    ON CONFLICT (user_id, exercise_key) DO UPDATE
+    SET exercise_name = LEAST(S.exercise_name, EXCLUDED.exercise_name),
+        entry_count = S.entry_count + EXCLUDED.entry_count,
+        total_sets = S.total_sets + EXCLUDED.total_sets,
+        total_reps = S.total_reps + EXCLUDED.total_reps,
+        total_volume = S.total_volume + EXCLUDED.total_volume,
+        best_weight_kg = GREATEST(S.best_weight_kg, EXCLUDED.best_weight_kg),
+        best_weight_date = CASE
+            WHEN S.best_weight_kg IS NULL OR EXCLUDED.best_weight_kg > S.best_weight_kg THEN EXCLUDED.best_weight_date
+            WHEN EXCLUDED.best_weight_kg = S.best_weight_kg THEN LEAST(S.best_weight_date, EXCLUDED.best_weight_date)
+            ELSE S.best_weight_date END,
+        best_e1rm_kg = GREATEST(S.best_e1rm_kg, EXCLUDED.best_e1rm_kg),
+        best_e1rm_date = CASE
+            WHEN S.best_e1rm_kg IS NULL OR EXCLUDED.best_e1rm_kg > S.best_e1rm_kg THEN EXCLUDED.best_e1rm_date
+            WHEN EXCLUDED.best_e1rm_kg = S.best_e1rm_kg THEN LEAST(S.best_e1rm_date, EXCLUDED.best_e1rm_date)
+            ELSE S.best_e1rm_date END,
+        last_performed = GREATEST(S.last_performed, EXCLUDED.last_performed);
+"""
+
+# Folds newly inserted workouts into the stats. The date range lets Postgres prune the
+# monthly partitions while executing the prepared statement (it cannot from the IDs or
+# from "= ANY" of dates), and the IDs on both sides keep the join on the primary keys.
+ADD_EXERCISE_STATS_SQL = FOLD_EXERCISE_STATS_SQL.format(
+    table="ExerciseStats", columns=EXERCISE_STATS_COLUMNS,
+    select=EXERCISE_STATS_SELECT.format(
+        where="E.workout_id = ANY(%s) AND W.workout_id = ANY(%s)"
+              " AND E.workout_date BETWEEN %s AND %s AND W.workout_date BETWEEN %s AND %s"
+    ),
+)
+
+# Stats recomputed from the live exercises matching {where} plus the archived totals
+# matching {archived_where}, so months moved out by archive_partitions still count.
+MERGED_EXERCISE_STATS_SELECT = f"""
+    SELECT user_id, exercise_key, MIN(exercise_name), SUM(entry_count), SUM(total_sets), SUM(total_reps), SUM(total_volume),
+           MAX(best_weight_kg),
+           (array_agg(best_weight_date ORDER BY best_weight_kg DESC, best_weight_date) FILTER (WHERE best_weight_kg IS NOT NULL))[1],
+           MAX(best_e1rm_kg),
+           (array_agg(best_e1rm_date ORDER BY best_e1rm_kg DESC, best_e1rm_date) FILTER (WHERE best_e1rm_kg IS NOT NULL))[1],
+           MAX(last_performed)
+    FROM ({EXERCISE_STATS_SELECT}
+          UNION ALL
+          SELECT {EXERCISE_STATS_COLUMNS} FROM ArchivedExerciseStats WHERE {{archived_where}}) S ({EXERCISE_STATS_COLUMNS})
+    GROUP BY user_id, exercise_key
+"""
+
+def _add_exercise_stats(cur, workout_ids, workout_dates):
+    """Folds the exercises of newly inserted workouts into ExerciseStats, inside the caller's transaction."""
+    if workout_ids:
+        dates = [datetime.date.fromisoformat(date) if isinstance(date, str) else date for date in workout_dates]
+        first, last = min(dates), max(dates)
+        cur.execute_prepared(ADD_EXERCISE_STATS_SQL, (list(workout_ids), list(workout_ids), first, last, first, last))
+
+def _recompute_exercise_stats(cur, user_id, exercise_keys):
+    """Recomputes a user's stats for some exercises from their remaining rows, e.g. after a delete.
+
+    Records cannot be "subtracted", so affected keys are rebuilt rather than adjusted.
+    """
+    if not exercise_keys:
+        return
+    select = MERGED_EXERCISE_STATS_SELECT.format(
+        where="W.user_id = %s AND E.exercise_key = ANY(%s)", archived_where="user_id = %s AND exercise_key = ANY(%s)"
+    )
+    cur.execute("DELETE FROM ExerciseStats WHERE user_id = %s AND exercise_key = ANY(%s);", (user_id, list(exercise_keys)))
+    cur.execute(f"INSERT INTO ExerciseStats ({EXERCISE_STATS_COLUMNS}) {select};", (user_id, list(exercise_keys)) * 2)
+
+def _rebuild_exercise_stats(cur, user_id=None):
+    """Recomputes ExerciseStats from scratch for one user or everyone; returns the number of rows written."""
+    if user_id is None:
+        cur.execute("DELETE FROM ExerciseStats;")
+        select = MERGED_EXERCISE_STATS_SELECT.format(where="TRUE", archived_where="TRUE")
+        cur.execute(f"INSERT INTO ExerciseStats ({EXERCISE_STATS_COLUMNS}) {select};")
+    else:
+        cur.execute("DELETE FROM ExerciseStats WHERE user_id = %s;", (user_id,))
+        select = MERGED_EXERCISE_STATS_SELECT.format(where="W.user_id = %s", archived_where="user_id = %s")
+        cur.execute(f"INSERT INTO ExerciseStats ({EXERCISE_STATS_COLUMNS}) {select};", (user_id, user_id))
+    return cur.rowcount
+
+@instrumentation.traced
+def rebuild_exercise_stats(user_id=None):
+    """U: Recomputes the exercise stats of one user, or of everyone, from the Exercises table and the archived totals.
+
+    Returns the number of stats rows written, or None on failure.
+    """
+    conn, cur = None, None
+    try:
+        conn = get_db_connection()
+        if not conn: return None
+        cur = conn.cursor()
+        rows = _rebuild_exercise_stats(cur, user_id)
+        conn.commit()
+        if user_id is None:
+            _cache.invalidate_namespace("workouts")
+        else:
+            _invalidate(["workouts"], [user_id])
+        return rows
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error rebuilding exercise stats")
+        if conn: conn.rollback()
+        return None
+    finally:
+        close_db_connection(conn, cur)
+
+# A user's stats rows, of every exercise or of one exercise key
+PERSONAL_RECORDS_SQL = "SELECT exercise_name, entry_count, total_volume, best_weight_kg, best_weight_date, best_e1rm_kg, best_e1rm_date, last_performed FROM ExerciseStats WHERE user_id = %s ORDER BY exercise_key;"
+EXERCISE_RECORDS_SQL = "SELECT exercise_name, entry_count, total_volume, best_weight_kg, best_weight_date, best_e1rm_kg, best_e1rm_date, last_performed FROM ExerciseStats WHERE user_id = %s AND exercise_key = %s;"
+
+def read_personal_records(user_id, exercise_name=None):
+    """R: Reads a user's per-exercise totals and personal records, or those of one exercise.
+
+    Returns [(exercise_name, entry_count, total_volume, best_weight_kg, best_weight_date,
+    best_e1rm_kg, best_e1rm_date, last_performed)], read from the maintained ExerciseStats
+    table so the cost does not grow with the number of logged exercises.
+    """
+    return _run_async("read_personal_records", user_id, exercise_name)
+
+# --- PARTITIONS & ARCHIVE ---
+# Workouts and Exercises are partitioned by month of workout_date (see
+# migrations/0007_partition_workouts.sql). Months are created ahead of time by
+# ensure_partitions and on demand by writers. Months older than ARCHIVE_AFTER_MONTHS
+# can be moved by archive_partitions into gzipped CSV files listed in a manifest.
+# Workout history reads merge those files back in. ExerciseStats, the week and month
+# minutes rollups and goal progress keep counting archived workouts: goal evaluation
+# adds Goals.archived_progress, folded in as each month is archived, to what it counts
+# in the database. Analytics and activity feeds only see the months still in the
+# database, and archived workouts cannot be deleted.
+
+PARTITION_MONTHS_AHEAD = 3     # months of empty partitions kept ready beyond the current one
+ARCHIVE_AFTER_MONTHS = 24      # months of history kept in the database by archive_partitions
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive")
+ARCHIVE_MANIFEST = "manifest.json"
+
+_PARTITION_NAME = re.compile(r"^workouts_(\d{4})_(\d{2})$")
+_partition_months = set()      # months this process has seen partitions for, so writes skip the check
+_archive_manifest = {}         # directory -> (mtime, manifest), reloaded when the file changes
+
+ARCHIVED_WORKOUT_COLUMNS = ("workout_id", "user_id", "workout_date", "duration_minutes", "created_at")
+ARCHIVED_EXERCISE_COLUMNS = ("exercise_id", "workout_id", "workout_date", "exercise_name", "sets", "reps", "weight_kg")
+
+def _month_start(value):
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value)
+    return datetime.date(value.year, value.month, 1)
+
+def _add_months(month, months):
+    month_index = month.year * 12 + month.month - 1 + months
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+def _ensure_partitions(conn, cur, dates):
+    """Creates the monthly partitions that workouts on `dates` need, before the caller's transaction starts.
+
+    Creating a partition locks the parent tables, so it is committed on its own
+    rather than held for the length of the caller's write.
+    """
+    missing = {_month_start(date) for date in dates} - _partition_months
+    if missing:
+        cur.execute("SELECT create_workout_partitions(%s, %s);", (min(missing), max(missing)))
+        conn.commit()
+        _partition_months.update(missing)
+
+def _live_partition_months(cur):
+    """Returns the months that have partitions in the database, oldest first."""
+    cur.execute("SELECT C.relname FROM pg_inherits I JOIN pg_class C ON C.oid = I.inhrelid WHERE I.inhparent = 'workouts'::regclass;")
+    months = []
+    for (name,) in cur.fetchall():
+        match = _PARTITION_NAME.match(name)
+        if match:
+            months.append(datetime.date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+@instrumentation.traced
+def ensure_partitions(months_ahead=PARTITION_MONTHS_AHEAD):
+    """C: Creates the partitions of the current month and the next `months_ahead` months.
+
+    Returns the number of months created, or None on failure.
+    """
+    conn, cur = None, None
+    try:
+        conn = get_db_connection()
+        if not conn: return None
+        cur = conn.cursor()
+        first = _month_start(datetime.date.today())
+        cur.execute("SELECT create_workout_partitions(%s, %s);", (first, _add_months(first, months_ahead)))
+        created = cur.fetchone()[0]
+        conn.commit()
+        return created
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error creating partitions")
+        if conn: conn.rollback()
+        return None
+    finally:
+        close_db_connection(conn, cur)
+
+def _load_manifest(directory):
+    """Returns the archive manifest of `directory`: {"YYYY-MM": [part, ...]}, oldest part first."""
+    path = os.path.join(directory, ARCHIVE_MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    cached = _archive_manifest.get(directory)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)["months"]
+    _archive_manifest[directory] = (mtime, manifest)
+    return manifest
+
+def _write_manifest(directory, manifest):
+    """Replaces the manifest atomically, so readers never see a half-written one."""
+    path = os.path.join(directory, ARCHIVE_MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"format": "csv.gz", "months": manifest}, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+def _copy_to_gzip(cur, sql, path):
+    """Streams a query's rows into a gzipped CSV file with a header; returns the row count."""
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8", newline="") as f:
+        cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER);", f)
+        rows = cur.rowcount
+    os.replace(path + ".tmp", path)
+    return rows
+
+@instrumentation.traced
+def archive_partitions(keep_months=ARCHIVE_AFTER_MONTHS, directory=ARCHIVE_DIR):
+    """D: Moves every month older than `keep_months` months out of the database into gzipped CSV files.
+
+    Each month is written to workouts_YYYY_MM_N.csv.gz (sorted by user, newest first)
+    and exercises_YYYY_MM_N.csv.gz (sorted by workout). Its stats are folded into
+    ArchivedExerciseStats and its goal progress into Goals.archived_progress, it is listed in the manifest, and its partitions are
+    dropped, all in one transaction per month. N counts parts, because a workout
+    logged later into an archived month recreates that month's partition.
+    Returns the archived months, or None on failure; months archived before the
+    failure are kept.
+    """
+    conn, cur = None, None
+    archived = []
+    manifest = None
+    try:
+        conn = get_db_connection()
+        if not conn: return None
+        cur = conn.cursor()
+        os.makedirs(directory, exist_ok=True)
+        cutoff = _add_months(_month_start(datetime.date.today()), -keep_months)
+        for month in [month for month in _live_partition_months(cur) if month < cutoff]:
+            suffix, label, end = month.strftime("%Y_%m"), month.strftime("%Y-%m"), _add_months(month, 1)
+            manifest = dict(_load_manifest(directory))
+            parts = list(manifest.get(label, []))
+            # Writes to the month wait until it is gone; reads carry on
+            cur.execute(f"LOCK TABLE workouts_{suffix}, exercises_{suffix} IN SHARE MODE;")
+            part = {
+                "workouts": f"workouts_{suffix}_{len(parts)}.csv.gz",
+                "exercises": f"exercises_{suffix}_{len(parts)}.csv.gz",
+                "archived_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            }
+            part["workout_rows"] = _copy_to_gzip(
+                cur,
+                f"SELECT {', '.join(ARCHIVED_WORKOUT_COLUMNS)} FROM workouts_{suffix} ORDER BY user_id, workout_date DESC, workout_id DESC",
+                os.path.join(directory, part["workouts"])
+            )
+            part["exercise_rows"] = _copy_to_gzip(
+                cur,
+                f"SELECT {', '.join(ARCHIVED_EXERCISE_COLUMNS)} FROM exercises_{suffix} ORDER BY workout_id, exercise_id",
+                os.path.join(directory, part["exercises"])
+            )
+            cur.execute(f"SELECT MIN(workout_id), MAX(workout_id) FROM workouts_{suffix};")
+            part["first_workout_id"], part["last_workout_id"] = cur.fetchone()
+            cur.execute(
+                FOLD_EXERCISE_STATS_SQL.format(
+                    table="ArchivedExerciseStats", columns=EXERCISE_STATS_COLUMNS,
+                    select=EXERCISE_STATS_SELECT.format(where="E.workout_date >= %s AND E.workout_date < %s"),
+                ),
+                (month, end)
+            )
+            cur.execute(FOLD_GOAL_PROGRESS_SQL, (end, month, month, end))
+            _write_manifest(directory, dict(manifest, **{label: parts + [part]}))
+            cur.execute("DELETE FROM FeedItems WHERE workout_date >= %s AND workout_date < %s;", (month, end))
+            # A partition the Exercises foreign key points at must be detached before it can go
+            cur.execute(f"DROP TABLE exercises_{suffix};")
+            cur.execute(f"ALTER TABLE Workouts DETACH PARTITION workouts_{suffix};")
+            cur.execute(f"DROP TABLE workouts_{suffix};")
+            conn.commit()
+            manifest = None
+            _partition_months.discard(month)
+            archived.append(label)
+            instrumentation.logger.info("Archived %s: %d workouts, %d exercises", label, part["workout_rows"], part["exercise_rows"])
+        return archived
+    except (psycopg2.Error, OSError):
+        instrumentation.logger.exception("Error archiving partitions (archived so far: %s)", archived)
+        if conn: conn.rollback()
+        # The month being archived is still in the database; take it back out of the manifest
+        if manifest is not None:
+            _write_manifest(directory, manifest)
+        return None
+    finally:
+        close_db_connection(conn, cur)
+
+def _read_archive_csv(directory, filename):
+    with gzip.open(os.path.join(directory, filename), "rt", encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f)
+
+def _parse_archived_workout(row):
+    duration = row["duration_minutes"]
+    return int(row["workout_id"]), datetime.date.fromisoformat(row["workout_date"]), int(duration) if duration else None
+
+def _merge_archived_workouts(user_id, workouts, limit, before, directory=ARCHIVE_DIR):
+    """Merges a user's archived workouts into a page of (workout_id, date, duration) read from the database.
+
+    `workouts` holds up to limit + 1 rows after `before`. Only archived months the
+    page can reach are read, so pages of recent history never touch the files.
+    """
+    manifest = _load_manifest(directory)
+    if not manifest:
+        return workouts
+    # The page reaches down to its last database row, or to the beginning if the database ran out
+    lowest = workouts[-1][1] if limit and len(workouts) > limit else None
+    archived = []
+    for label in sorted(manifest, reverse=True):
+        month = datetime.date.fromisoformat(label + "-01")
+        if before and month > before[0]:
+            continue
+        if lowest and _add_months(month, 1) <= lowest:
+            break
+        for part in manifest[label]:
+            for row in _read_archive_csv(directory, part["workouts"]):
+                row_user = int(row["user_id"])
+                if row_user < user_id:
+                    continue
+                if row_user > user_id:
+                    break
+                workout = _parse_archived_workout(row)
+                if not before or (workout[1], workout[0]) < tuple(before):
+                    archived.append(workout)
+        # Older months cannot reach a page that the newer ones already filled
+        if limit and len(archived) > limit:
+            break
+    if not archived:
+        return workouts
+    merged = sorted(workouts + archived, key=lambda workout: (workout[1], workout[0]), reverse=True)
+    return merged[:limit + 1] if limit else merged
+
+def _read_archived_exercises(workout_ids, months=None, directory=ARCHIVE_DIR):
+    """Reads the exercises of archived workouts.
+
+    Returns {workout_id: [(exercise_name, sets, reps, weight_kg)]} in exercise_id order.
+    Pass the workouts' `months` when they are known; otherwise every part whose
+    workout ID range holds a wanted ID is read.
+    """
+    exercises = {}
+    for label, parts in _load_manifest(directory).items():
+        if months is not None and datetime.date.fromisoformat(label + "-01") not in months:
+            continue
+        for part in parts:
+            if part["first_workout_id"] is None:
+                continue
+            wanted = {w for w in workout_ids if part["first_workout_id"] <= w <= part["last_workout_id"]}
+            if not wanted:
+                continue
+            # The file is sorted by workout, so stop after the last wanted one
+            last_wanted = max(wanted)
+            for row in _read_archive_csv(directory, part["exercises"]):
+                workout_id = int(row["workout_id"])
+                if workout_id > last_wanted:
+                    break
+                if workout_id in wanted:
+                    exercises.setdefault(workout_id, []).append((
+                        row["exercise_name"],
+                        int(row["sets"]) if row["sets"] else None,
+                        int(row["reps"]) if row["reps"] else None,
+                        decimal.Decimal(row["weight_kg"]) if row["weight_kg"] else None,
+                    ))
+    return exercises
+
 # --- WORKOUTS & EXERCISES (CRUD) ---
 
-def create_workout_with_exercises(user_id, workout_date, duration_minutes, exercises):
-    """C: Creates a new workout and its associated exercises in a single transaction."""
+# One page of a user's workouts, newest first; takes the user ID and the page size plus
+# one. The next page also takes the cursor's date twice and its workout ID after the user
+# ID; the bare date bound lets Postgres skip the partitions of later months.
+WORKOUT_PAGE_SQL = "SELECT workout_id, workout_date, duration_minutes FROM Workouts WHERE user_id = %s ORDER BY workout_date DESC, workout_id DESC LIMIT %s;"
+WORKOUT_PAGE_BEFORE_SQL = "SELECT workout_id, workout_date, duration_minutes FROM Workouts WHERE user_id = %s AND workout_date <= %s AND (workout_date, workout_id) < (%s, %s) ORDER BY workout_date DESC, workout_id DESC LIMIT %s;"
+WORKOUT_EXERCISES_SQL = "SELECT exercise_name, sets, reps, weight_kg FROM Exercises WHERE workout_id = %s;"
+# The exercises of every workout on a page in one batch; the page's first and last dates
+# let Postgres skip the partitions of other months
+WORKOUT_PAGE_EXERCISES_SQL = "SELECT workout_id, exercise_name, sets, reps, weight_kg FROM Exercises WHERE workout_id = ANY(%s) AND workout_date BETWEEN %s AND %s ORDER BY workout_id, exercise_id;"
+# The stats keys a workout's exercises fed, noted before deleting it
+WORKOUT_EXERCISE_KEYS_SQL = "SELECT DISTINCT exercise_key FROM Exercises WHERE workout_id = %s;"
+
+@instrumentation.traced
+def create_workout_with_exercises(user_id, workout_date, duration_minutes, exercises, submission_key=None):
+    """C: Creates a new workout and its associated exercises in a single transaction.
+
+    With a `submission_key` (see WRITE-BEHIND SUBMISSIONS), a workout whose key was
+    already written is not written again and counts as logged.
+    """
     conn, cur = None, None
     try:
         conn = get_db_connection()
         if not conn: return False
         cur = conn.cursor()
-        cur.execute(
+        _ensure_partitions(conn, cur, [workout_date])
+        cur.execute_prepared(
             "INSERT INTO Workouts (user_id, workout_date, duration_minutes) VALUES (%s, %s, %s) RETURNING workout_id;",
             (user_id, workout_date, duration_minutes)
         )
         workout_id = cur.fetchone()[0]
+        # A submission sent twice (a resent form, a retried request) is logged once
+        if submission_key and not _claim_submission_keys(cur, [{'key': submission_key, 'user_id': user_id, 'workout_id': workout_id}]):
+            conn.rollback()
+            return True
 
         for exercise in exercises:
-            cur.execute(
-                "INSERT INTO Exercises (workout_id, exercise_name, sets, reps, weight_kg) VALUES (%s, %s, %s, %s, %s);",
-                (workout_id, exercise['name'], exercise['sets'], exercise['reps'], exercise['weight'])
+            cur.execute_prepared(
+                "INSERT INTO Exercises (workout_id, workout_date, exercise_name, sets, reps, weight_kg) VALUES (%s, %s, %s, %s, %s, %s);",
+                (workout_id, workout_date, exercise['name'], exercise['sets'], exercise['reps'], exercise['weight'])
             )
 
+        _update_minutes_rollup(cur, [(user_id, workout_date, duration_minutes)])
+        _add_exercise_stats(cur, [workout_id], [workout_date])
+        _fan_out_workouts(cur, [(user_id, workout_date, workout_id, duration_minutes)])
+        _evaluate_goals(cur, [user_id])
+        member_ids = _read_member_ids(cur, user_id)
         conn.commit()
+        # The new minutes show up on the leaderboards of the user and every friend, and the workout in their feeds
+        _invalidate(["workouts", "goals"], [user_id])
+        _invalidate(["leaderboard", "feed"], member_ids)
         return True
-    except psycopg2.Error as e:
-        print(f"Error logging workout: {e}")
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error logging workout")
         if conn: conn.rollback()
         return False
     finally:
         close_db_connection(conn, cur)
 
-def read_workouts(user_id):
-    """R: Reads a user's workout history."""
+def read_workouts(user_id, limit=None, before=None):
+    """R: Reads one page of a user's workouts as (workout_id, date, duration), newest first.
+
+    Returns (workouts, next_cursor). Pass next_cursor back as `before` for the
+    following page; it is None on the last page. `limit=None` reads every workout.
+    """
+    return _run_async("read_workouts", user_id, limit, before)
+
+def read_exercises_for_workout(workout_id, user_id=None):
+    """R: Reads exercises for a specific workout, from the archive if its month was archived.
+
+    Pass the owner's `user_id` so the read sees a workout they just logged.
+    """
+    return _run_async("read_exercises_for_workout", workout_id, user_id)
+
+def read_workout_history(user_id, limit=20, before=None):
+    """R: Reads one page of a user's workout history with each workout's exercises nested.
+
+    Pages are keyed on (workout_date, workout_id), newest first. Pass the returned
+    cursor as `before` to fetch the next, older page; it is None on the last page.
+    Returns ([(workout_id, workout_date, duration_minutes, exercises), ...], cursor),
+    reading the exercises of the whole page in one batched query.
+    """
+    return _run_async("read_workout_history", user_id, limit, before)
+
+@instrumentation.traced
+def delete_workout(workout_id):
+    """D: Deletes a workout and all its exercises (due to ON DELETE CASCADE)."""
     conn, cur = None, None
     try:
         conn = get_db_connection()
-        if not conn: return []
+        if not conn: return False
         cur = conn.cursor()
+        # The exercises disappear with the workout, so note which stats they fed first
+        cur.execute(WORKOUT_EXERCISE_KEYS_SQL, (workout_id,))
+        exercise_keys = [row[0] for row in cur.fetchall()]
         cur.execute(
-            "SELECT workout_id, workout_date, duration_minutes FROM Workouts WHERE user_id = %s ORDER BY workout_date DESC;",
-            (user_id,)
+            "DELETE FROM Workouts WHERE workout_id = %s RETURNING user_id, workout_date, duration_minutes;",
+            (workout_id,)
         )
-        return cur.fetchall()
-    except psycopg2.Error as e:
-        print(f"Error reading workouts: {e}")
-        return []
+        deleted = cur.fetchall()
+        if not deleted:
+            conn.rollback()
+            return False
+        _update_minutes_rollup(cur, deleted, sign=-1)
+        user_id = deleted[0][0]
+        _recompute_exercise_stats(cur, user_id, exercise_keys)
+        cur.execute(DELETE_FEED_ITEMS_SQL, (user_id, workout_id))
+        _evaluate_goals(cur, [user_id])
+        member_ids = _read_member_ids(cur, user_id)
+        conn.commit()
+        _invalidate(["workouts", "goals"], [user_id])
+        _invalidate(["leaderboard", "feed"], member_ids)
+        return True
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error deleting workout")
+        if conn: conn.rollback()
+        return False
     finally:
         close_db_connection(conn, cur)
 
-def read_exercises_for_workout(workout_id):
-    """R: Reads exercises for a specific workout."""
+# --- BULK WORKOUT IMPORT ---
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_CSV_COLUMNS = ("workout_ref", "user_id", "workout_date", "duration_minutes", "exercise_name", "sets", "reps", "weight_kg")
+
+def _copy_text(value):
+    """Formats one value for PostgreSQL's COPY text format."""
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def _write_copy_row(buf, values):
+    """Appends one tab-separated COPY row to an in-memory buffer."""
+    buf.write("\t".join(_copy_text(value) for value in values))
+    buf.write("\n")
+
+def _copy_workout_batch(cur, batch):
+    """Writes a batch of workouts and their exercises with COPY FROM STDIN; returns the new workout IDs."""
+    # Reserve every workout ID of the batch in one round trip so exercises can reference them
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence('workouts', 'workout_id')) FROM generate_series(1, %s);",
+        (len(batch),)
+    )
+    workout_ids = [row[0] for row in cur.fetchall()]
+
+    workouts_buf, exercises_buf = io.StringIO(), io.StringIO()
+    for workout_id, workout in zip(workout_ids, batch):
+        _write_copy_row(workouts_buf, (workout_id, workout['user_id'], workout['workout_date'], workout['duration_minutes']))
+        for exercise in workout.get('exercises', ()):
+            _write_copy_row(exercises_buf, (workout_id, workout['workout_date'], exercise['name'], exercise['sets'], exercise['reps'], exercise['weight']))
+
+    workouts_buf.seek(0)
+    cur.copy_expert("COPY Workouts (workout_id, user_id, workout_date, duration_minutes) FROM STDIN;", workouts_buf)
+    exercises_buf.seek(0)
+    cur.copy_expert("COPY Exercises (workout_id, workout_date, exercise_name, sets, reps, weight_kg) FROM STDIN;", exercises_buf)
+
+    _update_minutes_rollup(cur, [(w['user_id'], w['workout_date'], w['duration_minutes']) for w in batch])
+    _add_exercise_stats(cur, workout_ids, [workout['workout_date'] for workout in batch])
+    _fan_out_workouts(cur, [(w['user_id'], w['workout_date'], workout_id, w['duration_minutes'])
+                            for workout_id, w in zip(workout_ids, batch)])
+    return workout_ids
+
+@instrumentation.traced
+def bulk_create_workouts(workouts, batch_size=IMPORT_BATCH_SIZE):
+    """C: Bulk-inserts many workouts with their exercises, committing every `batch_size` workouts.
+
+    `workouts` is any iterable (it is consumed lazily) of dicts shaped like
+    {'user_id', 'workout_date', 'duration_minutes', 'exercises': [{'name', 'sets', 'reps', 'weight'}]}.
+    Returns the number of workouts imported, or None if a batch failed; batches
+    committed before the failure are kept.
+    """
     conn, cur = None, None
+    imported = 0
     try:
         conn = get_db_connection()
-        if not conn: return []
+        if not conn: return None
         cur = conn.cursor()
-        cur.execute(
-            "SELECT exercise_name, sets, reps, weight_kg FROM Exercises WHERE workout_id = %s;",
-            (workout_id,)
-        )
-        return cur.fetchall()
-    except psycopg2.Error as e:
-        print(f"Error reading exercises: {e}")
-        return []
+        workouts = iter(workouts)
+        while True:
+            batch = list(itertools.islice(workouts, batch_size))
+            if not batch:
+                break
+            _ensure_partitions(conn, cur, [workout['workout_date'] for workout in batch])
+            _copy_workout_batch(cur, batch)
+            user_ids = list({workout['user_id'] for workout in batch})
+            _evaluate_goals(cur, user_ids)
+            conn.commit()
+            imported += len(batch)
+            # A batch can touch many users and their friends, so drop all leaderboards and feeds at once
+            _invalidate(["workouts", "goals"], user_ids)
+            _cache.invalidate_namespace("leaderboard")
+            _cache.invalidate_namespace("feed")
+        return imported
+    except (psycopg2.Error, KeyError, ValueError):
+        instrumentation.logger.exception("Error importing workouts after %d were committed", imported)
+        if conn: conn.rollback()
+        return None
     finally:
         close_db_connection(conn, cur)
 
-def delete_workout(workout_id):
-    """D: Deletes a workout and all its exercises (due to ON DELETE CASCADE)."""
+def _read_workouts_jsonl(f):
+    """Yields one workout dict per non-blank line of a JSON-lines file."""
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def _read_workouts_csv(f):
+    """Yields workout dicts from a CSV file with one row per exercise.
+
+    Consecutive rows sharing a `workout_ref` belong to the same workout; a row
+    with an empty `exercise_name` is a workout without exercises.
+    """
+    def parse(value, cast):
+        return cast(value) if value not in (None, "") else None
+
+    rows = csv.DictReader(f)
+    for _, group in itertools.groupby(rows, key=lambda row: row['workout_ref']):
+        workout = None
+        for row in group:
+            if workout is None:
+                workout = {
+                    'user_id': int(row['user_id']),
+                    'workout_date': row['workout_date'],
+                    'duration_minutes': parse(row['duration_minutes'], int),
+                    'exercises': [],
+                }
+            if row['exercise_name']:
+                workout['exercises'].append({
+                    'name': row['exercise_name'],
+                    'sets': parse(row['sets'], int),
+                    'reps': parse(row['reps'], int),
+                    'weight': parse(row['weight_kg'], float),
+                })
+        yield workout
+
+@instrumentation.traced
+def import_workouts_file(path, user_id=None, batch_size=IMPORT_BATCH_SIZE):
+    """C: Streams workouts from a .jsonl or .csv file on disk into the database.
+
+    The file is read incrementally, so only one batch is held in memory at a
+    time. If `user_id` is given it overrides the user of every workout, which
+    suits single-user wearable exports. Returns the number of workouts imported,
+    or None on failure.
+    """
+    reader = _read_workouts_csv if path.lower().endswith(".csv") else _read_workouts_jsonl
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            workouts = reader(f)
+            if user_id is not None:
+                workouts = (dict(workout, user_id=user_id) for workout in workouts)
+            return bulk_create_workouts(workouts, batch_size)
+    except (OSError, ValueError):
+        instrumentation.logger.exception("Error reading workout import file %s", path)
+        return None
+
+# --- WRITE-BEHIND SUBMISSIONS ---
+# With WRITE_BEHIND on, the frontend acknowledges a logged workout once it is in
+# WriteQueue's local queue (QUEUE_PATH), and a worker writes the queue here in batches. Every
+# submission carries an idempotency key, stored in WorkoutSubmissions in the same
+# transaction as its workout, so a batch retried after a failure is never written twice.
+
+SUBMISSION_KEY_RETENTION_DAYS = 7   # days a written submission's key is remembered
+
+MEMBERS_OF_USERS_SQL = """
+    SELECT member_id FROM unnest(%s::int[]) AS U (member_id)
+    UNION SELECT user_id_2 FROM Friends WHERE user_id_1 = ANY(%s)
+    UNION SELECT user_id_1 FROM Friends WHERE user_id_2 = ANY(%s);
+"""
+
+def _claim_submission_keys(cur, submissions):
+    """Stores the keys of submissions inside the caller's transaction; returns the submissions not seen before.
+
+    A key repeated within `submissions` counts once, for its first submission.
+    """
+    cur.execute_prepared(
+        """
+        INSERT INTO WorkoutSubmissions (submission_key, user_id, workout_id, submitted_at)
+        SELECT * FROM unnest(%s::text[], %s::int[], %s::int[], %s::timestamptz[])
+        ON CONFLICT (submission_key) DO NOTHING
+        RETURNING submission_key;
+        """,
+        ([s['key'] for s in submissions], [s['user_id'] for s in submissions],
+         [s.get('workout_id') for s in submissions],
+         [s.get('submitted_at') or datetime.datetime.now(datetime.timezone.utc) for s in submissions])
+    )
+    new_keys = {row[0] for row in cur.fetchall()}
+    new = {}
+    for submission in submissions:
+        if submission['key'] in new_keys:
+            new.setdefault(submission['key'], submission)
+    return list(new.values())
+
+def _write_submissions(cur, submissions):
+    """Writes the submissions whose keys are new inside the caller's transaction; returns them.
+
+    Their workout IDs are only reserved once the new ones are known, so the keys are
+    stored first and pointed at the workouts afterwards.
+    """
+    new = _claim_submission_keys(cur, submissions)
+    if new:
+        workout_ids = _copy_workout_batch(cur, new)
+        cur.execute(
+            """
+            UPDATE WorkoutSubmissions S SET workout_id = V.workout_id
+            FROM unnest(%s::text[], %s::int[]) AS V (submission_key, workout_id)
+            WHERE S.submission_key = V.submission_key;
+            """,
+            ([s['key'] for s in new], workout_ids)
+        )
+    return new
+
+@instrumentation.traced
+def write_workout_submissions(submissions):
+    """C: Writes a batch of queued workouts in one transaction, skipping those whose key was already written.
+
+    Each submission is a bulk_create_workouts workout plus its 'key' and, optionally,
+    'submitted_at'. If the database refuses some of them (bad data, a deleted user),
+    the others are still written. Returns (workouts written, {key: error} of the
+    refused ones), or None if nothing could be written; the batch can then be retried.
+    """
     conn, cur = None, None
     try:
         conn = get_db_connection()
-        if not conn: return False
+        if not conn: return None
         cur = conn.cursor()
-        cur.execute("DELETE FROM Workouts WHERE workout_id = %s;", (workout_id,))
+        _ensure_partitions(conn, cur, [s['workout_date'] for s in submissions])
+        refused = {}
+        try:
+            written = _write_submissions(cur, submissions)
+        except (psycopg2.IntegrityError, psycopg2.DataError):
+            # One bad submission fails the whole batch; redo them one at a time to set it aside
+            conn.rollback()
+            written = []
+            for submission in submissions:
+                cur.execute("SAVEPOINT submission;")
+                try:
+                    written += _write_submissions(cur, [submission])
+                    cur.execute("RELEASE SAVEPOINT submission;")
+                except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT submission;")
+                    refused[submission['key']] = str(e).strip()
+        user_ids = sorted({s['user_id'] for s in written})
+        member_ids = []
+        if user_ids:
+            _evaluate_goals(cur, user_ids)
+            cur.execute_prepared(MEMBERS_OF_USERS_SQL, (user_ids, user_ids, user_ids))
+            member_ids = [row[0] for row in cur.fetchall()]
         conn.commit()
-        return cur.rowcount > 0
-    except psycopg2.Error as e:
-        print(f"Error deleting workout: {e}")
+        _invalidate(["workouts", "goals"], user_ids)
+        _invalidate(["leaderboard", "feed"], member_ids)
+        return len(written), refused
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error writing %d queued workouts", len(submissions))
         if conn: conn.rollback()
-        return False
+        return None
     finally:
         close_db_connection(conn, cur)
 
-# --- GOALS (CRUD) ---
-
-def create_goal(user_id, description, target, start_date, end_date):
-    """C: Creates a new fitness goal."""
+@instrumentation.traced
+def prune_workout_submissions(keep_days=SUBMISSION_KEY_RETENTION_DAYS):
+    """D: Forgets the keys of submissions written more than `keep_days` days ago; returns how many, or None on failure."""
     conn, cur = None, None
     try:
         conn = get_db_connection()
-        if not conn: return False
+        if not conn: return None
         cur = conn.cursor()
         cur.execute(
-            "INSERT INTO Goals (user_id, goal_description, target_value, start_date, end_date) VALUES (%s, %s, %s, %s, %s);",
-            (user_id, description, target, start_date, end_date)
+            "DELETE FROM WorkoutSubmissions WHERE applied_at < CURRENT_TIMESTAMP - make_interval(days => %s);",
+            (keep_days,)
         )
+        pruned = cur.rowcount
         conn.commit()
-        return True
-    except psycopg2.Error as e:
-        print(f"Error creating goal: {e}")
+        return pruned
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error pruning workout submissions")
         if conn: conn.rollback()
-        return False
+        return None
     finally:
         close_db_connection(conn, cur)
 
-def read_goals(user_id):
-    """R: Reads all goals for a user."""
+# --- GOALS (CRUD) ---
+
+@instrumentation.traced
+def create_goal(user_id, description, target, start_date, end_date, metric="manual"):
+    """C: Creates a new fitness goal; `metric` is one of GOAL_METRICS."""
+    if metric not in GOAL_METRICS:
+        raise ValueError(f"metric must be one of {GOAL_METRICS}, not {metric!r}")
     conn, cur = None, None
     try:
         conn = get_db_connection()
-        if not conn: return []
+        if not conn: return False
         cur = conn.cursor()
         cur.execute(
-            "SELECT goal_id, goal_description, target_value, is_completed FROM Goals WHERE user_id = %s ORDER BY is_completed, end_date;",
-            (user_id,)
+            "INSERT INTO Goals (user_id, goal_description, target_value, start_date, end_date, metric) VALUES (%s, %s, %s, %s, %s, %s);",
+            (user_id, description, target, start_date, end_date, metric)
         )
-        return cur.fetchall()
-    except psycopg2.Error as e:
-        print(f"Error reading goals: {e}")
-        return []
+        _evaluate_goals(cur, [user_id])
+        conn.commit()
+        _invalidate(["goals"], [user_id])
+        return True
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error creating goal")
+        if conn: conn.rollback()
+        return False
     finally:
         close_db_connection(conn, cur)
 
+# One page of a user's goals, open ones first, then by end date (open-ended last); takes
+# the user ID and the page size plus one. The next page also takes the cursor's
+# (is_completed, end_date, goal_id) after the user ID.
+GOAL_PAGE_SQL = "SELECT goal_id, goal_description, target_value, is_completed, metric, progress_value, end_date FROM Goals WHERE user_id = %s ORDER BY is_completed, COALESCE(end_date, 'infinity'::date), goal_id LIMIT %s;"
+GOAL_PAGE_AFTER_SQL = "SELECT goal_id, goal_description, target_value, is_completed, metric, progress_value, end_date FROM Goals WHERE user_id = %s AND (is_completed, COALESCE(end_date, 'infinity'::date), goal_id) > (%s, COALESCE(%s::date, 'infinity'::date), %s) ORDER BY is_completed, COALESCE(end_date, 'infinity'::date), goal_id LIMIT %s;"
+
+def read_goals(user_id, limit=None, after=None):
+    """R: Reads one page of a user's goals, open ones first, then by end date (open-ended last).
+
+    Rows are (goal_id, description, target, is_completed, metric, progress_value, end_date).
+    Returns (goals, next_cursor). Pass next_cursor back as `after` for the
+    following page; it is None on the last page. `limit=None` reads every goal.
+    """
+    return _run_async("read_goals", user_id, limit, after)
+
+@instrumentation.traced
 def update_goal(goal_id, is_completed):
-    """U: Updates a goal's completion status."""
+    """U: Updates a goal's completion status; goal evaluation leaves a status set here alone."""
     conn, cur = None, None
     try:
         conn = get_db_connection()
         if not conn: return False
         cur = conn.cursor()
         cur.execute(
-            "UPDATE Goals SET is_completed = %s WHERE goal_id = %s;",
+            "UPDATE Goals SET is_completed = %s, completion_overridden = TRUE WHERE goal_id = %s RETURNING user_id;",
             (is_completed, goal_id)
         )
+        updated = cur.fetchone()
         conn.commit()
-        return cur.rowcount > 0
-    except psycopg2.Error as e:
-        print(f"Error updating goal: {e}")
+        if updated: _invalidate(["goals"], [updated[0]])
+        return updated is not None
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error updating goal")
         if conn: conn.rollback()
         return False
     finally:
         close_db_connection(conn, cur)
 
+@instrumentation.traced
 def delete_goal(goal_id):
     """D: Deletes a goal."""
     conn, cur = None, None
@@ -299,56 +1741,486 @@ def delete_goal(goal_id):
         conn = get_db_connection()
         if not conn: return False
         cur = conn.cursor()
-        cur.execute("DELETE FROM Goals WHERE goal_id = %s;", (goal_id,))
+        cur.execute("DELETE FROM Goals WHERE goal_id = %s RETURNING user_id;", (goal_id,))
+        deleted = cur.fetchone()
         conn.commit()
-        return cur.rowcount > 0
-    except psycopg2.Error as e:
-        print(f"Error deleting goal: {e}")
+        if deleted: _invalidate(["goals"], [deleted[0]])
+        return deleted is not None
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error deleting goal")
         if conn: conn.rollback()
         return False
     finally:
         close_db_connection(conn, cur)
 
-# --- LEADERBOARD (READ) ---
+# --- GOAL EVALUATION ---
 
-def read_leaderboard(user_id):
-    """R: Reads the leaderboard for a user and their friends based on weekly workout minutes."""
+# What a goal's target_value can measure; 'manual' goals are never evaluated.
+GOAL_METRICS = ("manual", "workouts", "minutes", "volume")
+
+# The progress of the measured goals matching {goals} over the workouts matching
+# {workouts}: each goal joins the workouts in its own date window (an open end date
+# means "until today") and volume goals add their exercises.
+GOAL_PROGRESS_SQL = """
+    WITH active AS (
+        SELECT G.goal_id, G.user_id, G.metric, G.start_date, COALESCE(G.end_date, CURRENT_DATE) AS end_date
+        FROM Goals G
+        WHERE G.metric <> 'manual' AND {goals}
+    ),
+    progress AS (
+        SELECT A.goal_id,
+               CASE A.metric
+                   WHEN 'workouts' THEN COUNT(W.workout_id)
+                   WHEN 'minutes' THEN COALESCE(SUM(W.duration_minutes), 0)
+                   ELSE COALESCE(SUM(V.volume), 0)
+               END AS progress_value
+        FROM active A
+        LEFT JOIN Workouts W ON W.user_id = A.user_id AND W.workout_date BETWEEN A.start_date AND A.end_date
+                            AND {workouts}
+        LEFT JOIN LATERAL (
+            SELECT SUM(E.sets * E.reps * E.weight_kg) AS volume
+            FROM Exercises E
+            WHERE A.metric = 'volume' AND E.workout_id = W.workout_id AND E.workout_date = W.workout_date
+        ) V ON TRUE
+        GROUP BY A.goal_id, A.metric
+    )
+"""
+
+# Recomputes the progress of the open, started goals in one pass, adding what archived
+# months contributed, and completes met goals unless the user set their completion by
+# hand. The same user filter is applied to Goals and Workouts so a partition of users
+# only reads its own share of each table.
+EVALUATE_GOALS_SQL = GOAL_PROGRESS_SQL.format(
+    goals="NOT G.is_completed AND G.start_date <= CURRENT_DATE AND {goal_filter}",
+    workouts="{workout_filter}",
+) + """
+    UPDATE Goals G
+    SET progress_value = G.archived_progress + P.progress_value,
+        evaluated_at = now(),
+        is_completed = CASE WHEN G.completion_overridden THEN G.is_completed
+                            ELSE G.target_value IS NOT NULL AND G.archived_progress + P.progress_value >= G.target_value
+                       END
+    FROM progress P
+    WHERE G.goal_id = P.goal_id
+    RETURNING G.user_id, G.is_completed;
+"""
+
+# Adds what one month's workouts count towards the goals whose windows overlap it
+# to their archived_progress; archive_partitions runs it before the month is dropped.
+# Takes the month's end, its start, then the start and end again.
+FOLD_GOAL_PROGRESS_SQL = GOAL_PROGRESS_SQL.format(
+    goals="G.start_date < %s AND COALESCE(G.end_date, CURRENT_DATE) >= %s",
+    workouts="W.workout_date >= %s AND W.workout_date < %s",
+) + """
+    UPDATE Goals G
+    SET archived_progress = G.archived_progress + P.progress_value
+    FROM progress P
+    WHERE G.goal_id = P.goal_id AND P.progress_value > 0;
+"""
+
+# EVALUATE_GOALS_SQL for a list of users, as writes run it; takes the user IDs twice
+EVALUATE_USERS_GOALS_SQL = EVALUATE_GOALS_SQL.format(goal_filter="G.user_id = ANY(%s)", workout_filter="W.user_id = ANY(%s)")
+
+def _evaluate_goals(cur, user_ids=None, user_range=None):
+    """Evaluates open goals inside the caller's transaction: of some users, of a user_id range, or everyone's.
+
+    Returns [(user_id, is_completed)] for every goal evaluated.
+    """
+    if user_ids is not None:
+        cur.execute_prepared(EVALUATE_USERS_GOALS_SQL, (list(user_ids),) * 2)
+        return cur.fetchall()
+    if user_range is not None:
+        where, params = "{} BETWEEN %s AND %s", tuple(user_range)
+    else:
+        where, params = "TRUE", ()
+    sql = EVALUATE_GOALS_SQL.format(goal_filter=where.format("G.user_id"), workout_filter=where.format("W.user_id"))
+    cur.execute_prepared(sql, params + params)
+    return cur.fetchall()
+
+@instrumentation.traced
+def evaluate_goals(user_id=None, user_range=None):
+    """U: Recomputes goal progress and completes met goals, for one user or for everyone.
+
+    `user_range` = (first_user_id, last_user_id) restricts a run over everyone to
+    that inclusive range, so a batch can be split across workers.
+    Returns (goals evaluated, goals completed), or None on failure.
+    """
     conn, cur = None, None
     try:
         conn = get_db_connection()
-        if not conn: return []
+        if not conn: return None
+        cur = conn.cursor()
+        evaluated = _evaluate_goals(cur, [user_id] if user_id is not None else None, user_range)
+        conn.commit()
+        _invalidate(["goals"], {row[0] for row in evaluated})
+        return len(evaluated), sum(1 for row in evaluated if row[1])
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error evaluating goals")
+        if conn: conn.rollback()
+        return None
+    finally:
+        close_db_connection(conn, cur)
+
+# --- LEADERBOARDS ---
+# A leaderboard ranks users by workout minutes in a window: a calendar week or month
+# (one rollup row per user) or a rolling number of days ending today (summed from the
+# 'day' rows). The friends scope ranks a user and their friends live, members without
+# minutes included. The global scope ranks everyone, so refresh_leaderboards ranks it
+# ahead of time into LeaderboardRanks (run it every few minutes with
+# `Batch.py refresh-leaderboards`) and pages read the top K, or one user's rank, from
+# there. Ties share a rank.
+
+LEADERBOARD_SCOPES = ("friends", "global")
+ROLLING_WINDOWS = {"7d": 7, "30d": 30}   # name -> days ending today
+LEADERBOARD_PERIODS = ("week", "month") + tuple(ROLLING_WINDOWS)
+LEADERBOARD_TOP_K = 10                    # rows of a global leaderboard read by default
+LEADERBOARD_SNAPSHOT_WINDOWS = (0, 1)     # periods_ago ranked by refresh_leaderboards: the current window and the last
+
+# A user's board with every member's minutes in a window (0 without any), ranked; takes
+# the user ID three times, the rollup period, the window's first and last day, and a limit.
+FRIENDS_LEADERBOARD_SQL = f"""
+    SELECT (RANK() OVER (ORDER BY COALESCE(T.total_minutes, 0) DESC))::int AS rank,
+           U.user_id, U.name, COALESCE(T.total_minutes, 0)::int AS total_minutes
+    FROM ({MEMBER_IDS_SQL}) M
+    JOIN Users U ON U.user_id = M.member_id
+    LEFT JOIN LATERAL (
+        SELECT SUM(R.total_minutes) AS total_minutes
+        FROM WorkoutMinutesRollup R
+        WHERE R.user_id = M.member_id AND R.period = %s AND R.period_start BETWEEN %s AND %s
+    ) T ON TRUE
+    ORDER BY rank, U.name, U.user_id
+    LIMIT %s
+"""
+# The top of a ranked window; takes the period, the window's first day and a limit
+GLOBAL_LEADERBOARD_SQL = """
+    SELECT L.rank, L.user_id, U.name, L.total_minutes
+    FROM LeaderboardRanks L
+    JOIN Users U ON U.user_id = L.user_id
+    WHERE L.period = %s AND L.period_start = %s
+    ORDER BY L.rank, L.user_id
+    LIMIT %s
+"""
+# One user's place in a ranked window; takes the user ID, the period and the window's first day
+GLOBAL_LEADERBOARD_RANK_SQL = """
+    SELECT COALESCE(L.rank, S.ranked_users + 1), COALESCE(L.total_minutes, 0), S.total_users, S.refreshed_at
+    FROM LeaderboardSnapshots S
+    LEFT JOIN LeaderboardRanks L
+      ON L.period = S.period AND L.period_start = S.period_start AND L.user_id = %s
+    WHERE S.period = %s AND S.period_start = %s
+"""
+# Ranks everyone with minutes in a window; takes the period and first day to store them
+# under, then the rollup period and the window's first and last day
+RANK_LEADERBOARD_SQL = """
+    INSERT INTO LeaderboardRanks (period, period_start, user_id, total_minutes, rank)
+    SELECT %s, %s, user_id, total_minutes, RANK() OVER (ORDER BY total_minutes DESC)
+    FROM (
+        SELECT user_id, SUM(total_minutes)::int AS total_minutes
+        FROM WorkoutMinutesRollup
+        WHERE period = %s AND period_start BETWEEN %s AND %s
+        GROUP BY user_id
+    ) T
+    WHERE total_minutes > 0;
+"""
+
+def leaderboard_window(period, periods_ago=0, today=None):
+    """Returns the (first_day, last_day) of a leaderboard window `periods_ago` windows back.
+
+    Weeks start on Monday. Raises ValueError for a period not in LEADERBOARD_PERIODS
+    or a rolling window reaching back past the kept 'day' rollup rows.
+    """
+    today = today or datetime.date.today()
+    if periods_ago < 0:
+        raise ValueError("periods_ago must not be negative")
+    if period in ROLLING_WINDOWS:
+        days = ROLLING_WINDOWS[period]
+        if days * (periods_ago + 1) > DAY_ROLLUP_DAYS:
+            raise ValueError(f"rolling windows reach back at most {DAY_ROLLUP_DAYS} days")
+        last_day = today - datetime.timedelta(days=days * periods_ago)
+        return last_day - datetime.timedelta(days=days - 1), last_day
+    if period == "week":
+        first_day = today - datetime.timedelta(days=today.weekday() + 7 * periods_ago)
+        return first_day, first_day + datetime.timedelta(days=6)
+    if period == "month":
+        first_day = _add_months(_month_start(today), -periods_ago)
+        return first_day, _add_months(first_day, 1) - datetime.timedelta(days=1)
+    raise ValueError(f"period must be one of {LEADERBOARD_PERIODS}, not {period!r}")
+
+def _rollup_period(period):
+    """Returns the rollup rows a leaderboard period is summed from."""
+    return "day" if period in ROLLING_WINDOWS else period
+
+def read_leaderboard(user_id, period="week", periods_ago=0, scope="friends", limit=None):
+    """R: Reads a leaderboard by workout minutes as [(rank, user_id, name, total_minutes)].
+
+    `period` is one of LEADERBOARD_PERIODS and `periods_ago` selects a past window
+    (0 is the current one). The "friends" scope ranks the user and all their friends,
+    including those without minutes, from WorkoutMinutesRollup, so the cost depends on
+    the number of friends rather than workouts. The "global" scope reads the top
+    `limit` (default LEADERBOARD_TOP_K) of the last refresh_leaderboards ranking,
+    which only covers LEADERBOARD_SNAPSHOT_WINDOWS; see read_leaderboard_rank for
+    the user's own place and when it was ranked.
+    """
+    return _run_async("read_leaderboard", user_id, period, periods_ago, scope, limit)
+
+def _friends_place(user_id, leaderboard):
+    """Finds a user's (rank, total_minutes, ranked_of, None) on their friends leaderboard, or None."""
+    for rank, member_id, _, total_minutes in leaderboard:
+        if member_id == user_id:
+            return rank, total_minutes, len(leaderboard), None
+    return None
+
+def read_leaderboard_rank(user_id, period="week", periods_ago=0, scope="global"):
+    """R: Reads a user's place on a leaderboard as (rank, total_minutes, ranked_of, ranked_at).
+
+    In the "global" scope the place comes from the last ranking, taken at ranked_at,
+    and ranked_of counts every user then; users without minutes share the rank after
+    the last ranked one. In the "friends" scope it is live and ranked_at is None.
+    Returns None if the window has not been ranked or the read fails.
+    """
+    return _run_async("read_leaderboard_rank", user_id, period, periods_ago, scope)
+
+def _rank_leaderboard(cur, period, first_day, last_day):
+    """Replaces the ranking of one global window inside the caller's transaction; returns how many users it ranked."""
+    cur.execute("DELETE FROM LeaderboardRanks WHERE period = %s AND period_start = %s;", (period, first_day))
+    cur.execute("DELETE FROM LeaderboardSnapshots WHERE period = %s AND period_start = %s;", (period, first_day))
+    cur.execute(
+        "INSERT INTO LeaderboardSnapshots (period, period_start, total_users) SELECT %s, %s, COUNT(*) FROM Users;",
+        (period, first_day)
+    )
+    cur.execute(RANK_LEADERBOARD_SQL, (period, first_day, _rollup_period(period), first_day, last_day))
+    ranked = cur.rowcount
+    cur.execute(
+        "UPDATE LeaderboardSnapshots SET ranked_users = %s WHERE period = %s AND period_start = %s;",
+        (ranked, period, first_day)
+    )
+    return ranked
+
+@instrumentation.traced
+def refresh_leaderboards(periods=LEADERBOARD_PERIODS):
+    """U: Ranks every user on the global leaderboards of the LEADERBOARD_SNAPSHOT_WINDOWS of each period.
+
+    Each window is ranked in its own transaction, so pages keep reading the previous
+    ranking until the new one commits. Rankings of windows that have passed out of
+    reach and 'day' rollup rows older than DAY_ROLLUP_DAYS are dropped. Returns
+    {(period, first_day): users ranked}, or None on failure.
+    """
+    windows = {
+        period: [leaderboard_window(period, periods_ago) for periods_ago in LEADERBOARD_SNAPSHOT_WINDOWS]
+        for period in periods
+    }
+    conn, cur = None, None
+    try:
+        conn = get_db_connection()
+        if not conn: return None
+        cur = conn.cursor()
+        ranked = {}
+        for period, period_windows in windows.items():
+            for first_day, last_day in period_windows:
+                ranked[(period, first_day)] = _rank_leaderboard(cur, period, first_day, last_day)
+                conn.commit()
+            oldest = min(first_day for first_day, _ in period_windows)
+            cur.execute("DELETE FROM LeaderboardRanks WHERE period = %s AND period_start < %s;", (period, oldest))
+            cur.execute("DELETE FROM LeaderboardSnapshots WHERE period = %s AND period_start < %s;", (period, oldest))
+            conn.commit()
+        cur.execute("DELETE FROM WorkoutMinutesRollup WHERE period = 'day' AND period_start < %s;", (_day_rollup_cutoff(),))
+        conn.commit()
+        _cache.invalidate_namespace("leaderboard")
+        return ranked
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error refreshing leaderboards")
+        if conn: conn.rollback()
+        return None
+    finally:
+        close_db_connection(conn, cur)
+
+# --- ACTIVITY FEED ---
+# A user's feed lists their friends' workouts, newest first, a page at a time keyed on
+# (workout_date, workout_id). It is read one of two ways (see migrations/0010_activity_feed.sql):
+# fan-out on read merges the newest workouts of every friend in one query, which costs
+# an index probe per friend; fan-out on write copies each new workout into the inboxes
+# of the author's friends, so a page is one range scan whatever the number of friends.
+# Only users with FEED_INBOX_MIN_FRIENDS friends or more get an inbox; run
+# `Batch.py refresh-feed-inboxes` nightly to create theirs and trim every inbox to
+# FEED_INBOX_SIZE workouts. Workouts in archived months are not in the feed.
+
+FEED_PAGE_SIZE = 20
+FEED_INBOX_MIN_FRIENDS = 100   # friends above which an index probe each costs more than keeping an inbox
+FEED_INBOX_SIZE = 500          # newest workouts kept in an inbox; older pages are merged on read
+
+# Cursors that start a feed at its newest or reach down to its oldest workout
+FEED_NEWEST = (datetime.date.max, 0)
+FEED_OLDEST = (datetime.date.min, 0)
+
+# The newest workouts of a user's friends before a cursor; takes the user ID twice,
+# the cursor's date twice and its workout ID, then the page size twice (each friend
+# contributes at most a page, read from the top of workouts_user_date_idx).
+FRIENDS_FEED_SQL = f"""
+    SELECT W.workout_id, W.workout_date, W.user_id, U.name, W.duration_minutes
+    FROM ({FRIEND_IDS_SQL}) F
+    JOIN Users U ON U.user_id = F.friend_id
+    CROSS JOIN LATERAL (
+        SELECT workout_id, workout_date, user_id, duration_minutes
+        FROM Workouts
+        WHERE user_id = F.friend_id AND workout_date <= %s AND (workout_date, workout_id) < (%s, %s)
+        ORDER BY workout_date DESC, workout_id DESC
+        LIMIT %s
+    ) W
+    ORDER BY W.workout_date DESC, W.workout_id DESC
+    LIMIT %s
+"""
+# The same page from an inbox, down to its horizon; takes the user ID, the cursor's date
+# and workout ID, the horizon's date and workout ID, and the page size
+INBOX_FEED_SQL = """
+    SELECT I.workout_id, I.workout_date, I.author_id, U.name, I.duration_minutes
+    FROM FeedItems I
+    JOIN Users U ON U.user_id = I.author_id
+    WHERE I.user_id = %s AND (I.workout_date, I.workout_id) < (%s, %s) AND (I.workout_date, I.workout_id) >= (%s, %s)
+    ORDER BY I.workout_date DESC, I.workout_id DESC
+    LIMIT %s
+"""
+# Copies new workouts into the inboxes of their authors' friends; takes arrays of the
+# authors, dates, workout IDs and durations
+FAN_OUT_SQL = """
+    INSERT INTO FeedItems (user_id, workout_date, workout_id, author_id, duration_minutes)
+    SELECT I.user_id, W.workout_date, W.workout_id, W.author_id, W.duration_minutes
+    FROM unnest(%s::int[], %s::date[], %s::int[], %s::int[]) AS W (author_id, workout_date, workout_id, duration_minutes)
+    CROSS JOIN LATERAL (
+        SELECT user_id_2 AS friend_id FROM Friends WHERE user_id_1 = W.author_id
+        UNION ALL
+        SELECT user_id_1 FROM Friends WHERE user_id_2 = W.author_id
+    ) F
+    JOIN FeedInboxes I ON I.user_id = F.friend_id
+    WHERE I.horizon_date IS NULL OR (W.workout_date, W.workout_id) >= (I.horizon_date, I.horizon_id)
+    ON CONFLICT DO NOTHING;
+"""
+# Copies one author's workouts into one inbox, e.g. of a new friend; takes the author and the inbox's user
+COPY_INTO_INBOX_SQL = """
+    INSERT INTO FeedItems (user_id, workout_date, workout_id, author_id, duration_minutes)
+    SELECT I.user_id, W.workout_date, W.workout_id, W.user_id, W.duration_minutes
+    FROM FeedInboxes I
+    JOIN Workouts W ON W.user_id = %s
+    WHERE I.user_id = %s AND (I.horizon_date IS NULL OR (W.workout_date, W.workout_id) >= (I.horizon_date, I.horizon_id))
+    ON CONFLICT DO NOTHING;
+"""
+# Removes a deleted workout from every inbox; takes its author and workout ID
+DELETE_FEED_ITEMS_SQL = "DELETE FROM FeedItems WHERE author_id = %s AND workout_id = %s;"
+# The horizon of a user's inbox once it has been filled; takes the user ID
+INBOX_HORIZON_SQL = "SELECT horizon_date, horizon_id FROM FeedInboxes WHERE user_id = %s AND built_at IS NOT NULL;"
+# Keeps the newest `size` workouts of every inbox: the last one kept becomes the horizon
+# of an inbox that had more. Workouts a writer copied below a horizon while it moved
+# are not counted. Takes the size.
+TRIM_INBOXES_SQL = """
+    WITH kept AS (
+        SELECT user_id, workout_date, workout_id
+        FROM (
+            SELECT F.user_id, F.workout_date, F.workout_id,
+                   ROW_NUMBER() OVER (PARTITION BY F.user_id ORDER BY F.workout_date DESC, F.workout_id DESC) AS n
+            FROM FeedItems F
+            JOIN FeedInboxes I ON I.user_id = F.user_id
+            WHERE I.horizon_date IS NULL OR (F.workout_date, F.workout_id) >= (I.horizon_date, I.horizon_id)
+        ) R
+        WHERE n = %s
+    )
+    UPDATE FeedInboxes I SET horizon_date = K.workout_date, horizon_id = K.workout_id
+    FROM kept K
+    WHERE I.user_id = K.user_id;
+"""
+
+def _fan_out_workouts(cur, workouts):
+    """Copies new workouts into the inboxes of their authors' friends, inside the caller's transaction.
+
+    `workouts` is a list of (user_id, workout_date, workout_id, duration_minutes) tuples.
+    """
+    if not workouts:
+        return
+    user_ids, dates, workout_ids, durations = (list(column) for column in zip(*workouts))
+    # Imported and queued workouts carry ISO date strings, which the prepared statement's date[] refuses
+    dates = [datetime.date.fromisoformat(date) if isinstance(date, str) else date for date in dates]
+    cur.execute_prepared(FAN_OUT_SQL, (user_ids, dates, workout_ids, durations))
+
+def _link_inboxes(cur, id1, id2):
+    """Copies two new friends' workouts into each other's inboxes, inside the caller's transaction."""
+    for author_id, user_id in ((id1, id2), (id2, id1)):
+        cur.execute(COPY_INTO_INBOX_SQL, (author_id, user_id))
+
+def _unlink_inboxes(cur, id1, id2):
+    """Removes two former friends' workouts from each other's inboxes, inside the caller's transaction."""
+    cur.execute(
+        "DELETE FROM FeedItems WHERE (user_id = %s AND author_id = %s) OR (user_id = %s AND author_id = %s);",
+        (id1, id2, id2, id1)
+    )
+
+def _feed_page(feed, limit):
+    """Cuts limit + 1 feed rows down to a page; returns (feed, next_cursor)."""
+    if len(feed) > limit:
+        feed = feed[:limit]
+        return feed, (feed[-1][1], feed[-1][0])
+    return feed, None
+
+def read_activity_feed(user_id, limit=FEED_PAGE_SIZE, before=None):
+    """R: Reads one page of a user's friends' workouts as (workout_id, workout_date, user_id, name, duration_minutes).
+
+    Pages are keyed on (workout_date, workout_id), newest first. Pass the returned
+    cursor as `before` to fetch the next, older page; it is None on the last page.
+    Users with an inbox read it down to its horizon and merge older pages from their
+    friends' workouts, so a feed reads the same either way.
+    """
+    return _run_async("read_activity_feed", user_id, limit, before)
+
+@instrumentation.traced
+def refresh_feed_inboxes(min_friends=FEED_INBOX_MIN_FRIENDS, size=FEED_INBOX_SIZE):
+    """U: Gives every user with at least `min_friends` friends an inbox, drops the others' and trims them all to `size` workouts.
+
+    A new inbox starts receiving workouts before it is filled with its friends'
+    newest ones, and is only read once filled, so no workout logged meanwhile is
+    missed. Returns (inboxes created, inboxes dropped, inboxes kept), or None on failure.
+    """
+    conn, cur = None, None
+    try:
+        conn = get_db_connection()
+        if not conn: return None
         cur = conn.cursor()
-        
-        # Get all users (user + friends) to include in the leaderboard
         cur.execute(
-            """
-            SELECT U.user_id FROM Users U
-            WHERE U.user_id = %s
-            UNION
-            SELECT U.user_id FROM Friends F
-            JOIN Users U ON F.user_id_1 = U.user_id OR F.user_id_2 = U.user_id
-            WHERE (F.user_id_1 = %s OR F.user_id_2 = %s) AND U.user_id != %s;
-            """,
-            (user_id, user_id, user_id, user_id)
+            "SELECT member FROM (SELECT user_id_1 AS member FROM Friends UNION ALL SELECT user_id_2 FROM Friends) M GROUP BY member HAVING COUNT(*) >= %s;",
+            (min_friends,)
         )
-        leaderboard_ids = [row[0] for row in cur.fetchall()]
-
-        # Get total workout minutes for this week for all relevant users
+        heavy_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("DELETE FROM FeedInboxes WHERE user_id <> ALL(%s);", (heavy_ids,))
+        dropped = cur.rowcount
         cur.execute(
-            """
-            SELECT U.name, SUM(W.duration_minutes) as total_minutes
-            FROM Users U
-            LEFT JOIN Workouts W ON U.user_id = W.user_id
-            WHERE U.user_id IN %s
-              AND W.workout_date >= date_trunc('week', NOW())
-            GROUP BY U.name
-            ORDER BY total_minutes DESC;
-            """,
-            (tuple(leaderboard_ids),)
+            "INSERT INTO FeedInboxes (user_id) SELECT unnest(%s::int[]) ON CONFLICT DO NOTHING RETURNING user_id;",
+            (heavy_ids,)
         )
-        return cur.fetchall()
-    except psycopg2.Error as e:
-        print(f"Error reading leaderboard: {e}")
-        return []
+        new_ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+        for user_id in new_ids:
+            # One workout past the size tells whether the inbox holds them all
+            cur.execute(FRIENDS_FEED_SQL + ";", (user_id, user_id, FEED_NEWEST[0], FEED_NEWEST[0], FEED_NEWEST[1], size + 1, size + 1))
+            feed = cur.fetchall()
+            horizon = (feed[size - 1][1], feed[size - 1][0]) if len(feed) > size else (None, None)
+            cur.execute(
+                """
+                INSERT INTO FeedItems (user_id, workout_date, workout_id, author_id, duration_minutes)
+                SELECT %s, * FROM unnest(%s::date[], %s::int[], %s::int[], %s::int[])
+                ON CONFLICT DO NOTHING;
+                """,
+                (user_id, [row[1] for row in feed[:size]], [row[0] for row in feed[:size]],
+                 [row[2] for row in feed[:size]], [row[4] for row in feed[:size]])
+            )
+            cur.execute(
+                "UPDATE FeedInboxes SET horizon_date = %s, horizon_id = %s, built_at = CURRENT_TIMESTAMP WHERE user_id = %s;",
+                horizon + (user_id,)
+            )
+            conn.commit()
+        cur.execute(TRIM_INBOXES_SQL, (size,))
+        cur.execute(
+            "DELETE FROM FeedItems F USING FeedInboxes I WHERE F.user_id = I.user_id AND (F.workout_date, F.workout_id) < (I.horizon_date, I.horizon_id);"
+        )
+        conn.commit()
+        return len(new_ids), dropped, len(heavy_ids) - len(new_ids)
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error refreshing feed inboxes")
+        if conn: conn.rollback()
+        return None
     finally:
-        close_db_connection(conn, cur)
\ No newline at end of file
+        close_db_connection(conn, cur)
@@ -0,0 +1,258 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import psycopg2
+
+import Backend as backend
+import Export as export
+import Instrumentation as instrumentation
+import WriteQueue as write_queue
+
+# --- NIGHTLY BATCH JOBS ---
+# Run from cron (or any scheduler) against the production database, e.g.
+#
+#     python Batch.py evaluate-goals --workers 4
+#     python Batch.py ensure-partitions --months-ahead 3
+#     python Batch.py archive-partitions --keep-months 24
+#     python Batch.py export-users --format jsonl --output-dir exports --workers 4
+#     python Batch.py prune-submissions --keep-days 7
+#     python Batch.py refresh-feed-inboxes
+#
+# The global leaderboards are only as fresh as their last ranking, so rank them often:
+#
+#     */5 * * * *  python Batch.py refresh-leaderboards
+#
+# With write-behind on, a worker can also drain the workout queue outside the app:
+#
+#     python Batch.py drain-queue --follow
+
+def _init_worker(db_config, statement_timeout_ms):
+    """Points a freshly spawned worker process at the same database and settings as the parent."""
+    backend.DB_CONFIG.update(db_config)
+    backend.configure(statement_timeout_ms=statement_timeout_ms)
+    backend.configure_pool(min_size=1, max_size=1)
+
+def _evaluate_partition(user_range):
+    return backend.evaluate_goals(user_range=user_range)
+
+def _export_user(args):
+    user_id, directory, format = args
+    return user_id, export.export_user(user_id, directory, format) is not None
+
+def goal_user_ranges(partitions):
+    """Splits the users with open goals into up to `partitions` user_id ranges holding about as many goals each.
+
+    Returns [(first_user_id, last_user_id)], or None on failure.
+    """
+    conn, cur = None, None
+    try:
+        conn = backend.get_db_connection()
+        if not conn: return None
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT MIN(user_id), MAX(user_id)
+            FROM (SELECT user_id, ntile(%s) OVER (ORDER BY user_id) AS part
+                  FROM Goals WHERE NOT is_completed AND metric <> 'manual') G
+            GROUP BY part ORDER BY part;
+            """,
+            (partitions,)
+        )
+        bounds = cur.fetchall()
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error partitioning goals")
+        return None
+    finally:
+        backend.close_db_connection(conn, cur)
+    # One user's goals can straddle two tiles; start each range after the previous one
+    ranges = []
+    for first, last in bounds:
+        if ranges:
+            first = max(first, ranges[-1][1] + 1)
+        if first <= last:
+            ranges.append((first, last))
+    return ranges
+
+def evaluate_all_goals(workers=1):
+    """Evaluates every user's open goals, split into `workers` user ranges run in parallel processes.
+
+    Returns (goals evaluated, goals completed), or None if any range failed;
+    ranges commit independently, so the others are kept.
+    """
+    if workers <= 1:
+        return backend.evaluate_goals()
+    ranges = goal_user_ranges(workers)
+    if ranges is None:
+        return None
+    if not ranges:
+        return 0, 0
+    # Spawn rather than fork so no worker inherits the parent's pooled connections
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(len(ranges), mp_context=context, initializer=_init_worker,
+                             initargs=(backend.DB_CONFIG, backend.STATEMENT_TIMEOUT_MS)) as pool:
+        results = list(pool.map(_evaluate_partition, ranges))
+    if any(result is None for result in results):
+        return None
+    return sum(result[0] for result in results), sum(result[1] for result in results)
+
+def export_users(directory, format="jsonl", workers=1, user_ids=None):
+    """Exports many users (default: everyone) into `directory`, spread over `workers` processes.
+
+    Each user is exported on its own (see Export.export_user), so one failure does not
+    stop the others. Returns (users exported, [user IDs that failed]), or None if the
+    users could not be listed.
+    """
+    if user_ids is None:
+        conn, cur = None, None
+        try:
+            conn = backend.get_read_connection()
+            if not conn: return None
+            cur = conn.cursor()
+            cur.execute("SELECT user_id FROM Users ORDER BY user_id;")
+            user_ids = [row[0] for row in cur.fetchall()]
+        except psycopg2.Error:
+            instrumentation.logger.exception("Error listing users to export")
+            return None
+        finally:
+            backend.close_db_connection(conn, cur)
+    os.makedirs(directory, exist_ok=True)
+    jobs = [(user_id, directory, format) for user_id in user_ids]
+    if workers <= 1:
+        results = [_export_user(job) for job in jobs]
+    else:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(backend.DB_CONFIG, backend.STATEMENT_TIMEOUT_MS)) as pool:
+            # Most users are small, so hand them out in chunks to keep the workers busy
+            results = list(pool.map(_export_user, jobs, chunksize=max(1, min(64, len(jobs) // (workers * 4)))))
+    failed = [user_id for user_id, ok in results if not ok]
+    return len(jobs) - len(failed), failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Personal Fitness Tracker batch jobs.")
+    parser.add_argument("--config", help="a JSON settings file (see Backend.load_config)")
+    parser.add_argument("--database", help="overrides the configured database name")
+    commands = parser.add_subparsers(dest="command", required=True)
+    goals = commands.add_parser("evaluate-goals", help="recompute goal progress and complete met goals")
+    goals.add_argument("--workers", type=int, default=1, help="worker processes, each taking a share of the users")
+    partitions = commands.add_parser("ensure-partitions", help="create the monthly workout partitions ahead of time")
+    partitions.add_argument("--months-ahead", type=int, default=backend.PARTITION_MONTHS_AHEAD)
+    archive = commands.add_parser("archive-partitions", help="move old months of workouts into compressed files")
+    archive.add_argument("--keep-months", type=int, default=backend.ARCHIVE_AFTER_MONTHS,
+                         help="months (including the current one) kept in the database")
+    archive.add_argument("--archive-dir", default=backend.ARCHIVE_DIR)
+    exports = commands.add_parser("export-users", help="export users' data for portability requests")
+    exports.add_argument("--format", choices=export.EXPORT_FORMATS, default="jsonl")
+    exports.add_argument("--output-dir", required=True)
+    exports.add_argument("--workers", type=int, default=1, help="worker processes exporting users in parallel")
+    exports.add_argument("--user-id", type=int, action="append", help="export only this user; repeat for several")
+    drain = commands.add_parser("drain-queue", help="write the queued workouts of write-behind mode")
+    drain.add_argument("--batch-size", type=int, default=write_queue.QUEUE_BATCH_SIZE)
+    drain.add_argument("--follow", action="store_true", help="keep draining as workouts arrive until interrupted")
+    prune = commands.add_parser("prune-submissions", help="forget the idempotency keys of old submissions")
+    prune.add_argument("--keep-days", type=int, default=backend.SUBMISSION_KEY_RETENTION_DAYS)
+    leaderboards = commands.add_parser("refresh-leaderboards", help="rank every user on the global leaderboards")
+    leaderboards.add_argument("--periods", nargs="+", choices=backend.LEADERBOARD_PERIODS,
+                              default=list(backend.LEADERBOARD_PERIODS))
+    inboxes = commands.add_parser("refresh-feed-inboxes", help="give heavy users feed inboxes and trim them")
+    inboxes.add_argument("--min-friends", type=int, default=backend.FEED_INBOX_MIN_FRIENDS,
+                         help="friends a user needs to get an inbox")
+    inboxes.add_argument("--size", type=int, default=backend.FEED_INBOX_SIZE, help="workouts kept in each inbox")
+    args = parser.parse_args(argv)
+    # Backend logs its errors and the archive progress; show them on the terminal
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    settings = dict(backend.load_config(args.config), statement_timeout_ms=0)
+    if args.database:
+        settings["database"] = args.database
+    # Batch jobs work through every user at once; no interactive statement timeout
+    backend.configure(**settings)
+
+    if args.command == "evaluate-goals":
+        started = time.perf_counter()
+        result = evaluate_all_goals(args.workers)
+        if result is None:
+            return 1
+        print(f"Evaluated {result[0]} goals, completed {result[1]} in {time.perf_counter() - started:.1f}s")
+        return 0
+
+    if args.command == "ensure-partitions":
+        created = backend.ensure_partitions(args.months_ahead)
+        if created is None:
+            return 1
+        print(f"Created partitions for {created} months")
+        return 0
+
+    if args.command == "archive-partitions":
+        started = time.perf_counter()
+        archived = backend.archive_partitions(args.keep_months, args.archive_dir)
+        if archived is None:
+            return 1
+        print(f"Archived {len(archived)} months to {args.archive_dir} in {time.perf_counter() - started:.1f}s"
+              + (f": {', '.join(archived)}" if archived else ""))
+        return 0
+
+    if args.command == "export-users":
+        started = time.perf_counter()
+        result = export_users(args.output_dir, args.format, args.workers, args.user_id)
+        if result is None:
+            return 1
+        exported, failed = result
+        print(f"Exported {exported} users to {args.output_dir} in {time.perf_counter() - started:.1f}s"
+              + (f"; failed: {', '.join(map(str, failed))}" if failed else ""))
+        return 1 if failed else 0
+
+    if args.command == "drain-queue":
+        if args.follow:
+            worker = write_queue.start_worker(args.batch_size)
+            try:
+                while worker.is_alive():
+                    worker.join(60)
+                    print(f"Queue: {write_queue.queue_stats()}")
+            except KeyboardInterrupt:
+                worker.stop()
+            return 0
+        started = time.perf_counter()
+        drained = write_queue.drain(args.batch_size)
+        stats = write_queue.queue_stats()
+        if drained is None:
+            print(f"Stopped after a failed batch; {stats['depth']} workouts are still queued")
+            return 1
+        print(f"Drained {drained} queued workouts in {time.perf_counter() - started:.1f}s; "
+              f"{stats['depth']} queued, {stats['dead']} dead")
+        return 0
+
+    if args.command == "prune-submissions":
+        pruned = backend.prune_workout_submissions(args.keep_days)
+        if pruned is None:
+            return 1
+        print(f"Forgot {pruned} submission keys older than {args.keep_days} days")
+        return 0
+
+    if args.command == "refresh-leaderboards":
+        started = time.perf_counter()
+        ranked = backend.refresh_leaderboards(args.periods)
+        if ranked is None:
+            return 1
+        for (period, first_day), users in ranked.items():
+            print(f"Ranked {users} users on the {period} leaderboard from {first_day}")
+        print(f"Refreshed {len(ranked)} leaderboards in {time.perf_counter() - started:.1f}s")
+        return 0
+
+    if args.command == "refresh-feed-inboxes":
+        started = time.perf_counter()
+        result = backend.refresh_feed_inboxes(args.min_friends, args.size)
+        if result is None:
+            return 1
+        created, dropped, kept = result
+        print(f"Built {created} feed inboxes, dropped {dropped} and trimmed {created + kept} "
+              f"in {time.perf_counter() - started:.1f}s")
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,457 @@
+import datetime
+import decimal
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import Instrumentation as instrumentation
+
+try:
+    import redis
+except ImportError:  # a Redis cache is optional; SQLiteStore needs nothing extra
+    redis = None
+
+# Returned by LRUCache.lookup() when a key is absent or expired, so None can be cached.
+MISS = object()
+
+
+class LRUCache:
+    """A thread-safe, size-bounded LRU cache with per-namespace TTLs.
+
+    Keys are tuples that start with (namespace, owner), e.g. ("friends", user_id)
+    or ("leaderboard", user_id, "week", 0). invalidate(namespace, owner) drops
+    every key with that prefix and bumps its version; store() ignores values
+    read under an older version, so a read that raced a write cannot cache stale data.
+    """
+
+    def __init__(self, max_entries=1024, ttls=None, default_ttl=60.0):
+        self.max_entries = max_entries
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires_at, value), least recently used first
+        self._owners = {}               # (namespace, owner) -> set of keys
+        self._versions = {}             # (namespace, owner) -> invalidation count
+        self._namespace_versions = {}   # namespace -> invalidation count
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0, "stale_stores": 0}
+
+    def _version(self, key):
+        return (self._namespace_versions.get(key[0], 0), self._versions.get(key[:2], 0))
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._owners.get(key[:2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._owners[key[:2]]
+
+    def lookup(self, key):
+        """Returns (value, version); value is MISS if the key is absent or expired.
+
+        Pass the version back to store() with the freshly loaded value.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[1], self._version(key)
+                self._remove(key)
+                self._stats["expired"] += 1
+            self._stats["misses"] += 1
+            return MISS, self._version(key)
+
+    def store(self, key, value, version):
+        """Caches a value loaded after lookup() returned `version`, unless the key was invalidated since."""
+        if self.max_entries <= 0:
+            return
+        ttl = self.ttls.get(key[0], self.default_ttl)
+        with self._lock:
+            if self._version(key) != version:
+                self._stats["stale_stores"] += 1
+                return
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            self._owners.setdefault(key[:2], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def release(self, key, version):
+        """Ends a load started by a lookup() miss; SharedCache needs it, here there is nothing to do."""
+
+    def invalidate(self, namespace, owner):
+        """Drops every cached key of one owner in a namespace."""
+        with self._lock:
+            prefix = (namespace, owner)
+            self._versions[prefix] = self._versions.get(prefix, 0) + 1
+            for key in list(self._owners.get(prefix, ())):
+                self._remove(key)
+            self._stats["invalidations"] += 1
+
+    def invalidate_many(self, namespaces, owners):
+        """Drops every cached key of each owner in each namespace."""
+        for namespace in namespaces:
+            for owner in owners:
+                self.invalidate(namespace, owner)
+
+    def invalidate_namespace(self, namespace):
+        """Drops every cached key in a namespace."""
+        with self._lock:
+            self._namespace_versions[namespace] = self._namespace_versions.get(namespace, 0) + 1
+            for key in [key for key in self._entries if key[0] == namespace]:
+                self._remove(key)
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        """Drops every entry; counters are kept."""
+        with self._lock:
+            for namespace in {key[0] for key in self._entries}:
+                self._namespace_versions[namespace] = self._namespace_versions.get(namespace, 0) + 1
+            self._entries.clear()
+            self._owners.clear()
+
+    def stats(self):
+        """Returns hit/miss counters and the current size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+# --- SHARED CACHE ---
+# Processes serving the same app (several Streamlit processes behind a load balancer)
+# can share one cache, so a leaderboard read by one is a hit in all of them. Entries
+# live in a store every process reaches: a Redis server, or a SQLite file for processes
+# on one host.
+
+CACHE_FLIGHT_LEASE = 1.0      # seconds other callers wait on a key's loader before loading it themselves
+CACHE_POLL_INTERVAL = 0.01    # seconds between looks at a key someone else is loading
+CACHE_VERSION_TTL = 86400     # seconds an untouched version counter is kept; must exceed every entry TTL
+CACHE_PURGE_INTERVAL = 60.0   # seconds between sweeps of expired SQLite entries by each process
+
+
+def _encode(value):
+    """Turns a cached value into plain JSON data, tagging the types JSON lacks.
+
+    Entries hold data only, never pickles, so a process that can write to the store
+    cannot make the others run code. Dicts are tagged too, since their keys need not be strings.
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, tuple):
+        return {"t": [_encode(item) for item in value]}
+    if isinstance(value, dict):
+        return {"m": [[_encode(k), _encode(v)] for k, v in value.items()]}
+    if isinstance(value, datetime.datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"d": value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {"n": str(value)}
+    raise TypeError(f"Cannot keep a {type(value).__name__} in the shared cache")
+
+_DECODERS = {
+    "t": lambda items: tuple(_decode(item) for item in items),
+    "m": lambda pairs: {_decode(k): _decode(v) for k, v in pairs},
+    "dt": datetime.datetime.fromisoformat,
+    "d": datetime.date.fromisoformat,
+    "n": decimal.Decimal,
+}
+
+def _decode(data):
+    """Reverses _encode()."""
+    if isinstance(data, list):
+        return [_decode(item) for item in data]
+    if isinstance(data, dict):
+        (tag, payload), = data.items()
+        return _DECODERS[tag](payload)
+    return data
+
+
+class SQLiteStore:
+    """Cache entries in a SQLite file in WAL mode, shared by the processes of one host."""
+
+    name = "sqlite"
+    errors = (sqlite3.Error,)
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()   # one SQLite connection per thread
+        self._purged_at = time.monotonic()
+        self._db().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS entries_expires_idx ON entries (expires_at);
+            """
+        )
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL;")
+            # Losing the last entries in a power cut only costs reads
+            db.execute("PRAGMA synchronous=NORMAL;")
+            self._local.db = db
+        return db
+
+    def get_many(self, keys):
+        """Returns the unexpired values of some keys, None for the others."""
+        rows = dict(self._db().execute(
+            f"SELECT key, value FROM entries WHERE key IN ({', '.join('?' * len(keys))}) AND expires_at > ?;",
+            (*keys, time.time())
+        ).fetchall())
+        return [rows.get(key) for key in keys]
+
+    def set(self, key, value, ttl):
+        self._db().execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?);", (key, value, time.time() + ttl))
+        if time.monotonic() - self._purged_at > CACHE_PURGE_INTERVAL:
+            self._purged_at = time.monotonic()
+            self._db().execute("DELETE FROM entries WHERE expires_at <= ?;", (time.time(),))
+
+    def add(self, key, value, ttl):
+        """Sets a key unless it holds an unexpired value; returns whether it did."""
+        now = time.time()
+        cursor = self._db().execute(
+            """
+            INSERT INTO entries VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+            WHERE entries.expires_at <= ?;
+            """,
+            (key, value, now + ttl, now)
+        )
+        return cursor.rowcount == 1
+
+    def incr_many(self, keys, ttl):
+        """Adds one to integer keys (absent or expired ones count as 0) and keeps them for `ttl` seconds."""
+        now = time.time()
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE;")
+        try:
+            db.executemany(
+                """
+                INSERT INTO entries VALUES (?, 1, ?)
+                ON CONFLICT (key) DO UPDATE
+                SET value = CASE WHEN entries.expires_at > ? THEN entries.value + 1 ELSE 1 END,
+                    expires_at = excluded.expires_at;
+                """,
+                [(key, now + ttl, now) for key in keys]
+            )
+            db.execute("COMMIT;")
+        except sqlite3.Error:
+            db.execute("ROLLBACK;")
+            raise
+
+    def delete(self, key):
+        self._db().execute("DELETE FROM entries WHERE key = ?;", (key,))
+
+    def flush(self, prefix):
+        self._db().execute("DELETE FROM entries WHERE key >= ? AND key < ?;", (prefix, prefix + "\uffff"))
+
+
+class RedisStore:
+    """Cache entries in a Redis (or Redis-compatible) server, shared by processes on any host."""
+
+    name = "redis"
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("A Redis cache needs the redis package; install it or use a SQLite cache file.")
+        self.url = url
+        self._redis = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+        self.errors = (redis.RedisError,)
+
+    def get_many(self, keys):
+        return self._redis.mget(keys)
+
+    def set(self, key, value, ttl):
+        self._redis.set(key, value, px=int(ttl * 1000))
+
+    def add(self, key, value, ttl):
+        return bool(self._redis.set(key, value, px=int(ttl * 1000), nx=True))
+
+    def incr_many(self, keys, ttl):
+        pipe = self._redis.pipeline()
+        for key in keys:
+            pipe.incr(key)
+            pipe.expire(key, int(ttl))
+        pipe.execute()
+
+    def delete(self, key):
+        self._redis.delete(key)
+
+    def flush(self, prefix):
+        keys = list(self._redis.scan_iter(match=prefix + "*", count=1000))
+        for start in range(0, len(keys), 1000):
+            self._redis.delete(*keys[start:start + 1000])
+
+
+def open_store(url):
+    """Opens the store a cache URL names: redis://, rediss:// or unix:// for Redis, else a SQLite file path."""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url)
+    return SQLiteStore(url[len("sqlite:///"):] if url.startswith("sqlite:///") else url)
+
+
+class SharedCache:
+    """A cache kept in a store that several processes share, with the interface of LRUCache.
+
+    Each entry is saved with the versions of its namespace and its (namespace, owner)
+    prefix, which are counters in the store. invalidate() only bumps a counter, so
+    every process stops serving the owner's entries at once, and an entry stored with
+    versions read before a write no longer matches. Superseded entries expire by TTL.
+
+    A miss takes a short lease on the key (single-flight): the one caller holding it
+    loads the value while other callers, in any process, wait for it to be stored
+    instead of all reading the database at once. The loader calls release() when it
+    is done, stored or not, in a finally; if its process dies first, the lease runs
+    out after CACHE_FLIGHT_LEASE seconds and the next caller loads. Entries are
+    stored as JSON. Store errors count as misses, so an unreachable cache slows pages
+    down without breaking them.
+    """
+
+    def __init__(self, store, ttls=None, default_ttl=60.0, prefix="fitness:",
+                 lease=CACHE_FLIGHT_LEASE, poll_interval=CACHE_POLL_INTERVAL):
+        self._store = store
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_entries = None   # bounded by the store (Redis maxmemory) and the TTLs
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "stale": 0, "invalidations": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _version_keys(self, key):
+        return self.prefix + "v:" + repr(key[:1]), self.prefix + "v:" + repr(key[:2])
+
+    def _lease_key(self, key, version):
+        return f"{self.prefix}l:{key!r}:{version}"
+
+    def _read(self, key):
+        """Returns (value or MISS, current version) in one round trip to the store."""
+        entry, namespace_version, owner_version = self._store.get_many(
+            [self.prefix + "e:" + repr(key), *self._version_keys(key)]
+        )
+        version = (int(namespace_version or 0), int(owner_version or 0))
+        if entry is None:
+            return MISS, version
+        try:
+            stored_version, value = json.loads(entry)
+            stored_version, value = tuple(stored_version), _decode(value)
+        except (ValueError, TypeError, KeyError):
+            # Written by an older release or damaged; load it again
+            self._count("stale")
+            return MISS, version
+        if stored_version != version:
+            self._count("stale")
+            return MISS, version
+        return value, version
+
+    def lookup(self, key):
+        """Returns (value, version); value is MISS if the caller should load the key and store() it.
+
+        Blocks while another caller is loading the key, for up to CACHE_FLIGHT_LEASE seconds.
+        """
+        try:
+            value, version = self._read(key)
+            if value is not MISS:
+                self._count("hits")
+                return value, version
+            while not self._store.add(self._lease_key(key, version), b"1", self.lease):
+                time.sleep(self.poll_interval)
+                value, version = self._read(key)
+                if value is not MISS:
+                    self._count("coalesced")
+                    return value, version
+            self._count("misses")
+            return MISS, version
+        except self._store.errors:
+            instrumentation.logger.exception("Error reading the shared cache")
+            self._count("errors")
+            return MISS, None
+
+    def store(self, key, value, version):
+        """Caches a value loaded after lookup() returned `version`; invalidations since then make it unreachable."""
+        if version is None:
+            return
+        try:
+            self._store.set(self.prefix + "e:" + repr(key), json.dumps([version, _encode(value)]),
+                            self.ttls.get(key[0], self.default_ttl))
+        except (TypeError, *self._store.errors):
+            instrumentation.logger.exception("Error writing the shared cache")
+            self._count("errors")
+
+    def release(self, key, version):
+        """Gives up the lease a lookup() miss took, so callers waiting on the key stop waiting; call it in a finally."""
+        if version is None:
+            return
+        try:
+            self._store.delete(self._lease_key(key, version))
+        except self._store.errors:
+            instrumentation.logger.exception("Error writing the shared cache")
+            self._count("errors")
+
+    def _bump(self, keys):
+        try:
+            self._store.incr_many(keys, CACHE_VERSION_TTL)
+            with self._lock:
+                self._stats["invalidations"] += len(keys)
+        except self._store.errors:
+            # The entries stay servable until their TTL runs out
+            instrumentation.logger.exception("Error invalidating the shared cache")
+            self._count("errors")
+
+    def invalidate(self, namespace, owner):
+        """Stops serving every cached key of one owner in a namespace, in every process."""
+        self._bump([self._version_keys((namespace, owner))[1]])
+
+    def invalidate_many(self, namespaces, owners):
+        """Stops serving every cached key of each owner in each namespace, in one round trip."""
+        self._bump([self._version_keys((namespace, owner))[1] for namespace in namespaces for owner in owners])
+
+    def invalidate_namespace(self, namespace):
+        """Stops serving every cached key in a namespace."""
+        self._bump([self._version_keys((namespace,))[0]])
+
+    def clear(self):
+        """Drops every entry of this cache from the store; counters are kept."""
+        try:
+            # Version counters stay, so a value loaded before the clear is still refused
+            self._store.flush(self.prefix + "e:")
+        except self._store.errors:
+            instrumentation.logger.exception("Error clearing the shared cache")
+            self._count("errors")
+
+    def stats(self):
+        """Returns this process's hit/miss counters; `coalesced` lookups waited for another caller's load."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["store"] = self._store.name
+        stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = (stats["hits"] + stats["coalesced"]) / lookups if lookups else 0.0
+        return stats
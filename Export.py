@@ -0,0 +1,250 @@
+import csv
+import datetime
+import decimal
+import gzip
+import json
+import os
+
+import psycopg2
+
+import Backend as backend
+import Instrumentation as instrumentation
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet exports are optional
+    pa = pq = None
+
+# --- SETTINGS ---
+
+EXPORT_FORMATS = ("jsonl", "csv", "parquet")
+EXPORT_COMPRESSLEVEL = 6          # gzip level of JSON-lines and CSV files; 9 saves little on this data
+PARQUET_COMPRESSION = "gzip"      # codec of Parquet pages, which compress column by column themselves
+
+# --- SECTIONS ---
+# An export holds one user's rows of each section, in this order. Each section lists
+# its columns as (name, kind), and its query takes the user ID once per %s. Workouts
+# and exercises also include the months moved out by Backend.archive_partitions.
+
+EXPORT_SECTIONS = {
+    "profile": (
+        (("user_id", "int"), ("name", "text"), ("email", "text"), ("weight_kg", "decimal"), ("created_at", "timestamp")),
+        "SELECT user_id, name, email, weight_kg, created_at FROM Users WHERE user_id = %s",
+    ),
+    "workouts": (
+        (("workout_id", "int"), ("workout_date", "date"), ("duration_minutes", "int"), ("created_at", "timestamp")),
+        "SELECT workout_id, workout_date, duration_minutes, created_at FROM Workouts WHERE user_id = %s ORDER BY workout_date, workout_id",
+    ),
+    "exercises": (
+        (("exercise_id", "int"), ("workout_id", "int"), ("workout_date", "date"), ("exercise_name", "text"),
+         ("sets", "int"), ("reps", "int"), ("weight_kg", "decimal")),
+        """SELECT E.exercise_id, E.workout_id, E.workout_date, E.exercise_name, E.sets, E.reps, E.weight_kg
+           FROM Workouts W JOIN Exercises E ON E.workout_id = W.workout_id AND E.workout_date = W.workout_date
+           WHERE W.user_id = %s ORDER BY W.workout_date, W.workout_id, E.exercise_id""",
+    ),
+    "goals": (
+        (("goal_id", "int"), ("goal_description", "text"), ("metric", "text"), ("target_value", "int"),
+         ("progress_value", "numeric"), ("start_date", "date"), ("end_date", "date"), ("is_completed", "bool"),
+         ("evaluated_at", "timestamp")),
+        "SELECT goal_id, goal_description, metric, target_value, progress_value, start_date, end_date, is_completed, evaluated_at FROM Goals WHERE user_id = %s ORDER BY goal_id",
+    ),
+    "friends": (
+        (("user_id", "int"), ("name", "text")),
+        f"SELECT U.user_id, U.name FROM ({backend.FRIEND_IDS_SQL}) F JOIN Users U ON U.user_id = F.friend_id ORDER BY U.user_id",
+    ),
+}
+
+# Parsers for values read back from the archive's CSV files; an empty field is NULL
+_PARSERS = {
+    "int": int,
+    "text": str,
+    "date": datetime.date.fromisoformat,
+    "timestamp": datetime.datetime.fromisoformat,
+    "decimal": decimal.Decimal,
+}
+
+def _arrow_type(kind):
+    return {
+        "int": pa.int64(),
+        "text": pa.string(),
+        "date": pa.date32(),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+        "decimal": pa.decimal128(5, 2),
+        "numeric": pa.float64(),
+        "bool": pa.bool_(),
+    }[kind]
+
+def _json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Cannot export {type(value).__name__}")
+
+# --- READING ---
+
+def _archived_rows(user_id, section, directory):
+    """Yields a user's archived rows of "workouts" or "exercises" as the archive's CSV dicts, oldest month first.
+
+    Archived months are older than every month still in the database, so yielding
+    them first keeps an export in date order.
+    """
+    manifest = backend._load_manifest(directory)
+    for label in sorted(manifest):
+        for part in manifest[label]:
+            workouts = []
+            for row in backend._read_archive_csv(directory, part["workouts"]):
+                row_user = int(row["user_id"])
+                if row_user < user_id:
+                    continue
+                if row_user > user_id:
+                    break
+                workouts.append(row)
+            if not workouts:
+                continue
+            if section == "workouts":
+                # The file lists each user's workouts newest first
+                yield from reversed(workouts)
+                continue
+            workout_ids = {int(row["workout_id"]) for row in workouts}
+            last_wanted = max(workout_ids)
+            for row in backend._read_archive_csv(directory, part["exercises"]):
+                workout_id = int(row["workout_id"])
+                if workout_id > last_wanted:
+                    break
+                if workout_id in workout_ids:
+                    yield row
+
+def _parse_archived(columns, row):
+    return tuple(_PARSERS[kind](row[name]) if row[name] != "" else None for name, kind in columns)
+
+def _user_rows(conn, user_id, section, archive_dir):
+    """Yields a user's rows of one section as tuples: archived ones first, then a server-side cursor's."""
+    columns, sql = EXPORT_SECTIONS[section]
+    if section in ("workouts", "exercises"):
+        for row in _archived_rows(user_id, section, archive_dir):
+            yield _parse_archived(columns, row)
+    cur = backend.server_cursor(conn)
+    try:
+        cur.execute(sql + ";", (user_id,) * sql.count("%s"))
+        yield from cur
+    finally:
+        cur.close()
+
+def _begin_snapshot(conn):
+    """Makes every section of an export read the same snapshot of the database."""
+    cur = conn.cursor()
+    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;")
+    cur.close()
+
+# --- WRITERS ---
+
+def _write_jsonl(conn, user_id, path, archive_dir):
+    """Writes every section into one gzipped JSON-lines file; each line carries its "section"."""
+    counts = {}
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=EXPORT_COMPRESSLEVEL) as f:
+        for section, (columns, _) in EXPORT_SECTIONS.items():
+            names = [name for name, _ in columns]
+            counts[section] = 0
+            for row in _user_rows(conn, user_id, section, archive_dir):
+                record = {"section": section, **dict(zip(names, row))}
+                f.write(json.dumps(record, default=_json_value, ensure_ascii=False) + "\n")
+                counts[section] += 1
+    return counts
+
+def _write_csv(conn, user_id, path, section, archive_dir):
+    """Writes one section into a gzipped CSV file, streaming the database rows with COPY."""
+    columns, sql = EXPORT_SECTIONS[section]
+    rows = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=EXPORT_COMPRESSLEVEL) as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(name for name, _ in columns)
+        # Archived rows are already in COPY's CSV text form, so they are written as read
+        if section in ("workouts", "exercises"):
+            for row in _archived_rows(user_id, section, archive_dir):
+                writer.writerow(row[name] for name, _ in columns)
+                rows += 1
+        cur = conn.cursor()
+        try:
+            # COPY takes no parameters, so the user ID is bound into the query text
+            query = cur.mogrify(sql, (user_id,) * sql.count("%s")).decode()
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv);", f)
+            rows += cur.rowcount
+        finally:
+            cur.close()
+    return rows
+
+def _arrow_table(schema, columns, rows):
+    """Builds an Arrow table of some rows of a section, column by column."""
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return pa.table([
+        pa.array([float(value) if kind == "numeric" and value is not None else value for value in column],
+                 type=_arrow_type(kind))
+        for (_, kind), column in zip(columns, values)
+    ], schema=schema)
+
+def _write_parquet(conn, user_id, path, section, archive_dir):
+    """Writes one section into a Parquet file, one row group per CURSOR_ITERSIZE rows."""
+    columns, _ = EXPORT_SECTIONS[section]
+    schema = pa.schema([(name, _arrow_type(kind)) for name, kind in columns])
+    rows, batch = 0, []
+    with pq.ParquetWriter(path, schema, compression=PARQUET_COMPRESSION) as writer:
+        for row in _user_rows(conn, user_id, section, archive_dir):
+            batch.append(row)
+            if len(batch) >= backend.CURSOR_ITERSIZE:
+                writer.write_table(_arrow_table(schema, columns, batch))
+                rows += len(batch)
+                batch = []
+        # An empty section still gets a file with its schema
+        if batch or not rows:
+            writer.write_table(_arrow_table(schema, columns, batch))
+            rows += len(batch)
+    return rows
+
+# --- EXPORT ---
+
+def export_filenames(user_id, format="jsonl"):
+    """Returns the names of the files export_user writes for a user, in section order."""
+    if format == "jsonl":
+        return [f"user_{user_id}.jsonl.gz"]
+    extension = "csv.gz" if format == "csv" else "parquet"
+    return [f"user_{user_id}_{section}.{extension}" for section in EXPORT_SECTIONS]
+
+@instrumentation.traced
+def export_user(user_id, directory, format="jsonl", archive_dir=backend.ARCHIVE_DIR):
+    """R: Exports a user's profile, workouts, exercises, goals and friends into `directory`.
+
+    `format` is one of EXPORT_FORMATS: "jsonl" writes one gzipped JSON-lines file,
+    "csv" one gzipped CSV file per section and "parquet" one Parquet file per section
+    (this needs pyarrow). Rows stream from the database a batch at a time, so memory
+    use does not grow with the user's history, and all sections come from one snapshot.
+    Returns the paths written, or None on failure (partial files are removed).
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {EXPORT_FORMATS}, not {format!r}")
+    if format == "parquet" and pa is None:
+        raise RuntimeError("Parquet exports need pyarrow; install it or export JSON lines or CSV.")
+    paths = [os.path.join(directory, filename) for filename in export_filenames(user_id, format)]
+    conn = None
+    try:
+        conn = backend.get_read_connection(user_id)
+        if not conn: return None
+        _begin_snapshot(conn)
+        if format == "jsonl":
+            _write_jsonl(conn, user_id, paths[0], archive_dir)
+        else:
+            write = _write_csv if format == "csv" else _write_parquet
+            for section, path in zip(EXPORT_SECTIONS, paths):
+                write(conn, user_id, path, section, archive_dir)
+        conn.commit()
+        return paths
+    except (psycopg2.Error, OSError):
+        instrumentation.logger.exception("Error exporting user %s", user_id)
+        if conn: conn.rollback()
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        return None
+    finally:
+        backend.close_db_connection(conn, None)
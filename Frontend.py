@@ -1,6 +1,45 @@
 import streamlit as st
 import Backend as backend
+import AsyncBackend as async_backend
+import Instrumentation as instrumentation
+import Analytics as analytics
+import Export as export
+import WriteQueue as write_queue
+import asyncio
 import datetime
+import os
+import shutil
+import tempfile
+import time
+import pandas as pd
+
+HISTORY_PAGE_SIZE = 10
+FRIENDS_PAGE_SIZE = 20
+FEED_PAGE_SIZE = 10
+GOALS_PAGE_SIZE = 10
+# Seconds a page reuses its data before reading it again, so other users' changes show up
+PAGE_DATA_TTL = 60
+GOAL_METRIC_LABELS = {
+    "manual": "Tracked by hand",
+    "workouts": "Number of workouts",
+    "minutes": "Workout minutes",
+    "volume": "Training volume (kg)",
+}
+EXPORT_FORMAT_LABELS = {
+    "jsonl": "JSON lines (one file)",
+    "csv": "CSV (one file per section)",
+    "parquet": "Parquet (one file per section)",
+}
+EXPORT_MIME_TYPES = {"jsonl": "application/gzip", "csv": "application/gzip", "parquet": "application/vnd.apache.parquet"}
+LEADERBOARD_WINDOWS = {
+    "This week": ("week", 0),
+    "Last week": ("week", 1),
+    "This month": ("month", 0),
+    "Last month": ("month", 1),
+    "Last 7 days": ("7d", 0),
+    "Last 30 days": ("30d", 0),
+}
+LEADERBOARD_SCOPES = {"Friends": "friends", "Everyone": "global"}
 
 # --- HELPER FUNCTIONS FOR UI ---
 def get_user_id():
@@ -11,44 +50,281 @@ def get_user_name():
     """Gets the user name from session state."""
     return st.session_state.get('user_name')
 
+def flash(kind, message):
+    """Queues a message ("success", "error"...) to show on the next render; callbacks run before the page is drawn."""
+    st.session_state.setdefault('flash', []).append((kind, message))
+
+def show_flash():
+    """Draws and clears the queued messages."""
+    for kind, message in st.session_state.pop('flash', []):
+        getattr(st, kind)(message)
+
+def page_cursor(name):
+    """Gets the keyset cursor of the page of a paginated list that is on screen."""
+    # Each entry is the cursor that starts a page; the last one is the page on screen
+    return st.session_state.setdefault(f"{name}_cursors", [None])[-1]
+
+def page_controls(name, next_cursor, previous_label="← Previous", next_label="Next →"):
+    """Draws buttons that move a paginated list one page back or forward."""
+    cursors = st.session_state[f"{name}_cursors"]
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(cursors) > 1:
+            st.button(previous_label, key=f"{name}_previous", on_click=cursors.pop)
+    with col2:
+        if next_cursor:
+            st.button(next_label, key=f"{name}_next", on_click=cursors.append, args=(next_cursor,))
+
+def step_back_if_empty(name):
+    """Steps back a page when the page on screen emptied out, e.g. after someone else deleted its rows.
+
+    Call it where the list is empty; on a later page it reruns the script and does not return.
+    """
+    cursors = st.session_state[f"{name}_cursors"]
+    if len(cursors) > 1:
+        cursors.pop()
+        st.rerun()
+
+# --- SESSION DATA LAYER ---
+# Page data is kept in session state, so widget interactions redraw from memory instead
+# of re-running every backend read. Writes patch the cached rows they change or, when
+# their effects reach across pages (a new workout moves records, trends, goals and the
+# leaderboard), bump the data version, which drops everything read before it.
+
+def bump_data_version():
+    """Marks all cached page data stale."""
+    st.session_state.data_version = st.session_state.get('data_version', 0) + 1
+
+def page_data(*requests):
+    """Returns the data of (name, args, load) requests, calling load(*args) only for missing or stale ones.
+
+    Loaders are AsyncBackend coroutine functions, which run concurrently, or plain functions.
+    """
+    version = st.session_state.get('data_version', 0)
+    if st.session_state.get('page_data_version') != version:
+        st.session_state.page_data = {}
+        st.session_state.page_data_version = version
+    store = st.session_state.page_data
+    now = time.monotonic()
+    keys = [(name,) + tuple(args) for name, args, _ in requests]
+    missing = [
+        (key, load) for key, (_, _, load) in zip(keys, requests)
+        if key not in store or now - store[key][0] > PAGE_DATA_TTL
+    ]
+    if missing:
+        values = [load(*key[1:]) for key, load in missing]
+        pending = [i for i, value in enumerate(values) if asyncio.iscoroutine(value)]
+        for i, value in zip(pending, async_backend.run_all(*(values[i] for i in pending))):
+            values[i] = value
+        for (key, _), value in zip(missing, values):
+            store[key] = (now, value)
+    return [store[key][1] for key in keys]
+
+def patch_page_data(name, patch):
+    """Replaces every cached `name` entry with patch(value).
+
+    Cached values may be shared with the backend cache, so patches build new lists
+    and tuples instead of changing them in place.
+    """
+    store = st.session_state.get('page_data', {})
+    for key, (loaded_at, value) in list(store.items()):
+        if key[0] == name:
+            store[key] = (loaded_at, patch(value))
+
+def forget_page_data(*names):
+    """Drops the cached entries of some pages so their next render reads them again."""
+    store = st.session_state.get('page_data', {})
+    for key in [key for key in store if key[0] in names]:
+        del store[key]
+
+def remove_from_page(name, row_id):
+    """Patches a row out of a cached paginated list, stepping back a page if the one on screen empties."""
+    patch_page_data(name, lambda page: ([row for row in page[0] if row[0] != row_id], page[1]))
+    cursor = page_cursor(name)
+    emptied = any(
+        key[0] == name and key[-1] == cursor and not value[0]
+        for key, (_, value) in st.session_state.get('page_data', {}).items()
+    )
+    cursors = st.session_state[f"{name}_cursors"]
+    if emptied and len(cursors) > 1:
+        cursors.pop()
+
+# --- CALLBACKS ---
+# Streamlit runs these before it redraws the page, so a single rerun shows their result.
+
+def log_in():
+    user = backend.read_user_by_email(st.session_state.login_email)
+    if user:
+        st.session_state.user_id = user[0]
+        st.session_state.user_name = user[1]
+        flash("success", f"Welcome back, {user[1]}!")
+    else:
+        flash("error", "User not found. Please register below.")
+
+def register():
+    name = st.session_state.register_name
+    new_id = backend.create_user(name, st.session_state.register_email, st.session_state.register_weight)
+    if new_id:
+        st.session_state.user_id = new_id
+        st.session_state.user_name = name
+        flash("success", f"Successfully registered! Your user ID is {new_id}.")
+    else:
+        flash("error", "Registration failed. Email might already exist.")
+
+def update_profile():
+    name, email, weight = st.session_state.new_name, st.session_state.new_email, st.session_state.new_weight
+    if backend.update_user_profile(get_user_id(), name, email, weight):
+        st.session_state.user_name = name
+        patch_page_data("profile", lambda user: (user[0], name, email, weight))
+        forget_page_data("friends", "leaderboard", "leaderboard_rank")
+        flash("success", "Profile updated successfully!")
+    else:
+        flash("error", "Failed to update profile.")
+
+def log_workout():
+    exercises_list = [
+        {
+            'name': st.session_state[f"name_{i}"],
+            'sets': st.session_state[f"sets_{i}"],
+            'reps': st.session_state[f"reps_{i}"],
+            'weight': st.session_state[f"weight_{i}"],
+        }
+        for i in range(st.session_state.num_exercises)
+    ]
+    # The form's key makes a resent form log its workout once
+    submission_key = st.session_state.workout_submission_key
+    if backend.WRITE_BEHIND:
+        try:
+            write_queue.enqueue_workout(get_user_id(), st.session_state.workout_date,
+                                        st.session_state.workout_duration, exercises_list, submission_key)
+        except ValueError as e:
+            flash("error", f"Failed to log workout: {e}.")
+            return
+        # The history is refreshed once the worker has written it (see the dashboard)
+        st.session_state.queued_workouts = st.session_state.get('queued_workouts', 0) + 1
+        del st.session_state.workout_submission_key
+        flash("success", "Workout logged! It will appear in your history in a moment.")
+    elif backend.create_workout_with_exercises(get_user_id(), st.session_state.workout_date,
+                                               st.session_state.workout_duration, exercises_list, submission_key):
+        del st.session_state.workout_submission_key
+        bump_data_version()
+        flash("success", "Workout logged successfully!")
+    else:
+        flash("error", "Failed to log workout.")
+
+def delete_workout(workout_id):
+    if backend.delete_workout(workout_id):
+        remove_from_page("history", workout_id)
+        bump_data_version()
+        flash("success", "Workout deleted.")
+    else:
+        flash("error", "Failed to delete workout.")
+
+def add_friend():
+    friend_email = st.session_state.friend_email
+    if backend.add_friend(get_user_id(), friend_email):
+        forget_page_data("friends", "leaderboard", "leaderboard_rank", "feed")
+        flash("success", f"Friend request sent to {friend_email}!")
+    else:
+        flash("error", f"Could not find a user with email {friend_email} or you are already friends.")
+
+def remove_friend(friend_id, name):
+    if backend.remove_friend(get_user_id(), friend_id):
+        remove_from_page("friends", friend_id)
+        forget_page_data("leaderboard", "leaderboard_rank", "feed")
+        flash("success", f"{name} has been removed from your friends list.")
+    else:
+        flash("error", "Failed to remove friend.")
+
+def create_goal():
+    if backend.create_goal(get_user_id(), st.session_state.goal_description, st.session_state.goal_target,
+                           st.session_state.goal_start_date, st.session_state.goal_end_date,
+                           st.session_state.goal_metric):
+        forget_page_data("goals")
+        flash("success", "Goal set successfully!")
+    else:
+        flash("error", "Failed to set goal.")
+
+def update_goal(goal_id):
+    is_completed = st.session_state[f"chk_{goal_id}"]
+    if backend.update_goal(goal_id, is_completed):
+        patch_page_data("goals", lambda page: (
+            [goal[:3] + (is_completed,) + goal[4:] if goal[0] == goal_id else goal for goal in page[0]],
+            page[1],
+        ))
+        flash("success", "Goal status updated.")
+    else:
+        flash("error", "Failed to update goal status.")
+
+def discard_export():
+    """Deletes the files of a previously prepared export."""
+    directory = st.session_state.pop('export_dir', None)
+    st.session_state.pop('export_files', None)
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def prepare_export():
+    # The export streams into temporary files; only the download buttons hold it in memory
+    discard_export()
+    directory = tempfile.mkdtemp(prefix="fitness-export-")
+    st.session_state.export_dir = directory
+    paths = export.export_user(get_user_id(), directory, st.session_state.export_format)
+    if paths:
+        st.session_state.export_files = (st.session_state.export_format, paths)
+    else:
+        discard_export()
+        flash("error", "Could not export your data.")
+
+def export_file_served(path):
+    """Drops a downloaded file from the prepared export, discarding the export once every file is served."""
+    export_format, paths = st.session_state.export_files
+    remaining = [p for p in paths if p != path]
+    if remaining:
+        st.session_state.export_files = (export_format, remaining)
+    else:
+        discard_export()
+
+def log_out():
+    discard_export()
+    st.session_state.clear()
+
+def delete_goal(goal_id):
+    if backend.delete_goal(goal_id):
+        remove_from_page("goals", goal_id)
+        flash("success", "Goal deleted.")
+    else:
+        flash("error", "Failed to delete goal.")
+
 # --- MAIN PAGE LAYOUT ---
 st.set_page_config(page_title="Personal Fitness Tracker")
 st.title("💪 Fitness Tracker")
 
+# Every rerun is one request; the backend adds each statement it runs to this summary
+request_summary = instrumentation.begin_request()
+
+# In write-behind mode each app process also drains the queue it acknowledges workouts from
+if backend.WRITE_BEHIND:
+    write_queue.start_worker()
+
 # Initialize session state for the user ID
 if 'user_id' not in st.session_state:
     st.session_state.user_id = None
 if 'user_name' not in st.session_state:
     st.session_state.user_name = None
 
+show_flash()
+
 # --- USER LOGIN/REGISTRATION ---
 if not get_user_id():
     st.header("Login or Register")
-    email = st.text_input("Enter your email:")
-    if st.button("Log In"):
-        user = backend.read_user_by_email(email)
-        if user:
-            st.session_state.user_id = user[0]
-            st.session_state.user_name = user[1]
-            st.success(f"Welcome back, {user[1]}!")
-            st.experimental_rerun()
-        else:
-            st.error("User not found. Please register below.")
+    st.text_input("Enter your email:", key="login_email")
+    st.button("Log In", on_click=log_in)
     with st.expander("New User? Register here."):
         with st.form("new_user_form"):
-            name = st.text_input("Name")
-            email_reg = st.text_input("Email")
-            weight = st.number_input("Weight (kg)", min_value=1.0)
-            submitted = st.form_submit_button("Register")
-            if submitted:
-                new_id = backend.create_user(name, email_reg, weight)
-                if new_id:
-                    st.success(f"Successfully registered! Your user ID is {new_id}.")
-                    st.session_state.user_id = new_id
-                    st.session_state.user_name = name
-                    st.experimental_rerun()
-                else:
-                    st.error("Registration failed. Email might already exist.")
+            st.text_input("Name", key="register_name")
+            st.text_input("Email", key="register_email")
+            st.number_input("Weight (kg)", min_value=1.0, key="register_weight")
+            st.form_submit_button("Register", on_click=register)
 
 # --- APPLICATION SECTIONS (Logged-in view) ---
 else:
@@ -57,14 +333,33 @@ else:
         "Navigation",
         ["Dashboard", "Log Workout", "Friends & Leaderboard", "Goals"]
     )
-    st.sidebar.button("Logout", on_click=lambda: st.session_state.clear())
+    st.sidebar.button("Logout", on_click=log_out)
 
     # --- DASHBOARD & PROFILE (READ/UPDATE) ---
     if selected_page == "Dashboard":
         st.header("Your Dashboard")
 
+        if backend.WRITE_BEHIND:
+            waiting, dead = write_queue.pending_workouts(get_user_id())
+            # Queued workouts written since the last render belong in the history now
+            if waiting < st.session_state.get('queued_workouts', 0):
+                bump_data_version()
+            st.session_state.queued_workouts = waiting
+            if waiting:
+                st.info(f"{waiting} logged workout(s) are still being saved.")
+            if dead:
+                st.warning(f"{dead} logged workout(s) could not be saved. Please log them again.")
+
+        # The profile, the visible history page (its exercises fetched in one batch) and the
+        # records are independent, so they load concurrently; later reruns reuse them until a write or PAGE_DATA_TTL makes them stale
+        user_data, (workouts, next_cursor), records, trends = page_data(
+            ("profile", (get_user_id(),), async_backend.read_user),
+            ("history", (get_user_id(), HISTORY_PAGE_SIZE, page_cursor("history")), async_backend.read_workout_history),
+            ("records", (get_user_id(),), async_backend.read_personal_records),
+            ("trends", (get_user_id(),), analytics.read_training_analytics),
+        )
+
         # Display user profile
-        user_data = backend.read_user_by_email(st.session_state.user_name)
         if user_data:
             st.subheader("Your Profile")
             st.write(f"**Name:** {user_data[1]}")
@@ -74,68 +369,94 @@ else:
             # Update Profile form
             with st.form("update_profile_form"):
                 st.subheader("Update Profile")
-                new_name = st.text_input("New Name", value=user_data[1])
-                new_email = st.text_input("New Email", value=user_data[2])
-                new_weight = st.number_input("New Weight (kg)", value=user_data[3], min_value=1.0)
-                if st.form_submit_button("Update"):
-                    if backend.update_user_profile(get_user_id(), new_name, new_email, new_weight):
-                        st.session_state.user_name = new_name
-                        st.success("Profile updated successfully!")
-                        st.experimental_rerun()
-                    else:
-                        st.error("Failed to update profile.")
+                st.text_input("New Name", value=user_data[1], key="new_name")
+                st.text_input("New Email", value=user_data[2], key="new_email")
+                st.number_input("New Weight (kg)", value=float(user_data[3]), min_value=1.0, key="new_weight")
+                st.form_submit_button("Update", on_click=update_profile)
         else:
             st.error("Could not load user data.")
 
+        with st.expander("Export your data"):
+            st.write("Download your profile, workouts, exercises, goals and friends list.")
+            # Parquet needs the optional pyarrow package
+            formats = [name for name in export.EXPORT_FORMATS if name != "parquet" or export.pa is not None]
+            st.selectbox("Format", formats, format_func=EXPORT_FORMAT_LABELS.get, key="export_format")
+            st.button("Prepare export", on_click=prepare_export)
+            # Only files not yet downloaded get a button; the button reads the open file when it renders
+            if 'export_files' in st.session_state:
+                export_format, paths = st.session_state.export_files
+                for path in paths:
+                    filename = os.path.basename(path)
+                    with open(path, "rb") as f:
+                        st.download_button(f"Download {filename}", f, file_name=filename,
+                                           mime=EXPORT_MIME_TYPES[export_format], key=f"download_{filename}",
+                                           on_click=export_file_served, args=(path,))
+
+        st.subheader("Training Trends")
+        if trends and trends["rows"]:
+            volume = pd.DataFrame(trends["weekly_volume"], columns=["Week", "Exercise", "Volume (kg)"])
+            st.write("**Weekly volume** (sets × reps × weight)")
+            st.bar_chart(volume, x="Week", y="Volume (kg)", color="Exercise")
+
+            e1rm = pd.DataFrame(trends["e1rm_progression"], columns=["Week", "Exercise", "Estimated 1RM (kg)"])
+            if not e1rm.empty:
+                exercise = st.selectbox("Estimated 1RM progression for", sorted(e1rm["Exercise"].unique()))
+                st.line_chart(e1rm[e1rm["Exercise"] == exercise], x="Week", y="Estimated 1RM (kg)")
+
+            if records:
+                st.write("**Personal records**")
+                st.dataframe(
+                    pd.DataFrame(records, columns=[
+                        "Exercise", "Times logged", "Total volume (kg)", "Heaviest (kg)", "Lifted on",
+                        "Best est. 1RM (kg)", "Reached on", "Last performed",
+                    ]),
+                    hide_index=True,
+                )
+        elif trends is None:
+            st.error("Could not load training trends.")
+        else:
+            st.info("Log some exercises to see your training trends.")
+
         st.subheader("Your Workout History")
-        workouts = backend.read_workouts(get_user_id())
         if workouts:
             for workout in workouts:
-                workout_id, date, duration = workout
+                workout_id, date, duration, exercises = workout
                 with st.expander(f"Workout on {date} - {duration} minutes"):
                     st.write(f"**Duration:** {duration} minutes")
-                    exercises = backend.read_exercises_for_workout(workout_id)
                     st.markdown("---")
                     st.subheader("Exercises")
                     if exercises:
                         for exercise in exercises:
                             name, sets, reps, weight = exercise
                             st.write(f"- **{name}**: {sets} sets, {reps} reps, {weight} kg")
-                        if st.button("Delete Workout", key=f"del_wk_{workout_id}"):
-                            if backend.delete_workout(workout_id):
-                                st.success("Workout deleted.")
-                                st.experimental_rerun()
-                            else:
-                                st.error("Failed to delete workout.")
                     else:
                         st.info("No exercises logged for this workout.")
+                    st.button("Delete Workout", key=f"del_wk_{workout_id}", on_click=delete_workout, args=(workout_id,))
+
+            page_controls("history", next_cursor, "← Newer", "Older →")
         else:
+            step_back_if_empty("history")
             st.info("You haven't logged any workouts yet.")
 
     # --- LOG WORKOUT (CREATE) ---
     elif selected_page == "Log Workout":
         st.header("Log a New Workout")
+        if 'workout_submission_key' not in st.session_state:
+            st.session_state.workout_submission_key = write_queue.new_submission_key()
         with st.form("new_workout_form"):
-            workout_date = st.date_input("Date", datetime.date.today())
-            duration = st.number_input("Duration (minutes)", min_value=1)
+            st.date_input("Date", datetime.date.today(), key="workout_date")
+            st.number_input("Duration (minutes)", min_value=1, key="workout_duration")
             
             st.subheader("Exercises")
-            num_exercises = st.number_input("Number of exercises", min_value=1, value=1)
-            exercises_list = []
+            num_exercises = st.number_input("Number of exercises", min_value=1, value=1, key="num_exercises")
             for i in range(num_exercises):
                 st.markdown(f"**Exercise {i+1}**")
-                name = st.text_input("Exercise Name", key=f"name_{i}")
-                sets = st.number_input("Sets", min_value=1, key=f"sets_{i}")
-                reps = st.number_input("Reps", min_value=1, key=f"reps_{i}")
-                weight = st.number_input("Weight (kg)", min_value=0.0, key=f"weight_{i}")
-                exercises_list.append({'name': name, 'sets': sets, 'reps': reps, 'weight': weight})
+                st.text_input("Exercise Name", key=f"name_{i}")
+                st.number_input("Sets", min_value=1, key=f"sets_{i}")
+                st.number_input("Reps", min_value=1, key=f"reps_{i}")
+                st.number_input("Weight (kg)", min_value=0.0, key=f"weight_{i}")
             
-            submitted = st.form_submit_button("Log Workout")
-            if submitted:
-                if backend.create_workout_with_exercises(get_user_id(), workout_date, duration, exercises_list):
-                    st.success("Workout logged successfully!")
-                else:
-                    st.error("Failed to log workout.")
+            st.form_submit_button("Log Workout", on_click=log_workout)
     
     # --- FRIENDS & LEADERBOARD (CREATE/READ/DELETE) ---
     elif selected_page == "Friends & Leaderboard":
@@ -143,15 +464,22 @@ else:
         
         with st.form("add_friend_form"):
             st.subheader("Add a Friend")
-            friend_email = st.text_input("Friend's Email")
-            if st.form_submit_button("Add Friend"):
-                if backend.add_friend(get_user_id(), friend_email):
-                    st.success(f"Friend request sent to {friend_email}!")
-                else:
-                    st.error(f"Could not find a user with email {friend_email} or you are already friends.")
+            st.text_input("Friend's Email", key="friend_email")
+            st.form_submit_button("Add Friend", on_click=add_friend)
+
+        # The leaderboard widgets are drawn further down; read their last values now so
+        # the friends list, the leaderboard and the feed can be fetched concurrently
+        window = st.session_state.get("leaderboard_window", next(iter(LEADERBOARD_WINDOWS)))
+        scope = LEADERBOARD_SCOPES[st.session_state.get("leaderboard_scope", next(iter(LEADERBOARD_SCOPES)))]
+        board = (get_user_id(),) + LEADERBOARD_WINDOWS[window] + (scope,)
+        (friends, next_cursor), leaderboard_data, place, (feed, feed_cursor) = page_data(
+            ("friends", (get_user_id(), FRIENDS_PAGE_SIZE, page_cursor("friends")), async_backend.read_friends),
+            ("leaderboard", board, async_backend.read_leaderboard),
+            ("leaderboard_rank", board, async_backend.read_leaderboard_rank),
+            ("feed", (get_user_id(), FEED_PAGE_SIZE, page_cursor("feed")), async_backend.read_activity_feed),
+        )
 
         st.subheader("Your Friends List")
-        friends = backend.read_friends(get_user_id())
         if friends:
             for friend in friends:
                 friend_id, name, email = friend
@@ -159,22 +487,49 @@ else:
                 with col1:
                     st.write(f"- {name} ({email})")
                 with col2:
-                    if st.button("Remove", key=f"rem_fr_{friend_id}"):
-                        if backend.remove_friend(get_user_id(), friend_id):
-                            st.success(f"{name} has been removed from your friends list.")
-                            st.experimental_rerun()
-                        else:
-                            st.error("Failed to remove friend.")
+                    st.button("Remove", key=f"rem_fr_{friend_id}", on_click=remove_friend, args=(friend_id, name))
+            page_controls("friends", next_cursor)
         else:
+            step_back_if_empty("friends")
             st.info("You don't have any friends yet.")
 
         st.markdown("---")
-        st.header("Weekly Leaderboard")
-        leaderboard_data = backend.read_leaderboard(get_user_id())
+        st.header("Leaderboard")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.selectbox("Ranking", list(LEADERBOARD_SCOPES), key="leaderboard_scope")
+        with col2:
+            st.selectbox("Window", list(LEADERBOARD_WINDOWS), key="leaderboard_window")
+        if place:
+            rank, total_minutes, ranked_of, ranked_at = place
+            st.metric("Your rank", f"#{rank} of {ranked_of}")
+            st.caption(f"{total_minutes} minutes" + (f" · ranked at {ranked_at:%H:%M}" if ranked_at else ""))
         if leaderboard_data:
-            st.dataframe(leaderboard_data, use_container_width=True)
+            st.dataframe(
+                pd.DataFrame(leaderboard_data, columns=["Rank", "User ID", "Name", "Minutes"]).drop(columns="User ID"),
+                hide_index=True,
+                use_container_width=True,
+            )
+        elif scope == "global":
+            st.info(f"The leaderboard of everyone for {window.lower()} has not been ranked yet. Check back in a few minutes.")
+        else:
+            st.info(f"No leaderboard data available for {window.lower()}. Log a workout to get started!")
+
+        st.markdown("---")
+        st.header("Friends' Activity")
+        if feed:
+            st.dataframe(
+                pd.DataFrame(
+                    [(date, name, duration) for _, date, _, name, duration in feed],
+                    columns=["Date", "Name", "Minutes"],
+                ),
+                hide_index=True,
+                use_container_width=True,
+            )
+            page_controls("feed", feed_cursor, "← Newer", "Older →")
         else:
-            st.info("No leaderboard data available for this week. Log a workout to get started!")
+            step_back_if_empty("feed")
+            st.info("Your friends haven't logged any workouts yet.")
 
     # --- GOALS (CRUD) ---
     elif selected_page == "Goals":
@@ -183,42 +538,44 @@ else:
         # CREATE Goal
         with st.form("new_goal_form"):
             st.subheader("Set a New Goal")
-            description = st.text_area("Goal Description")
-            target = st.number_input("Target Value (e.g., 5 workouts/week)", min_value=1)
-            start_date = st.date_input("Start Date", datetime.date.today())
-            end_date = st.date_input("End Date")
-            if st.form_submit_button("Set Goal"):
-                if backend.create_goal(get_user_id(), description, target, start_date, end_date):
-                    st.success("Goal set successfully!")
-                else:
-                    st.error("Failed to set goal.")
+            st.text_area("Goal Description", key="goal_description")
+            st.selectbox("Measured by", list(GOAL_METRIC_LABELS), format_func=GOAL_METRIC_LABELS.get, key="goal_metric")
+            st.number_input("Target Value (e.g., 5 workouts/week)", min_value=1, key="goal_target")
+            st.date_input("Start Date", datetime.date.today(), key="goal_start_date")
+            st.date_input("End Date", key="goal_end_date")
+            st.form_submit_button("Set Goal", on_click=create_goal)
         
         st.markdown("---")
         
         # READ/UPDATE/DELETE Goals
         st.subheader("Your Current Goals")
-        goals = backend.read_goals(get_user_id())
+        (goals, next_cursor), = page_data(
+            ("goals", (get_user_id(), GOALS_PAGE_SIZE, page_cursor("goals")), async_backend.read_goals),
+        )
         if goals:
             for goal in goals:
-                goal_id, desc, target, is_completed = goal
+                goal_id, desc, target, is_completed, metric, progress, end_date = goal
                 col1, col2, col3 = st.columns([0.6, 0.2, 0.2])
                 with col1:
                     status = "✅ Completed" if is_completed else "⏳ In Progress"
                     st.write(f"**{status}**: {desc}")
+                    if end_date:
+                        st.caption(f"Due {end_date}")
+                    if metric != "manual" and target and progress is not None:
+                        st.progress(min(float(progress) / target, 1.0),
+                                    text=f"{float(progress):g} / {target} ({GOAL_METRIC_LABELS[metric].lower()})")
                 with col2:
-                    is_completed_new = st.checkbox("Mark as Done", value=is_completed, key=f"chk_{goal_id}")
-                    if is_completed_new != is_completed:
-                        if backend.update_goal(goal_id, is_completed_new):
-                            st.success("Goal status updated.")
-                            st.experimental_rerun()
-                        else:
-                            st.error("Failed to update goal status.")
+                    st.checkbox("Mark as Done", value=is_completed, key=f"chk_{goal_id}",
+                                on_change=update_goal, args=(goal_id,))
                 with col3:
-                    if st.button("Delete", key=f"del_goal_{goal_id}"):
-                        if backend.delete_goal(goal_id):
-                            st.success("Goal deleted.")
-                            st.experimental_rerun()
-                        else:
-                            st.error("Failed to delete goal.")
+                    st.button("Delete", key=f"del_goal_{goal_id}", on_click=delete_goal, args=(goal_id,))
+            page_controls("goals", next_cursor)
         else:
-            st.info("You haven't set any goals yet.")
\ No newline at end of file
+            step_back_if_empty("goals")
+            st.info("You haven't set any goals yet.")
+
+    # --- PERFORMANCE SUMMARY ---
+    with st.sidebar.expander("Performance"):
+        summary = request_summary.as_dict()
+        st.write(f"{summary['queries']} queries, {summary['db_ms']:.1f} ms in the database")
+        st.caption(f"Waited {summary['acquire_ms']:.1f} ms for connections; {summary['wall_ms']:.0f} ms total")
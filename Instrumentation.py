@@ -0,0 +1,277 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2.extensions
+
+# --- SETTINGS ---
+
+# Statements slower than this are logged (with their parameters redacted)
+SLOW_QUERY_THRESHOLD_MS = 200.0
+# Upper bounds of the latency histogram buckets, in milliseconds
+HISTOGRAM_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+logger = logging.getLogger("fitness.backend")
+
+# --- HISTOGRAMS ---
+
+class Histogram:
+    """A fixed-bucket latency histogram that is cheap to update from many threads."""
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # the last bucket collects everything above the largest bound
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def record(self, ms, rows=0):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+            self.rows += max(rows, 0)
+
+    def percentile(self, fraction):
+        """Estimates a percentile as the upper bound of the bucket it falls in."""
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (self.max_ms,), self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(bound, self.max_ms)
+        return 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "count": self.count,
+                "total_ms": round(self.total_ms, 3),
+                "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+                "max_ms": round(self.max_ms, 3),
+                "p50_ms": self.percentile(0.50),
+                "p95_ms": self.percentile(0.95),
+                "p99_ms": self.percentile(0.99),
+                "rows": self.rows,
+            }
+
+
+_histograms = {}   # (kind, name) -> Histogram
+_histograms_lock = threading.Lock()
+
+def _histogram(kind, name):
+    key = (kind, name)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    return histogram
+
+def histograms(kind=None):
+    """Returns {(kind, name): snapshot} for every histogram, optionally of one kind ("call", "statement", "acquire", "queue")."""
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {key: histogram.snapshot() for key, histogram in items if kind is None or key[0] == kind}
+
+def reset():
+    """Drops every recorded histogram."""
+    with _histograms_lock:
+        _histograms.clear()
+
+# --- HOOKS ---
+
+_hooks = []
+
+def add_hook(hook):
+    """Registers `hook(event)`, called with a dict for every backend call, statement, connection checkout and queued write.
+
+    Events have a "kind" ("call", "statement", "acquire" or "queue"), a "name" and "ms";
+    statement events also carry "rows".
+    """
+    _hooks.append(hook)
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+def _emit(event):
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception:
+            logger.exception("Instrumentation hook %r failed", hook)
+
+# --- PER-REQUEST SUMMARY ---
+
+class RequestSummary:
+    """Query count and database time of one unit of work, e.g. one Streamlit rerun."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.rows = 0
+        self.db_ms = 0.0
+        self.acquire_ms = 0.0
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "rows": self.rows,
+                "db_ms": round(self.db_ms, 2),
+                "acquire_ms": round(self.acquire_ms, 2),
+                "wall_ms": round((time.perf_counter() - self.started) * 1000, 2),
+                "calls": dict(self.calls),
+            }
+
+
+_current_request = contextvars.ContextVar("request_summary", default=None)
+
+def begin_request():
+    """Starts a new summary for the current context and returns it; statements recorded afterwards count towards it."""
+    summary = RequestSummary()
+    _current_request.set(summary)
+    return summary
+
+def current_request():
+    return _current_request.get()
+
+def attach_request(summary):
+    """Makes `summary` the current one, e.g. in a task or thread that works on behalf of a request."""
+    _current_request.set(summary)
+
+@contextmanager
+def request_scope():
+    """Collects a RequestSummary for the statements run inside the block."""
+    summary = RequestSummary()
+    token = _current_request.set(summary)
+    try:
+        yield summary
+    finally:
+        _current_request.reset(token)
+
+# --- RECORDING ---
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%(?:\(\w+\))?s")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalizes a statement so every execution of the same query shape shares one key."""
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _VALUE_LIST.sub("(...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip().rstrip(";")
+
+def redact(params):
+    """Describes statement parameters by type only, so logs never contain user data."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {name: type(value).__name__ for name, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+def record_statement(sql, params, ms, rows):
+    """Records one executed statement; empty statements such as pool health checks are ignored."""
+    name = fingerprint(sql)
+    if not name:
+        return
+    _histogram("statement", name).record(ms, rows)
+    summary = _current_request.get()
+    if summary is not None:
+        with summary._lock:
+            summary.queries += 1
+            summary.rows += max(rows, 0)
+            summary.db_ms += ms
+    if ms >= SLOW_QUERY_THRESHOLD_MS:
+        logger.warning("Slow query (%.1f ms, %d rows): %s params=%s", ms, rows, name, redact(params))
+    if _hooks:
+        _emit({"kind": "statement", "name": name, "ms": ms, "rows": rows})
+
+def record_acquire(ms):
+    """Records how long a caller waited to check out a database connection."""
+    _histogram("acquire", "pool").record(ms)
+    summary = _current_request.get()
+    if summary is not None:
+        with summary._lock:
+            summary.acquire_ms += ms
+    if _hooks:
+        _emit({"kind": "acquire", "name": "pool", "ms": ms})
+
+def record_queue_lag(name, ms):
+    """Records how long a queued write waited between being acknowledged and being committed."""
+    _histogram("queue", name).record(ms)
+    if _hooks:
+        _emit({"kind": "queue", "name": name, "ms": ms})
+
+def _record_call(name, ms):
+    _histogram("call", name).record(ms)
+    summary = _current_request.get()
+    if summary is not None:
+        with summary._lock:
+            summary.calls[name] = summary.calls.get(name, 0) + 1
+    if _hooks:
+        _emit({"kind": "call", "name": name, "ms": ms})
+
+def traced(func):
+    """Records the wall time of every call to a backend function (sync or async)."""
+    name = func.__name__
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _record_call(name, (time.perf_counter() - start) * 1000)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record_call(name, (time.perf_counter() - start) * 1000)
+    return wrapper
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """A psycopg2 cursor that records the time and row count of every statement, including COPY."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_statement(query, vars, (time.perf_counter() - start) * 1000, self.rowcount)
+
+    def execute_as(self, query, recorded_as, vars=None):
+        """Executes `query` but records it as `recorded_as`, e.g. an EXECUTE under the statement it prepared."""
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_statement(recorded_as, vars, (time.perf_counter() - start) * 1000, self.rowcount)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_statement(sql, None, (time.perf_counter() - start) * 1000, self.rowcount)
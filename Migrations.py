@@ -0,0 +1,341 @@
+import argparse
+import logging
+import os
+import re
+import sys
+
+import psycopg2
+
+import Analytics as analytics
+import Backend as backend
+import Instrumentation as instrumentation
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d+)_(\w+)\.sql$")
+MIGRATION_LOCK_ID = 30041  # pg_advisory_xact_lock key, so concurrent runners apply migrations one at a time
+
+# --- MIGRATION RUNNER ---
+
+def list_migrations():
+    """Returns [(version, name, path)] for every migration file, in version order."""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE_PATTERN.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations)
+
+def read_applied_versions(cur):
+    """Returns the set of migration versions recorded in schema_migrations."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cur.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cur.fetchall()}
+
+def apply_migrations():
+    """Applies every pending migration, each in its own transaction. Returns the versions applied."""
+    conn, cur = None, None
+    applied = []
+    try:
+        conn = backend.get_db_connection()
+        if not conn: return None
+        cur = conn.cursor()
+        for version, name, path in list_migrations():
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_ID,))
+            if version in read_applied_versions(cur):
+                conn.commit()
+                continue
+            # Rewriting a large table can take far longer than an interactive statement may
+            cur.execute("SET LOCAL statement_timeout = 0;")
+            with open(path, encoding="utf-8") as f:
+                cur.execute(f.read())
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);", (version, name))
+            conn.commit()
+            applied.append(version)
+            instrumentation.logger.info("Applied migration %04d_%s", version, name)
+        return applied
+    except (psycopg2.Error, OSError):
+        instrumentation.logger.exception("Error applying migrations (applied so far: %s)", applied)
+        if conn: conn.rollback()
+        return None
+    finally:
+        backend.close_db_connection(conn, cur)
+
+# --- QUERY PLAN CHECK ---
+
+# Tables that grow with usage; a sequential scan over any of them is a missing index.
+PLAN_CHECK_TABLES = {"users", "friends", "workouts", "exercises", "goals", "workoutminutesrollup", "exercisestats",
+                     "leaderboardranks", "feeditems"}
+# Monthly partitions (workouts_2024_05) count as their parent table
+PARTITION_SUFFIX = re.compile(r"_\d{4}_\d{2}$")
+
+# The statements Backend.py runs on hot paths, taken from its constants so the check
+# follows what the app runs. Each comes with a function building its parameters from
+# a sample of the dataset (see check_query_plans): the busiest user and their newest
+# workouts, a page being PAGE rows read one past the page.
+PAGE = 20
+PLAN_CHECKS = [
+    ("read_user", backend.USER_BY_ID_SQL, lambda s: (s["user_id"],)),
+    ("read_user_by_email", backend.USER_BY_EMAIL_SQL, lambda s: (s["email"],)),
+    ("read_friend_ids", backend.FRIEND_IDS_SQL, lambda s: (s["user_id"],) * 2),
+    ("read_friends", backend.FRIEND_PAGE_SQL, lambda s: (s["user_id"], 0, s["user_id"], 0, PAGE + 1)),
+    ("read_workouts", backend.WORKOUT_PAGE_SQL, lambda s: (s["user_id"], PAGE + 1)),
+    ("read_workout_history (exercises)", backend.WORKOUT_PAGE_EXERCISES_SQL,
+     lambda s: (s["workout_ids"], s["first_date"], s["last_date"])),
+    ("read_workouts (older page)", backend.WORKOUT_PAGE_BEFORE_SQL,
+     lambda s: (s["user_id"], s["last_date"], s["last_date"], s["workout_id"], PAGE + 1)),
+    ("read_exercises_for_workout", backend.WORKOUT_EXERCISES_SQL, lambda s: (s["workout_id"],)),
+    ("read_personal_records", backend.PERSONAL_RECORDS_SQL, lambda s: (s["user_id"],)),
+    ("read_personal_records (one exercise)", backend.EXERCISE_RECORDS_SQL, lambda s: (s["user_id"], s["exercise_key"])),
+    ("read_goals", backend.GOAL_PAGE_SQL, lambda s: (s["user_id"], PAGE + 1)),
+    ("read_goals (next page)", backend.GOAL_PAGE_AFTER_SQL, lambda s: (s["user_id"], False, None, 0, PAGE + 1)),
+    *[(f"read_leaderboard ({period})", backend.FRIENDS_LEADERBOARD_SQL,
+       lambda s, period=period: (s["user_id"],) * 3 + (backend._rollup_period(period), *backend.leaderboard_window(period), None))
+      for period in backend.LEADERBOARD_PERIODS],
+    ("read_leaderboard (global)", backend.GLOBAL_LEADERBOARD_SQL,
+     lambda s: ("week", backend.leaderboard_window("week")[0], backend.LEADERBOARD_TOP_K)),
+    ("read_leaderboard_rank", backend.GLOBAL_LEADERBOARD_RANK_SQL,
+     lambda s: (s["user_id"], "week", backend.leaderboard_window("week")[0])),
+    ("read_activity_feed", backend.FRIENDS_FEED_SQL,
+     lambda s: (s["user_id"], s["user_id"], s["last_date"], s["last_date"], s["workout_id"], PAGE + 1, PAGE + 1)),
+    ("read_activity_feed (inbox)", backend.INBOX_FEED_SQL,
+     lambda s: (s["user_id"], s["last_date"], s["workout_id"], s["first_date"], 0, PAGE + 1)),
+    ("read_training_analytics", analytics.EXERCISE_ROWS_SQL, lambda s: (s["user_id"],)),
+    ("create_workout_with_exercises minutes rollup", backend.MINUTES_ROLLUP_SQL,
+     lambda s: backend._minutes_rollup_params([(s["user_id"], s["last_date"], 30)], 1)),
+    ("create_workout_with_exercises exercise stats", backend.ADD_EXERCISE_STATS_SQL,
+     lambda s: (s["workout_ids"], s["workout_ids"]) + (s["first_date"], s["last_date"]) * 2),
+    ("create_workout_with_exercises fan-out", backend.FAN_OUT_SQL,
+     lambda s: ([s["user_id"]], [s["last_date"]], [s["workout_id"]], [30])),
+    ("create_workout_with_exercises goals", backend.EVALUATE_USERS_GOALS_SQL, lambda s: ([s["user_id"]],) * 2),
+    ("create_workout_with_exercises members", backend.MEMBER_IDS_SQL, lambda s: (s["user_id"],) * 3),
+    ("write_workout_submissions members", backend.MEMBERS_OF_USERS_SQL, lambda s: ([s["user_id"]],) * 3),
+    ("add_friend inbox copy", backend.COPY_INTO_INBOX_SQL, lambda s: (s["user_id"], s["user_id"])),
+    ("delete_workout exercise keys", backend.WORKOUT_EXERCISE_KEYS_SQL, lambda s: (s["workout_id"],)),
+    ("delete_workout feed items", backend.DELETE_FEED_ITEMS_SQL, lambda s: (s["user_id"], s["workout_id"])),
+]
+
+def seed_plan_check_data(cur, users, friends_per_user, workouts_per_user, exercises_per_workout):
+    """Bulk-loads a synthetic dataset with set-based inserts so plans reflect realistic table sizes."""
+    cur.execute("SELECT COALESCE(MAX(user_id), 0) FROM Users;")
+    first_id = cur.fetchone()[0] + 1
+    cur.execute(
+        """
+        INSERT INTO Users (name, email, weight_kg)
+        SELECT 'Seed User ' || n, 'seed.' || n || '.' || md5(random()::text) || '@example.com', 50 + (n %% 50)
+        FROM generate_series(%s, %s) AS n;
+        """,
+        (first_id, first_id + users - 1)
+    )
+    cur.execute(
+        """
+        INSERT INTO Friends (user_id_1, user_id_2)
+        SELECT U.user_id, U.user_id + k FROM Users U, generate_series(1, %s) AS k
+        WHERE U.user_id >= %s AND U.user_id + k < %s
+        ON CONFLICT DO NOTHING;
+        """,
+        (friends_per_user, first_id, first_id + users)
+    )
+    cur.execute("SELECT create_workout_partitions(CURRENT_DATE - 1000, CURRENT_DATE);")
+    cur.execute(
+        """
+        INSERT INTO Workouts (user_id, workout_date, duration_minutes)
+        SELECT U.user_id, CURRENT_DATE - ((n * 3 + U.user_id) %% 1000), 20 + (n %% 60)
+        FROM Users U, generate_series(1, %s) AS n
+        WHERE U.user_id >= %s;
+        """,
+        (workouts_per_user, first_id)
+    )
+    cur.execute(
+        """
+        INSERT INTO Exercises (workout_id, workout_date, exercise_name, sets, reps, weight_kg)
+        SELECT W.workout_id, W.workout_date, (ARRAY['Squat', 'Bench Press', 'Deadlift', 'Row', 'Running'])[1 + (n %% 5)], 3, 8, 40 + (n * 5)
+        FROM Workouts W JOIN Users U ON U.user_id = W.user_id, generate_series(1, %s) AS n
+        WHERE U.user_id >= %s;
+        """,
+        (exercises_per_workout, first_id)
+    )
+    cur.execute(
+        """
+        INSERT INTO Goals (user_id, goal_description, target_value, start_date, end_date, is_completed)
+        SELECT U.user_id, 'Seeded goal ' || n, n, CURRENT_DATE - 30 * n, CURRENT_DATE + 30 * n, n %% 2 = 0
+        FROM Users U, generate_series(1, 5) AS n
+        WHERE U.user_id >= %s;
+        """,
+        (first_id,)
+    )
+    backend._rebuild_exercise_stats(cur)
+    cur.execute(
+        """
+        INSERT INTO WorkoutMinutesRollup (user_id, period, period_start, total_minutes, workout_count)
+        SELECT W.user_id, P.period, date_trunc(P.period, W.workout_date)::date, SUM(W.duration_minutes), COUNT(*)
+        FROM Workouts W CROSS JOIN unnest(%s::text[]) AS P (period)
+        WHERE W.user_id >= %s AND (P.period <> 'day' OR W.workout_date >= %s)
+        GROUP BY 1, 2, 3;
+        """,
+        (list(backend.ROLLUP_PERIODS), first_id, backend._day_rollup_cutoff())
+    )
+    backend._rank_leaderboard(cur, "week", *backend.leaderboard_window("week"))
+    # Feed inboxes for a tenth of the users, holding their friends' last 90 days
+    cur.execute(
+        """
+        INSERT INTO FeedInboxes (user_id, horizon_date, horizon_id, built_at)
+        SELECT user_id, CURRENT_DATE - 90, 0, CURRENT_TIMESTAMP FROM Users WHERE user_id >= %s AND user_id %% 10 = 0;
+        """,
+        (first_id,)
+    )
+    cur.execute(
+        """
+        INSERT INTO FeedItems (user_id, workout_date, workout_id, author_id, duration_minutes)
+        SELECT I.user_id, W.workout_date, W.workout_id, W.user_id, W.duration_minutes
+        FROM FeedInboxes I
+        CROSS JOIN LATERAL (
+            SELECT user_id_2 AS friend_id FROM Friends WHERE user_id_1 = I.user_id
+            UNION ALL
+            SELECT user_id_1 FROM Friends WHERE user_id_2 = I.user_id
+        ) F
+        JOIN Workouts W ON W.user_id = F.friend_id AND W.workout_date >= I.horizon_date
+        WHERE I.user_id >= %s;
+        """,
+        (first_id,)
+    )
+
+def _find_seq_scans(plan, found, empty=frozenset()):
+    """Collects the relations read with a sequential scan anywhere in an EXPLAIN JSON plan.
+
+    Relations in `empty` are skipped: an empty table is always scanned, index or not.
+    """
+    relation = plan.get("Relation Name", "")
+    if plan.get("Node Type") == "Seq Scan" and PARTITION_SUFFIX.sub("", relation.lower()) in PLAN_CHECK_TABLES and relation not in empty:
+        found.append(relation)
+    for child in plan.get("Plans", ()):
+        _find_seq_scans(child, found, empty)
+    return found
+
+def check_query_plans():
+    """EXPLAINs every statement in PLAN_CHECKS and returns [(name, tables)] for plans with sequential scans."""
+    conn, cur = None, None
+    try:
+        conn = backend.get_db_connection()
+        if not conn: return None
+        cur = conn.cursor()
+        cur.execute("ANALYZE;")
+        conn.commit()
+        # Tables without rows, e.g. partitions of months that have no workouts yet or FeedItems before any inbox
+        cur.execute("SELECT relname FROM pg_class WHERE relkind = 'r' AND reltuples = 0;")
+        empty = {r[0] for r in cur.fetchall()}
+
+        # Sample the busiest user so the plans cover the worst case rather than an empty profile
+        cur.execute("SELECT user_id, COUNT(*) FROM Workouts GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1;")
+        row = cur.fetchone()
+        if not row:
+            instrumentation.logger.warning("No workouts found; seed the database before checking query plans.")
+            return None
+        user_id = row[0]
+        cur.execute("SELECT email FROM Users WHERE user_id = %s;", (user_id,))
+        email = cur.fetchone()[0]
+        cur.execute("SELECT workout_id, workout_date FROM Workouts WHERE user_id = %s ORDER BY workout_date DESC LIMIT 20;", (user_id,))
+        workouts = cur.fetchall()
+        workout_ids = [r[0] for r in workouts]
+        cur.execute("SELECT exercise_key FROM ExerciseStats WHERE user_id = %s ORDER BY entry_count DESC LIMIT 1;", (user_id,))
+        exercise_key = cur.fetchone()
+        sample = {
+            "user_id": user_id,
+            "email": email,
+            "workout_id": workout_ids[0],
+            "workout_ids": workout_ids,
+            "first_date": workouts[-1][1],
+            "last_date": workouts[0][1],
+            "exercise_key": exercise_key[0] if exercise_key else "",
+        }
+
+        failures = []
+        for name, sql, params in PLAN_CHECKS:
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql, params(sample))
+            seq_scans = _find_seq_scans(cur.fetchone()[0][0]["Plan"], [], empty)
+            if seq_scans:
+                failures.append((name, seq_scans))
+        return failures
+    except psycopg2.Error:
+        instrumentation.logger.exception("Error checking query plans")
+        return None
+    finally:
+        backend.close_db_connection(conn, cur)
+
+# --- COMMAND LINE ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the Personal Fitness Tracker database schema.")
+    parser.add_argument("--config", help="a JSON settings file (see Backend.load_config)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="apply pending migrations")
+    commands.add_parser("status", help="list migrations and whether they are applied")
+    check = commands.add_parser("check-plans", help="fail if a backend query plan uses a sequential scan")
+    check.add_argument("--seed-users", type=int, default=0,
+                       help="first load this many synthetic users (use a scratch database)")
+    check.add_argument("--friends-per-user", type=int, default=20)
+    check.add_argument("--workouts-per-user", type=int, default=50)
+    check.add_argument("--exercises-per-workout", type=int, default=4)
+    rebuild = commands.add_parser("rebuild-stats", help="recompute the exercise stats and personal records")
+    rebuild.add_argument("--user-id", type=int, help="only this user (default: everyone)")
+    args = parser.parse_args(argv)
+    # Backend logs its errors; show them on the terminal
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    # Seeding, stats rebuilds and ANALYZE scan whole tables; no interactive statement timeout
+    backend.configure(**dict(backend.load_config(args.config), statement_timeout_ms=0))
+
+    if args.command == "migrate":
+        return 0 if apply_migrations() is not None else 1
+
+    if args.command == "status":
+        conn = backend.get_db_connection()
+        if not conn: return 1
+        cur = conn.cursor()
+        applied = read_applied_versions(cur)
+        conn.commit()
+        backend.close_db_connection(conn, cur)
+        for version, name, _ in list_migrations():
+            print(f"{'applied' if version in applied else 'pending'}  {version:04d}_{name}")
+        return 0
+
+    if args.command == "rebuild-stats":
+        rows = backend.rebuild_exercise_stats(args.user_id)
+        if rows is None:
+            return 1
+        print(f"Rebuilt {rows} exercise stats rows")
+        return 0
+
+    if args.seed_users:
+        conn = backend.get_db_connection()
+        if not conn: return 1
+        cur = conn.cursor()
+        try:
+            seed_plan_check_data(cur, args.seed_users, args.friends_per_user,
+                                 args.workouts_per_user, args.exercises_per_workout)
+            conn.commit()
+        except psycopg2.Error:
+            instrumentation.logger.exception("Error seeding plan-check data")
+            conn.rollback()
+            return 1
+        finally:
+            backend.close_db_connection(conn, cur)
+
+    failures = check_query_plans()
+    if failures is None:
+        return 1
+    for name, tables in failures:
+        print(f"FAIL  {name}: sequential scan on {', '.join(tables)}")
+    if not failures:
+        print(f"OK  {len(PLAN_CHECKS)} query plans use indexes")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import Backend as backend
+import Instrumentation as instrumentation
+
+# --- SETTINGS ---
+# The queue's file and whether the frontend uses it are Backend settings
+# (QUEUE_PATH, WRITE_BEHIND), so they can be set from the config file.
+
+QUEUE_BATCH_SIZE = 200          # submissions written per transaction
+QUEUE_POLL_INTERVAL = 0.5       # seconds an idle worker waits before looking again
+QUEUE_LEASE_SECONDS = 60.0      # a batch whose worker has not finished by then goes back to the queue
+QUEUE_RETRY_DELAY = 1.0         # seconds before a failed batch is retried; doubles with every attempt
+QUEUE_MAX_RETRY_DELAY = 300.0
+QUEUE_MAX_ATTEMPTS = 20         # a submission whose batch failed this often is kept as dead (about 1h15m of retries)
+MAX_EXERCISE_NAME_LENGTH = 255  # Exercises.exercise_name is VARCHAR(255)
+MAX_WEIGHT_KG = 999.99          # Exercises.weight_kg is DECIMAL(5, 2)
+
+# --- VALIDATION ---
+# A queued workout is acknowledged before the database sees it, so everything the
+# database would refuse about its values is checked first.
+
+def _whole_number(value, name, minimum, required=True):
+    if value is None and not required:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+        raise ValueError(f"{name} must be a whole number")
+    if value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return int(value)
+
+def validate_workout(user_id, workout_date, duration_minutes, exercises):
+    """Checks a workout and returns it as a bulk_create_workouts dict; raises ValueError if it is invalid."""
+    if isinstance(workout_date, str):
+        workout_date = datetime.date.fromisoformat(workout_date)
+    if not isinstance(workout_date, datetime.date):
+        raise ValueError("workout_date must be a date")
+    checked = []
+    for exercise in exercises:
+        name = (exercise.get('name') or "").strip()
+        if not name:
+            raise ValueError("every exercise needs a name")
+        if len(name) > MAX_EXERCISE_NAME_LENGTH:
+            raise ValueError(f"exercise names are at most {MAX_EXERCISE_NAME_LENGTH} characters")
+        weight = exercise.get('weight')
+        if weight is not None and not 0 <= float(weight) <= MAX_WEIGHT_KG:
+            raise ValueError(f"weight must be between 0 and {MAX_WEIGHT_KG} kg")
+        checked.append({
+            'name': name,
+            'sets': _whole_number(exercise.get('sets'), "sets", 0, required=False),
+            'reps': _whole_number(exercise.get('reps'), "reps", 0, required=False),
+            'weight': None if weight is None else round(float(weight), 2),
+        })
+    return {
+        'user_id': _whole_number(user_id, "user_id", 1),
+        'workout_date': workout_date.isoformat(),
+        'duration_minutes': _whole_number(duration_minutes, "duration_minutes", 1),
+        'exercises': checked,
+    }
+
+# --- QUEUE ---
+
+class WorkoutQueue:
+    """A durable FIFO of workout submissions in a SQLite database in WAL mode.
+
+    Several processes may enqueue into and drain the same file: workers claim a
+    batch by leasing it (setting available_at into the future) in one write
+    transaction, so two workers do not take the same submissions while both are alive.
+    A submission stays in the file until its batch has committed in Postgres; one
+    the database refused, or whose batch failed QUEUE_MAX_ATTEMPTS times, is kept
+    as dead, with its error, for someone to look at.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()   # one SQLite connection per thread
+        self._db().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS submissions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                submission_key TEXT NOT NULL UNIQUE,
+                user_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                dead INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS submissions_ready_idx ON submissions (dead, available_at, id);
+            CREATE INDEX IF NOT EXISTS submissions_user_idx ON submissions (user_id);
+            """
+        )
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # Autocommit; writes that must be atomic open their own transaction
+            db = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL;")
+            # An acknowledged workout must survive a power cut, so sync every commit
+            db.execute("PRAGMA synchronous=FULL;")
+            self._local.db = db
+        return db
+
+    def _write_many(self, sql, rows):
+        """Runs a statement for many rows in one transaction, so they cost one sync."""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE;")
+        try:
+            db.executemany(sql, rows)
+            db.execute("COMMIT;")
+        except sqlite3.Error:
+            db.execute("ROLLBACK;")
+            raise
+
+    def enqueue(self, workout, key):
+        """Appends a validated workout under its idempotency key; enqueueing a key again is a no-op."""
+        now = time.time()
+        self._db().execute(
+            "INSERT OR IGNORE INTO submissions (submission_key, user_id, payload, enqueued_at, available_at) VALUES (?, ?, ?, ?, ?);",
+            (key, workout['user_id'], json.dumps(workout), now, now)
+        )
+
+    def claim(self, limit, lease=QUEUE_LEASE_SECONDS):
+        """Leases up to `limit` ready submissions, oldest first; returns [(id, key, workout, enqueued_at)]."""
+        db = self._db()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE;")
+        try:
+            rows = db.execute(
+                "SELECT id, submission_key, payload, enqueued_at FROM submissions WHERE dead = 0 AND available_at <= ? ORDER BY id LIMIT ?;",
+                (now, limit)
+            ).fetchall()
+            db.executemany("UPDATE submissions SET available_at = ? WHERE id = ?;", [(now + lease, row[0]) for row in rows])
+            db.execute("COMMIT;")
+        except sqlite3.Error:
+            db.execute("ROLLBACK;")
+            raise
+        return [(id, key, json.loads(payload), enqueued_at) for id, key, payload, enqueued_at in rows]
+
+    def complete(self, ids):
+        """Removes submissions that are now in the database."""
+        self._write_many("DELETE FROM submissions WHERE id = ?;", [(id,) for id in ids])
+
+    def retry(self, ids, error, max_attempts=QUEUE_MAX_ATTEMPTS):
+        """Puts submissions back, to be tried again after a delay that grows with their attempts.
+
+        A submission that has now failed `max_attempts` times is marked dead instead.
+        """
+        self._write_many(
+            """
+            UPDATE submissions
+            SET attempts = attempts + 1, last_error = ?, dead = attempts + 1 >= ?,
+                available_at = ? + min(?, ? * (1 << min(attempts, 30)))
+            WHERE id = ?;
+            """,
+            [(error, max_attempts, time.time(), QUEUE_MAX_RETRY_DELAY, QUEUE_RETRY_DELAY, id) for id in ids]
+        )
+
+    def bury(self, errors):
+        """Marks submissions the database refused as dead; `errors` maps their IDs to the error."""
+        self._write_many(
+            "UPDATE submissions SET dead = 1, attempts = attempts + 1, last_error = ? WHERE id = ?;",
+            [(error, id) for id, error in errors.items()]
+        )
+
+    def pending(self, user_id):
+        """Returns (waiting, dead): how many of a user's submissions are not in the database yet."""
+        waiting, dead = self._db().execute(
+            "SELECT COUNT(*) - COALESCE(SUM(dead), 0), COALESCE(SUM(dead), 0) FROM submissions WHERE user_id = ?;",
+            (user_id,)
+        ).fetchone()
+        return waiting, dead
+
+    def stats(self):
+        """Returns the depth of the queue, its dead submissions and the age in seconds of its oldest waiting one."""
+        depth, dead, oldest = self._db().execute(
+            "SELECT COUNT(*) - COALESCE(SUM(dead), 0), COALESCE(SUM(dead), 0), MIN(CASE WHEN dead = 0 THEN enqueued_at END) FROM submissions;"
+        ).fetchone()
+        return {
+            "depth": depth,
+            "dead": dead,
+            "oldest_age_s": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+        }
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue():
+    """Returns the queue in Backend.QUEUE_PATH, opening it on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None or _queue.path != backend.QUEUE_PATH:
+            _queue = WorkoutQueue(backend.QUEUE_PATH)
+        return _queue
+
+def new_submission_key():
+    """Returns a fresh idempotency key; a form keeps its key until the workout it sends is acknowledged."""
+    return uuid.uuid4().hex
+
+def enqueue_workout(user_id, workout_date, duration_minutes, exercises, submission_key=None):
+    """C: Validates a workout and queues it for the worker to write; returns its submission key.
+
+    The workout is durable once this returns, so the caller can acknowledge it.
+    Pass the same `submission_key` when sending a submission again. Raises
+    ValueError for an invalid workout.
+    """
+    workout = validate_workout(user_id, workout_date, duration_minutes, exercises)
+    submission_key = submission_key or new_submission_key()
+    get_queue().enqueue(workout, submission_key)
+    return submission_key
+
+def pending_workouts(user_id):
+    """R: Returns (waiting, dead): how many of a user's acknowledged workouts are not in the database yet."""
+    return get_queue().pending(user_id)
+
+def queue_stats():
+    """Returns the queue's depth and dead count, the age of its oldest waiting submission, and the lag histogram."""
+    stats = get_queue().stats()
+    stats["lag"] = instrumentation.histograms("queue").get(("queue", "workouts"))
+    return stats
+
+# --- WORKER ---
+
+def drain_once(batch_size=QUEUE_BATCH_SIZE):
+    """Writes one batch of ready submissions to the database.
+
+    Returns how many submissions were taken off the queue (written, already
+    written, or refused and kept as dead), or None if the batch failed and will be retried.
+    """
+    queue = get_queue()
+    batch = queue.claim(batch_size)
+    if not batch:
+        return 0
+    submissions = [
+        dict(workout, key=key, submitted_at=datetime.datetime.fromtimestamp(enqueued_at, datetime.timezone.utc))
+        for _, key, workout, enqueued_at in batch
+    ]
+    result = backend.write_workout_submissions(submissions)
+    if result is None:
+        queue.retry([id for id, _, _, _ in batch], "the batch could not be written; see the log")
+        return None
+    _, refused = result
+    queue.bury({id: refused[key] for id, key, _, _ in batch if key in refused})
+    queue.complete([id for id, key, _, _ in batch if key not in refused])
+    now = time.time()
+    for _, key, _, enqueued_at in batch:
+        if key not in refused:
+            instrumentation.record_queue_lag("workouts", (now - enqueued_at) * 1000)
+    return len(batch)
+
+def drain(batch_size=QUEUE_BATCH_SIZE):
+    """Writes batches until no submission is ready; returns how many were taken off, or None if a batch failed."""
+    drained = 0
+    while True:
+        handled = drain_once(batch_size)
+        if handled is None:
+            return None
+        if not handled:
+            return drained
+        drained += handled
+
+class QueueWorker(threading.Thread):
+    """A daemon thread that drains the queue, waiting QUEUE_POLL_INTERVAL whenever it is empty.
+
+    An unexpected error is logged and the worker backs off, from QUEUE_RETRY_DELAY
+    doubling up to QUEUE_MAX_RETRY_DELAY, rather than letting the thread die. The
+    queue is durable, so a process that exits with the worker mid-batch loses
+    nothing: the lease runs out and the batch is written again, its keys skipping
+    whatever had already committed.
+    """
+
+    def __init__(self, batch_size=QUEUE_BATCH_SIZE, poll_interval=QUEUE_POLL_INTERVAL):
+        super().__init__(name="workout-queue-worker", daemon=True)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stopping = threading.Event()
+
+    def run(self):
+        backoff = QUEUE_RETRY_DELAY
+        while not self._stopping.is_set():
+            try:
+                handled = drain_once(self.batch_size)
+            except Exception:
+                instrumentation.logger.exception("Error draining the workout queue; retrying in %.1fs", backoff)
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, QUEUE_MAX_RETRY_DELAY)
+                continue
+            backoff = QUEUE_RETRY_DELAY
+            # A full batch means more are probably waiting
+            if handled != self.batch_size:
+                self._stopping.wait(self.poll_interval)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self.join(timeout)
+
+_worker = None
+
+def start_worker(batch_size=QUEUE_BATCH_SIZE, poll_interval=QUEUE_POLL_INTERVAL):
+    """Starts this process's queue worker unless it is already running; returns it."""
+    global _worker
+    with _queue_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = QueueWorker(batch_size, poll_interval)
+            _worker.start()
+        return _worker
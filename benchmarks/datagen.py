@@ -0,0 +1,159 @@
+"""Seeds a database with a synthetic, reproducible fitness dataset for benchmarking.
+
+Users and friendships are loaded with COPY; workouts go through
+Backend.bulk_create_workouts so rollups are maintained exactly as in production.
+Run it against a scratch database that already has the schema applied, e.g.:
+
+    python Migrations.py migrate
+    python benchmarks/datagen.py --database fitness_bench --users 10000 --mean-friends 20
+"""
+import argparse
+import datetime
+import io
+import os
+import random
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Backend as backend
+
+EXERCISE_NAMES = [
+    "Squat", "Bench Press", "Deadlift", "Overhead Press", "Barbell Row", "Pull-ups",
+    "Push-ups", "Lunges", "Running", "Cycling", "Rowing", "Plank",
+]
+
+
+def friend_degrees(rng, users, mean, distribution, max_degree):
+    """Samples how many friends each user should have."""
+    if distribution == "uniform":
+        return [rng.randint(0, 2 * mean) for _ in range(users)]
+    # Pareto with shape 2 has mean 2 * scale, giving a long tail of very social users
+    return [min(max_degree, int(rng.paretovariate(2.0) * mean / 2)) for _ in range(users)]
+
+
+def generate_friendships(rng, user_ids, degrees):
+    """Yields unique (smaller_id, larger_id) pairs, pairing each user with random partners."""
+    seen = set()
+    for user_id, degree in zip(user_ids, degrees):
+        for _ in range(degree):
+            other = rng.choice(user_ids)
+            pair = (min(user_id, other), max(user_id, other))
+            if other != user_id and pair not in seen:
+                seen.add(pair)
+                yield pair
+
+
+def generate_workouts(rng, user_ids, workouts_per_user, exercises_per_workout, days):
+    """Yields workout dicts in the shape Backend.bulk_create_workouts expects."""
+    today = datetime.date.today()
+    for user_id in user_ids:
+        for _ in range(max(0, int(rng.gauss(workouts_per_user, workouts_per_user / 4)))):
+            yield {
+                'user_id': user_id,
+                'workout_date': today - datetime.timedelta(days=rng.randrange(days)),
+                'duration_minutes': rng.randint(15, 120),
+                'exercises': [
+                    {
+                        'name': rng.choice(EXERCISE_NAMES),
+                        'sets': rng.randint(1, 5),
+                        'reps': rng.randint(1, 15),
+                        'weight': round(rng.uniform(0, 150), 1) if rng.random() < 0.8 else None,
+                    }
+                    for _ in range(rng.randint(1, 2 * exercises_per_workout - 1))
+                ],
+            }
+
+
+def seed(users, mean_friends, degree_distribution, max_friends, workouts_per_user,
+         exercises_per_workout, days, rng_seed=42, batch_size=backend.IMPORT_BATCH_SIZE):
+    """Loads the dataset and returns a summary dict, or None on failure."""
+    rng = random.Random(rng_seed)
+    started = time.perf_counter()
+    conn, cur = None, None
+    try:
+        conn = backend.get_db_connection()
+        if not conn: return None
+        cur = conn.cursor()
+
+        # Tag this run's e-mails so repeated seeds into the same database never collide
+        run_tag = f"{rng_seed}.{int(time.time())}"
+        buf = io.StringIO()
+        for n in range(users):
+            backend._write_copy_row(buf, (f"Bench User {n}", f"bench.{run_tag}.{n}@example.com", round(rng.uniform(45, 120), 2)))
+        buf.seek(0)
+        cur.copy_expert("COPY Users (name, email, weight_kg) FROM STDIN;", buf)
+        cur.execute("SELECT user_id FROM Users WHERE email LIKE %s ORDER BY user_id;", (f"bench.{run_tag}.%",))
+        user_ids = [row[0] for row in cur.fetchall()]
+
+        degrees = friend_degrees(rng, users, mean_friends, degree_distribution, max_friends)
+        buf = io.StringIO()
+        friendships = 0
+        for pair in generate_friendships(rng, user_ids, degrees):
+            backend._write_copy_row(buf, pair)
+            friendships += 1
+        buf.seek(0)
+        cur.copy_expert("COPY Friends (user_id_1, user_id_2) FROM STDIN;", buf)
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"Error seeding users and friendships: {e}")
+        if conn: conn.rollback()
+        return None
+    finally:
+        backend.close_db_connection(conn, cur)
+
+    workouts = backend.bulk_create_workouts(
+        generate_workouts(rng, user_ids, workouts_per_user, exercises_per_workout, days), batch_size
+    )
+    if workouts is None:
+        return None
+
+    conn = backend.get_db_connection()
+    if conn:
+        cur = conn.cursor()
+        cur.execute("ANALYZE;")
+        conn.commit()
+        backend.close_db_connection(conn, cur)
+
+    return {
+        "users": len(user_ids),
+        "first_user_id": user_ids[0] if user_ids else None,
+        "last_user_id": user_ids[-1] if user_ids else None,
+        "friendships": friendships,
+        "workouts": workouts,
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+
+
+def add_arguments(parser):
+    """Adds the dataset-shape options, shared with the load test."""
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--mean-friends", type=int, default=20)
+    parser.add_argument("--degree-distribution", choices=("pareto", "uniform"), default="pareto")
+    parser.add_argument("--max-friends", type=int, default=5000)
+    parser.add_argument("--workouts-per-user", type=int, default=100)
+    parser.add_argument("--exercises-per-workout", type=int, default=4)
+    parser.add_argument("--days", type=int, default=730, help="spread workouts over this many past days")
+    parser.add_argument("--rng-seed", type=int, default=42)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default=backend.DB_CONFIG["database"])
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    backend.DB_CONFIG["database"] = args.database
+    summary = seed(args.users, args.mean_friends, args.degree_distribution, args.max_friends,
+                   args.workouts_per_user, args.exercises_per_workout, args.days, args.rng_seed)
+    if summary is None:
+        return 1
+    print(summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
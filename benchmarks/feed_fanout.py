@@ -0,0 +1,158 @@
+"""Benchmarks the activity feed read by fan-out on read against fan-out on write.
+
+For the users with the most friends and a random sample of the others, times a
+feed page merged from their friends' workouts (Backend.FRIENDS_FEED_SQL) and the
+same page read from an inbox (Backend.INBOX_FEED_SQL), checking both return the
+same workouts. Then times what fan-out on write adds to logging a workout: copying
+it into the inboxes of the author's friends (Backend.FAN_OUT_SQL). Inboxes are
+built for the sampled users inside a transaction that is rolled back, so the
+database is left as it was. Run it against a database with a dataset, e.g.:
+
+    python benchmarks/datagen.py --database fitness_bench --users 10000 --mean-friends 20
+    python benchmarks/feed_fanout.py --database fitness_bench
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Backend as backend
+
+FRIEND_COUNTS_SQL = (
+    "SELECT member, COUNT(*) FROM (SELECT user_id_1 AS member FROM Friends UNION ALL SELECT user_id_2 FROM Friends) M "
+    "GROUP BY member;"
+)
+
+
+def build_inboxes(cur, user_ids, size):
+    """Fills an inbox of each user's `size` newest friends' workouts, as Backend.refresh_feed_inboxes does."""
+    newest_date, newest_id = backend.FEED_NEWEST
+    horizons = {}
+    for user_id in user_ids:
+        cur.execute(backend.FRIENDS_FEED_SQL + ";", (user_id, user_id, newest_date, newest_date, newest_id, size + 1, size + 1))
+        feed = cur.fetchall()[:size + 1]
+        horizons[user_id] = (feed[size - 1][1], feed[size - 1][0]) if len(feed) > size else backend.FEED_OLDEST
+        cur.execute(
+            "INSERT INTO FeedInboxes (user_id, horizon_date, horizon_id, built_at) VALUES (%s, %s, %s, CURRENT_TIMESTAMP) "
+            "ON CONFLICT (user_id) DO UPDATE SET horizon_date = EXCLUDED.horizon_date, horizon_id = EXCLUDED.horizon_id;",
+            (user_id,) + ((None, None) if len(feed) <= size else horizons[user_id])
+        )
+        cur.execute("DELETE FROM FeedItems WHERE user_id = %s;", (user_id,))
+        cur.execute(
+            """
+            INSERT INTO FeedItems (user_id, workout_date, workout_id, author_id, duration_minutes)
+            SELECT %s, * FROM unnest(%s::date[], %s::int[], %s::int[], %s::int[]);
+            """,
+            (user_id, [row[1] for row in feed[:size]], [row[0] for row in feed[:size]],
+             [row[2] for row in feed[:size]], [row[4] for row in feed[:size]])
+        )
+    cur.execute("ANALYZE FeedItems; ANALYZE FeedInboxes;")
+    return horizons
+
+
+def time_query(cur, sql, params, repeat):
+    """Runs a query `repeat` times and returns the latencies in milliseconds and its rows."""
+    latencies = []
+    rows = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, rows
+
+
+def p95(latencies):
+    return statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default=backend.DB_CONFIG["database"])
+    parser.add_argument("--users", type=int, default=10, help="users with the most friends, and as many random ones")
+    parser.add_argument("--page-size", type=int, default=backend.FEED_PAGE_SIZE)
+    parser.add_argument("--pages", type=int, default=3, help="pages read per user; later ones can reach past the inbox")
+    parser.add_argument("--inbox-size", type=int, default=backend.FEED_INBOX_SIZE)
+    parser.add_argument("--writes", type=int, default=200, help="workouts fanned out to time the write side")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--rng-seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    backend.DB_CONFIG["database"] = args.database
+    conn = backend.get_db_connection()
+    if not conn: return 1
+    cur = conn.cursor()
+    rng = random.Random(args.rng_seed)
+    try:
+        cur.execute(FRIEND_COUNTS_SQL)
+        friend_counts = dict(cur.fetchall())
+        if not friend_counts:
+            print("No friendships found; seed the database first.")
+            return 1
+        by_friends = sorted(friend_counts, key=friend_counts.get, reverse=True)
+        sampled = by_friends[:args.users] + rng.sample(by_friends[args.users:], min(args.users, len(by_friends[args.users:])))
+        print(f"Building inboxes of {args.inbox_size} workouts for {len(sampled)} users...")
+        horizons = build_inboxes(cur, sampled, args.inbox_size)
+
+        limit = args.page_size + 1
+        print(f"\n{'user':>10} {'friends':>8} {'on-read p50':>12} {'p95':>9} {'inbox p50':>10} {'p95':>9}  (per page, {args.pages} pages)")
+        on_read_all, inbox_all = [], []
+        for user_id in sampled:
+            horizon = horizons[user_id]
+            cursor = backend.FEED_NEWEST
+            on_read, inbox = [], []
+            for _ in range(args.pages):
+                read_ms, merged = time_query(cur, backend.FRIENDS_FEED_SQL + ";",
+                                             (user_id, user_id, cursor[0], cursor[0], cursor[1], limit, limit), args.repeat)
+                # Past the horizon an inbox read falls back to the merge, as Backend.read_activity_feed does
+                inbox_ms, rows = time_query(cur, backend.INBOX_FEED_SQL + ";",
+                                            (user_id, cursor[0], cursor[1], horizon[0], horizon[1], limit), args.repeat)
+                if len(rows) < limit and horizon > backend.FEED_OLDEST:
+                    start = min(cursor, horizon)
+                    rest_ms, rest = time_query(cur, backend.FRIENDS_FEED_SQL + ";",
+                                               (user_id, user_id, start[0], start[0], start[1], limit - len(rows), limit - len(rows)), args.repeat)
+                    inbox_ms = [a + b for a, b in zip(inbox_ms, rest_ms)]
+                    rows += rest
+                assert rows == merged, f"the inbox of user {user_id} must return the merged page"
+                on_read += read_ms
+                inbox += inbox_ms
+                if len(merged) < limit:
+                    break
+                cursor = (merged[-2][1], merged[-2][0])
+            on_read_all += on_read
+            inbox_all += inbox
+            print(f"{user_id:>10} {friend_counts[user_id]:>8} "
+                  f"{statistics.median(on_read):>10.2f}ms {p95(on_read):>7.2f}ms "
+                  f"{statistics.median(inbox):>8.2f}ms {p95(inbox):>7.2f}ms")
+        print(f"{'all':>10} {'':>8} {statistics.median(on_read_all):>10.2f}ms {p95(on_read_all):>7.2f}ms "
+              f"{statistics.median(inbox_all):>8.2f}ms {p95(inbox_all):>7.2f}ms")
+
+        # Random authors: a workout reaches every inbox among their friends, the sampled users' and any built before
+        authors = [rng.choice(by_friends) for _ in range(args.writes)]
+        latencies, deliveries = [], []
+        today = datetime.date.today()
+        for n, author_id in enumerate(authors, 1):
+            start = time.perf_counter()
+            # IDs no workout has, so every copy is new; the transaction is rolled back
+            cur.execute(backend.FAN_OUT_SQL, ([author_id], [today], [-n], [30]))
+            latencies.append((time.perf_counter() - start) * 1000)
+            deliveries.append(cur.rowcount)
+        print(f"\nFan-out on write: {len(authors)} workouts copied into {sum(deliveries)} inbox rows "
+              f"(mean {statistics.mean(deliveries):.1f}, max {max(deliveries)} per workout); "
+              f"p50 {statistics.median(latencies):.2f}ms, p95 {p95(latencies):.2f}ms per workout")
+        cur.execute("SELECT COUNT(*) FROM FeedItems WHERE user_id = ANY(%s);", (sampled,))
+        print(f"Inbox storage: {cur.fetchone()[0]} rows for {len(sampled)} sampled users "
+              f"(at most {args.inbox_size + 1} each between trims)")
+        return 0
+    finally:
+        conn.rollback()
+        backend.close_db_connection(conn, cur)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Benchmarks friend-graph lookups on a large synthetic graph.
+
+Compares the original OR-join friends query with the UNION ALL lookup behind
+Backend.read_friends for "hub" users with many friends. Run it against a
+scratch database that already has the schema applied, e.g.:
+
+    python Migrations.py migrate
+    python benchmarks/friends_graph.py --database fitness_bench --users 1000000 --edges 1000000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Backend as backend
+
+OR_JOIN_FRIENDS_SQL = (
+    "SELECT U.user_id, U.name, U.email FROM Friends F "
+    "JOIN Users U ON F.user_id_1 = U.user_id OR F.user_id_2 = U.user_id "
+    "WHERE (F.user_id_1 = %s OR F.user_id_2 = %s) AND U.user_id != %s;"
+)
+UNION_FRIENDS_SQL = (
+    f"SELECT U.user_id, U.name, U.email FROM ({backend.FRIEND_IDS_SQL}) F "
+    "JOIN Users U ON U.user_id = F.friend_id;"
+)
+
+
+def seed_graph(cur, users, edges, hubs, hub_degree):
+    """Loads `users` users, `edges` random friendships and `hubs` users with `hub_degree` friends each."""
+    cur.execute("SELECT COALESCE(MAX(user_id), 0) FROM Users;")
+    first_id = cur.fetchone()[0] + 1
+    last_id = first_id + users - 1
+    cur.execute(
+        """
+        INSERT INTO Users (name, email, weight_kg)
+        SELECT 'Graph User ' || n, 'graph.' || n || '.' || md5(random()::text) || '@example.com', 70
+        FROM generate_series(%s, %s) AS n;
+        """,
+        (first_id, last_id)
+    )
+    cur.execute(
+        """
+        INSERT INTO Friends (user_id_1, user_id_2)
+        SELECT LEAST(a, b), GREATEST(a, b) FROM (
+            SELECT %s + floor(random() * %s)::int AS a, %s + floor(random() * %s)::int AS b
+            FROM generate_series(1, %s)
+        ) pairs
+        WHERE a != b
+        ON CONFLICT DO NOTHING;
+        """,
+        (first_id, users, first_id, users, edges)
+    )
+    # Hubs are spread across the ID range so they sit on both sides of the stored pairs
+    hub_ids = [first_id + (i * users) // hubs for i in range(hubs)]
+    for hub_id in hub_ids:
+        cur.execute(
+            """
+            INSERT INTO Friends (user_id_1, user_id_2)
+            SELECT LEAST(%s, n), GREATEST(%s, n)
+            FROM generate_series(%s, %s) AS n
+            WHERE n != %s
+            ON CONFLICT DO NOTHING;
+            """,
+            (hub_id, hub_id, first_id, min(last_id, first_id + hub_degree), hub_id)
+        )
+    cur.execute("ANALYZE Users; ANALYZE Friends;")
+    return hub_ids
+
+
+def time_query(cur, sql, params, repeat):
+    """Runs a query `repeat` times and returns the latencies in milliseconds and the row count."""
+    latencies = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cur.execute(sql, params)
+        rows = len(cur.fetchall())
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default=backend.DB_CONFIG["database"])
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--edges", type=int, default=1000000)
+    parser.add_argument("--hubs", type=int, default=5)
+    parser.add_argument("--hub-degree", type=int, default=12000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--no-seed", action="store_true", help="reuse the graph already in the database")
+    args = parser.parse_args(argv)
+
+    backend.DB_CONFIG["database"] = args.database
+    conn = backend.get_db_connection()
+    if not conn: return 1
+    cur = conn.cursor()
+    try:
+        if args.no_seed:
+            cur.execute(
+                "SELECT member FROM (SELECT user_id_1 AS member FROM Friends UNION ALL SELECT user_id_2 FROM Friends) M "
+                "GROUP BY member ORDER BY COUNT(*) DESC LIMIT %s;",
+                (args.hubs,)
+            )
+            hub_ids = [row[0] for row in cur.fetchall()]
+        else:
+            print(f"Seeding {args.users} users, {args.edges} random edges and {args.hubs} hubs...")
+            hub_ids = seed_graph(cur, args.users, args.edges, args.hubs, args.hub_degree)
+            conn.commit()
+        cur.execute("SELECT COUNT(*) FROM Friends;")
+        print(f"Friend graph: {cur.fetchone()[0]} edges")
+
+        print(f"{'user':>10} {'friends':>8} {'or-join p50':>12} {'p95':>9} {'union p50':>10} {'p95':>9}")
+        for hub_id in hub_ids:
+            old, old_rows = time_query(cur, OR_JOIN_FRIENDS_SQL, (hub_id, hub_id, hub_id), args.repeat)
+            new, new_rows = time_query(cur, UNION_FRIENDS_SQL, (hub_id, hub_id), args.repeat)
+            assert old_rows == new_rows, "both queries must return the same friends"
+            print(f"{hub_id:>10} {new_rows:>8} "
+                  f"{statistics.median(old):>10.1f}ms {statistics.quantiles(old, n=20)[-1]:>7.1f}ms "
+                  f"{statistics.median(new):>8.1f}ms {statistics.quantiles(new, n=20)[-1]:>7.1f}ms")
+        conn.rollback()
+        return 0
+    finally:
+        backend.close_db_connection(conn, cur)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
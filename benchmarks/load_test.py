@@ -0,0 +1,264 @@
+"""Load-tests the backend functions and records latency, throughput and queries per operation.
+
+Each scenario calls one Backend function from several threads at once against
+random users, and the results are written as JSON so runs can be compared:
+
+    python benchmarks/load_test.py --database fitness_bench --seed --users 10000 --output run.json
+    python benchmarks/load_test.py --database fitness_bench --output new.json --compare run.json
+
+Pass --replica once per read replica (HOST:PORT) to spread the reads across them.
+The enqueue_workout scenario times write-behind acknowledgements; --drain then
+writes the queue and reports how long that took.
+
+--processes splits the threads across processes, like several app processes behind a
+load balancer; give them a shared cache (a Redis URL or a SQLite file) with --cache-url
+to see how many loads its single-flight saves:
+
+    python benchmarks/load_test.py --scenarios read_leaderboard --processes 4 --cache-url /tmp/cache.sqlite3
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Backend as backend
+import Instrumentation as instrumentation
+import WriteQueue as write_queue
+import datagen
+
+
+def _random_workout(rng, user_id):
+    return (user_id, datetime.date.today() - datetime.timedelta(days=rng.randrange(60)), rng.randint(15, 90), [
+        {'name': rng.choice(datagen.EXERCISE_NAMES), 'sets': 3, 'reps': 10, 'weight': 50.0}
+        for _ in range(4)
+    ])
+
+
+# name -> function(rng, user_id, emails) running one operation
+SCENARIOS = {
+    "read_user_by_email": lambda rng, user_id, emails: backend.read_user_by_email(emails[user_id]),
+    "read_friends": lambda rng, user_id, emails: backend.read_friends(user_id),
+    "read_workouts": lambda rng, user_id, emails: backend.read_workouts(user_id),
+    "read_workout_history": lambda rng, user_id, emails: backend.read_workout_history(user_id),
+    "read_goals": lambda rng, user_id, emails: backend.read_goals(user_id),
+    "read_leaderboard": lambda rng, user_id, emails: backend.read_leaderboard(user_id, rng.choice(backend.LEADERBOARD_PERIODS)),
+    # Global boards read the last ranking; run `Batch.py refresh-leaderboards` first
+    "read_global_leaderboard": lambda rng, user_id, emails: backend.read_leaderboard(user_id, rng.choice(backend.LEADERBOARD_PERIODS), scope="global"),
+    "read_leaderboard_rank": lambda rng, user_id, emails: backend.read_leaderboard_rank(user_id, rng.choice(backend.LEADERBOARD_PERIODS)),
+    # Users with many friends read an inbox once `Batch.py refresh-feed-inboxes` has run
+    "read_activity_feed": lambda rng, user_id, emails: backend.read_activity_feed(user_id),
+    "create_workout_with_exercises": lambda rng, user_id, emails: backend.create_workout_with_exercises(*_random_workout(rng, user_id)),
+    # Only the acknowledgement; run `Batch.py drain-queue` (or --drain) to time the writes
+    "enqueue_workout": lambda rng, user_id, emails: write_queue.enqueue_workout(*_random_workout(rng, user_id)),
+}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def _run_threads(name, user_ids, emails, per_thread, rng_seed):
+    """Runs one scenario on a thread per entry of `per_thread` (its number of calls); returns [(latencies, queries)]."""
+    operation = SCENARIOS[name]
+
+    def worker(index):
+        rng = random.Random(rng_seed + index)
+        latencies, queries = [], []
+        for _ in range(per_thread[index]):
+            with instrumentation.request_scope() as summary:
+                start = time.perf_counter()
+                operation(rng, rng.choice(user_ids), emails)
+                latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(summary.queries)
+        return latencies, queries
+
+    with ThreadPoolExecutor(max_workers=len(per_thread)) as pool:
+        return list(pool.map(worker, range(len(per_thread))))
+
+
+def _init_process(db_config, replica_configs, prepare_statements, pool_size, cache_url, cache):
+    """Points a spawned process at the parent's database, replicas, statement and cache settings."""
+    backend.DB_CONFIG.update(db_config)
+    backend.configure(prepare_statements=prepare_statements)
+    backend.configure_pool(min_size=pool_size, max_size=pool_size)
+    if replica_configs:
+        backend.configure_replicas(replica_configs, max_size=pool_size)
+    backend.configure_cache(max_entries=backend.CACHE_MAX_ENTRIES if cache else 0, url=cache_url)
+
+
+def _run_process(args):
+    return _run_threads(*args), backend.cache_stats()
+
+
+def run_scenario(name, user_ids, emails, concurrency, operations, rng_seed, processes=1):
+    """Runs `operations` calls of one scenario across `concurrency` threads and summarizes them.
+
+    With several `processes` the threads are split between them, each with its own
+    connection pool and cache (shared if the cache is).
+    """
+    per_thread = [operations // concurrency + (1 if i < operations % concurrency else 0) for i in range(concurrency)]
+
+    started = time.perf_counter()
+    cache = None
+    if processes <= 1:
+        results = _run_threads(name, user_ids, emails, per_thread, rng_seed)
+    else:
+        shares = [per_thread[i::processes] for i in range(processes)]
+        # Spawn rather than fork so no process inherits the parent's pooled connections
+        context = multiprocessing.get_context("spawn")
+        caching = backend.cache_stats()["max_entries"] != 0
+        with ProcessPoolExecutor(processes, mp_context=context, initializer=_init_process,
+                                 initargs=(backend.DB_CONFIG, backend.REPLICA_CONFIGS, backend.PREPARE_STATEMENTS,
+                                           max(map(len, shares)),
+                                           backend.CACHE_URL, caching)) as pool:
+            outcomes = list(pool.map(_run_process, [
+                (name, user_ids, emails, share, rng_seed + 1000 * i) for i, share in enumerate(shares)
+            ]))
+        results = [thread for threads, _ in outcomes for thread in threads]
+        # Loads that reached the database, summed over the processes
+        cache = {key: sum(stats.get(key, 0) for _, stats in outcomes) for key in ("hits", "misses", "coalesced")}
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(ms for thread_latencies, _ in results for ms in thread_latencies)
+    queries = [q for _, thread_queries in results for q in thread_queries]
+    result = {
+        "operations": len(latencies),
+        "concurrency": concurrency,
+        "processes": processes,
+        "seconds": round(elapsed, 3),
+        "throughput_ops": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "queries_per_op": round(statistics.mean(queries), 2),
+    }
+    if cache:
+        result["cache"] = cache
+    return result
+
+
+def compare(current, baseline_path):
+    """Prints latency and throughput deltas against a previous JSON result."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["scenarios"]
+    print(f"\nChange vs {baseline_path}:")
+    for name, result in current.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        deltas = []
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_ops", "queries_per_op"):
+            if before.get(metric):
+                deltas.append(f"{metric} {100 * (result[metric] - before[metric]) / before[metric]:+.1f}%")
+        print(f"  {name:<30} {', '.join(deltas)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default=backend.DB_CONFIG["database"])
+    parser.add_argument("--seed", action="store_true", help="load a synthetic dataset first")
+    datagen.add_arguments(parser)
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=2000, help="calls per scenario")
+    parser.add_argument("--cache", action="store_true", help="keep the read-through cache enabled")
+    parser.add_argument("--cache-url", help="share the cache through this Redis URL or SQLite file (implies --cache)")
+    parser.add_argument("--processes", type=int, default=1, help="split the threads across this many processes")
+    parser.add_argument("--no-prepare", action="store_true", help="send every statement unprepared")
+    parser.add_argument("--drain", action="store_true", help="write the workouts queued by enqueue_workout afterwards")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="a previous JSON result to compare against")
+    parser.add_argument("--replica", action="append", default=[], metavar="HOST:PORT",
+                        help="route reads to this replica of the database; repeat for several")
+    args = parser.parse_args(argv)
+
+    backend.DB_CONFIG["database"] = args.database
+    backend.configure(prepare_statements=not args.no_prepare)
+    backend.configure_pool(min_size=args.concurrency, max_size=args.concurrency)
+    if args.replica:
+        backend.configure_replicas(
+            [dict(zip(("host", "port"), replica.rsplit(":", 1))) for replica in args.replica],
+            max_size=args.concurrency,
+        )
+    if args.cache_url:
+        backend.configure(cache_url=args.cache_url)
+    elif not args.cache:
+        backend.configure_cache(max_entries=0)
+
+    dataset = None
+    if args.seed:
+        dataset = datagen.seed(args.users, args.mean_friends, args.degree_distribution, args.max_friends,
+                               args.workouts_per_user, args.exercises_per_workout, args.days, args.rng_seed)
+        if dataset is None:
+            return 1
+        print(f"Seeded {dataset}")
+
+    conn = backend.get_db_connection()
+    if not conn: return 1
+    cur = conn.cursor()
+    cur.execute("SELECT user_id, email FROM Users;")
+    emails = dict(cur.fetchall())
+    cur.execute("SELECT COUNT(*) FROM Workouts;")
+    workouts = cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*) FROM Friends;")
+    friendships = cur.fetchone()[0]
+    backend.close_db_connection(conn, cur)
+    user_ids = sorted(emails)
+
+    results = {}
+    print(f"{'scenario':<30} {'ops/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'queries/op':>11}")
+    for name in args.scenarios:
+        result = run_scenario(name, user_ids, emails, args.concurrency, args.operations, args.rng_seed, args.processes)
+        results[name] = result
+        print(f"{name:<30} {result['throughput_ops']:>9} {result['p50_ms']:>7.2f}ms {result['p95_ms']:>7.2f}ms "
+              f"{result['p99_ms']:>7.2f}ms {result['queries_per_op']:>11}")
+
+    queue = None
+    if "enqueue_workout" in args.scenarios:
+        if args.drain:
+            started = time.perf_counter()
+            drained = write_queue.drain()
+            elapsed = time.perf_counter() - started
+            print(f"\nDrained {drained} queued workouts in {elapsed:.2f}s"
+                  + (f" ({drained / elapsed:.0f}/s)" if drained and elapsed else ""))
+        queue = write_queue.queue_stats()
+
+    report = {
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "database": {"users": len(user_ids), "workouts": workouts, "friendships": friendships, "seeded": dataset},
+        "settings": {"concurrency": args.concurrency, "processes": args.processes, "operations": args.operations,
+                     "cache": args.cache or bool(args.cache_url), "cache_url": backend.CACHE_URL,
+                     "replicas": args.replica, "prepare_statements": backend.PREPARE_STATEMENTS,
+                     "statement_timeout_ms": backend.STATEMENT_TIMEOUT_MS},
+        "pool": backend.get_pool().stats(),
+        "cache": backend.cache_stats(),
+        "replicas": backend.replica_stats(),
+        "queue": queue,
+        "statements": {name: stats for (_, name), stats in instrumentation.histograms("statement").items()},
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"\nWrote {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
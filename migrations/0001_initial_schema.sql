@@ -0,0 +1,50 @@
+-- Base schema for the Personal Fitness Tracker.
+-- Uses IF NOT EXISTS so databases created from the `Database` script can adopt migrations.
+
+CREATE TABLE IF NOT EXISTS Users (
+    user_id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    email VARCHAR(255) UNIQUE NOT NULL,
+    weight_kg DECIMAL(5, 2),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS Friends (
+    friendship_id SERIAL PRIMARY KEY,
+    user_id_1 INT NOT NULL,
+    user_id_2 INT NOT NULL,
+    FOREIGN KEY (user_id_1) REFERENCES Users(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id_2) REFERENCES Users(user_id) ON DELETE CASCADE,
+    CHECK (user_id_1 != user_id_2),
+    UNIQUE (user_id_1, user_id_2)
+);
+
+CREATE TABLE IF NOT EXISTS Workouts (
+    workout_id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL,
+    workout_date DATE NOT NULL,
+    duration_minutes INT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS Exercises (
+    exercise_id SERIAL PRIMARY KEY,
+    workout_id INT NOT NULL,
+    exercise_name VARCHAR(255) NOT NULL,
+    sets INT,
+    reps INT,
+    weight_kg DECIMAL(5, 2),
+    FOREIGN KEY (workout_id) REFERENCES Workouts(workout_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS Goals (
+    goal_id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL,
+    goal_description TEXT NOT NULL,
+    target_value INT,
+    start_date DATE NOT NULL,
+    end_date DATE,
+    is_completed BOOLEAN DEFAULT FALSE,
+    FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+);
@@ -0,0 +1,14 @@
+-- Secondary indexes for the lookups Backend.py performs.
+
+-- read_workouts / read_workout_history / read_leaderboard: a user's workouts, newest first.
+-- Also serves plain user_id lookups, so no separate Workouts(user_id) index is needed.
+CREATE INDEX IF NOT EXISTS workouts_user_date_idx ON Workouts (user_id, workout_date DESC, workout_id DESC);
+
+-- read_exercises_for_workout and the batched history fetch; also speeds up ON DELETE CASCADE.
+CREATE INDEX IF NOT EXISTS exercises_workout_idx ON Exercises (workout_id);
+
+-- read_goals: ordered by completion status and deadline.
+CREATE INDEX IF NOT EXISTS goals_user_status_end_idx ON Goals (user_id, is_completed, end_date);
+
+-- Friendship lookups from the second member; the UNIQUE (user_id_1, user_id_2) index covers the first.
+CREATE INDEX IF NOT EXISTS friends_user2_idx ON Friends (user_id_2, user_id_1);
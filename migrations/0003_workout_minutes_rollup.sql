@@ -0,0 +1,21 @@
+-- Per-user workout minutes per ISO week (Monday start) and per calendar month.
+-- Kept current by Backend.py in the same transaction as every workout insert and delete.
+
+CREATE TABLE IF NOT EXISTS WorkoutMinutesRollup (
+    user_id INT NOT NULL,
+    period VARCHAR(8) NOT NULL CHECK (period IN ('week', 'month')),
+    period_start DATE NOT NULL,
+    total_minutes INT NOT NULL DEFAULT 0,
+    workout_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, period, period_start),
+    FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+);
+
+-- Backfill from existing workouts; re-running recomputes the totals from scratch.
+INSERT INTO WorkoutMinutesRollup (user_id, period, period_start, total_minutes, workout_count)
+SELECT W.user_id, P.period, date_trunc(P.period, W.workout_date)::date,
+       COALESCE(SUM(W.duration_minutes), 0), COUNT(*)
+FROM Workouts W CROSS JOIN (VALUES ('week'), ('month')) AS P (period)
+GROUP BY W.user_id, P.period, date_trunc(P.period, W.workout_date)
+ON CONFLICT (user_id, period, period_start) DO UPDATE
+SET total_minutes = EXCLUDED.total_minutes, workout_count = EXCLUDED.workout_count;
@@ -0,0 +1,50 @@
+-- Per-user, per-exercise totals and personal records, keyed by a normalized exercise name
+-- so "Squats" and "squat " share one row. Kept current by Backend.py in the same
+-- transaction as every workout insert and delete; Migrations.py rebuild-stats recomputes it.
+
+-- Lowercase, trim, collapse inner whitespace and drop one trailing plural "s" (but not "ss").
+-- Backend.normalize_exercise_name mirrors this; change both together.
+CREATE OR REPLACE FUNCTION normalize_exercise_name(name TEXT) RETURNS TEXT
+LANGUAGE SQL IMMUTABLE STRICT PARALLEL SAFE
+AS $$
+    SELECT regexp_replace(lower(regexp_replace(btrim(name, E' \t\r\n'), '\s+', ' ', 'g')), '([^s])s$', '\1')
+$$;
+
+ALTER TABLE Exercises
+    ADD COLUMN IF NOT EXISTS exercise_key TEXT GENERATED ALWAYS AS (normalize_exercise_name(exercise_name)) STORED;
+
+CREATE TABLE IF NOT EXISTS ExerciseStats (
+    user_id INT NOT NULL,
+    exercise_key TEXT NOT NULL,
+    exercise_name VARCHAR(255) NOT NULL,
+    entry_count INT NOT NULL DEFAULT 0,
+    total_sets BIGINT NOT NULL DEFAULT 0,
+    total_reps BIGINT NOT NULL DEFAULT 0,
+    total_volume NUMERIC NOT NULL DEFAULT 0,
+    best_weight_kg DECIMAL(5, 2),
+    best_weight_date DATE,
+    best_e1rm_kg NUMERIC(7, 2),
+    best_e1rm_date DATE,
+    last_performed DATE,
+    PRIMARY KEY (user_id, exercise_key),
+    FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+);
+
+-- Backfill from existing exercises; re-running recomputes the stats from scratch.
+DELETE FROM ExerciseStats;
+INSERT INTO ExerciseStats (user_id, exercise_key, exercise_name, entry_count, total_sets, total_reps, total_volume,
+                           best_weight_kg, best_weight_date, best_e1rm_kg, best_e1rm_date, last_performed)
+SELECT W.user_id, E.exercise_key, MIN(regexp_replace(btrim(E.exercise_name), '\s+', ' ', 'g')), COUNT(*),
+       COALESCE(SUM(E.sets), 0), COALESCE(SUM(E.sets * E.reps), 0), COALESCE(SUM(E.sets * E.reps * E.weight_kg), 0),
+       MAX(E.weight_kg) FILTER (WHERE E.weight_kg > 0),
+       (array_agg(W.workout_date ORDER BY E.weight_kg DESC, W.workout_date) FILTER (WHERE E.weight_kg > 0))[1],
+       MAX(X.e1rm),
+       (array_agg(W.workout_date ORDER BY X.e1rm DESC, W.workout_date) FILTER (WHERE X.e1rm IS NOT NULL))[1],
+       MAX(W.workout_date)
+FROM Exercises E
+JOIN Workouts W ON W.workout_id = E.workout_id
+CROSS JOIN LATERAL (
+    SELECT CASE WHEN E.weight_kg > 0 AND E.reps > 1 THEN round(E.weight_kg * (1 + E.reps / 30.0), 2)
+                WHEN E.weight_kg > 0 AND E.reps = 1 THEN E.weight_kg END AS e1rm
+) X
+GROUP BY W.user_id, E.exercise_key;
@@ -0,0 +1,9 @@
+-- What a goal's target_value measures, and the latest progress towards it.
+-- 'manual' goals are only completed from the Goals page; the others are evaluated
+-- by Backend.evaluate_goals over the workouts between start_date and end_date.
+
+ALTER TABLE Goals
+    ADD COLUMN IF NOT EXISTS metric VARCHAR(16) NOT NULL DEFAULT 'manual'
+        CHECK (metric IN ('manual', 'workouts', 'minutes', 'volume')),
+    ADD COLUMN IF NOT EXISTS progress_value NUMERIC,
+    ADD COLUMN IF NOT EXISTS evaluated_at TIMESTAMPTZ;
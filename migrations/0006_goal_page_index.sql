@@ -0,0 +1,9 @@
+-- Goals are listed open ones first, then by end date with open-ended goals last, with
+-- goal_id as a tie-breaker so keyset pagination has a total order. This index serves
+-- that order directly and also covers the (user_id, is_completed) lookups of goal
+-- evaluation, so it replaces goals_user_status_end_idx.
+
+CREATE INDEX IF NOT EXISTS goals_user_page_idx
+    ON Goals (user_id, is_completed, (COALESCE(end_date, 'infinity'::date)), goal_id);
+
+DROP INDEX IF EXISTS goals_user_status_end_idx;
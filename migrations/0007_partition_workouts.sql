@@ -0,0 +1,98 @@
+-- Range-partitions Workouts and Exercises by month of workout_date. Exercises carry
+-- their workout's date so both halves of a month live in partitions with the same
+-- bounds, and a month can be archived (Backend.archive_partitions) by detaching two
+-- tables. Partitions are named workouts_YYYY_MM and exercises_YYYY_MM; there is no
+-- default partition, so writers create the months they need first (Backend.ensure_partitions).
+
+-- Creates the monthly partitions of both tables for every month from first_month through
+-- last_month that does not have them yet. Returns the number of months created.
+CREATE OR REPLACE FUNCTION create_workout_partitions(first_month DATE, last_month DATE) RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    month DATE := date_trunc('month', first_month)::date;
+    suffix TEXT;
+    created INT := 0;
+BEGIN
+    WHILE month <= last_month LOOP
+        suffix := to_char(month, 'YYYY_MM');
+        IF to_regclass('workouts_' || suffix) IS NULL THEN
+            EXECUTE format('CREATE TABLE workouts_%s PARTITION OF Workouts FOR VALUES FROM (%L) TO (%L)',
+                           suffix, month, (month + INTERVAL '1 month')::date);
+            EXECUTE format('CREATE TABLE exercises_%s PARTITION OF Exercises FOR VALUES FROM (%L) TO (%L)',
+                           suffix, month, (month + INTERVAL '1 month')::date);
+            created := created + 1;
+        END IF;
+        month := (month + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END
+$$;
+
+-- Keep the ID sequences: they survive the old tables and keep numbering where it left off.
+ALTER SEQUENCE workouts_workout_id_seq OWNED BY NONE;
+ALTER SEQUENCE exercises_exercise_id_seq OWNED BY NONE;
+
+ALTER TABLE Exercises RENAME TO exercises_unpartitioned;
+ALTER TABLE Workouts RENAME TO workouts_unpartitioned;
+ALTER INDEX workouts_pkey RENAME TO workouts_unpartitioned_pkey;
+ALTER INDEX exercises_pkey RENAME TO exercises_unpartitioned_pkey;
+ALTER INDEX IF EXISTS workouts_user_date_idx RENAME TO workouts_unpartitioned_user_date_idx;
+ALTER INDEX IF EXISTS exercises_workout_idx RENAME TO exercises_unpartitioned_workout_idx;
+
+-- Primary keys of partitioned tables must include the partition key; the IDs stay
+-- unique because they come from one sequence.
+CREATE TABLE Workouts (
+    workout_id INT NOT NULL DEFAULT nextval('workouts_workout_id_seq'),
+    user_id INT NOT NULL,
+    workout_date DATE NOT NULL,
+    duration_minutes INT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (workout_id, workout_date),
+    FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE
+) PARTITION BY RANGE (workout_date);
+
+CREATE TABLE Exercises (
+    exercise_id INT NOT NULL DEFAULT nextval('exercises_exercise_id_seq'),
+    workout_id INT NOT NULL,
+    workout_date DATE NOT NULL,
+    exercise_name VARCHAR(255) NOT NULL,
+    sets INT,
+    reps INT,
+    weight_kg DECIMAL(5, 2),
+    exercise_key TEXT GENERATED ALWAYS AS (normalize_exercise_name(exercise_name)) STORED,
+    PRIMARY KEY (exercise_id, workout_date),
+    FOREIGN KEY (workout_id, workout_date) REFERENCES Workouts (workout_id, workout_date) ON DELETE CASCADE
+) PARTITION BY RANGE (workout_date);
+
+ALTER SEQUENCE workouts_workout_id_seq OWNED BY Workouts.workout_id;
+ALTER SEQUENCE exercises_exercise_id_seq OWNED BY Exercises.exercise_id;
+
+-- Same lookups as 0002_secondary_indexes.sql, now built on every partition.
+CREATE INDEX workouts_user_date_idx ON Workouts (user_id, workout_date DESC, workout_id DESC);
+CREATE INDEX exercises_workout_idx ON Exercises (workout_id);
+
+-- Every month that has workouts, through three months from now.
+SELECT create_workout_partitions(
+    LEAST((SELECT MIN(workout_date) FROM workouts_unpartitioned), CURRENT_DATE),
+    (CURRENT_DATE + INTERVAL '3 months')::date
+);
+
+INSERT INTO Workouts (workout_id, user_id, workout_date, duration_minutes, created_at)
+SELECT workout_id, user_id, workout_date, duration_minutes, created_at FROM workouts_unpartitioned;
+
+INSERT INTO Exercises (exercise_id, workout_id, workout_date, exercise_name, sets, reps, weight_kg)
+SELECT E.exercise_id, E.workout_id, W.workout_date, E.exercise_name, E.sets, E.reps, E.weight_kg
+FROM exercises_unpartitioned E
+JOIN workouts_unpartitioned W ON W.workout_id = E.workout_id;
+
+DROP TABLE exercises_unpartitioned;
+DROP TABLE workouts_unpartitioned;
+
+-- Per-user, per-exercise totals of the archived months, in ExerciseStats' shape. Live
+-- stats already include them; they are kept so stats recomputed from the remaining
+-- Exercises rows (after a delete, or by rebuild-stats) do not lose archived history.
+CREATE TABLE IF NOT EXISTS ArchivedExerciseStats (LIKE ExerciseStats INCLUDING DEFAULTS);
+ALTER TABLE ArchivedExerciseStats
+    ADD PRIMARY KEY (user_id, exercise_key),
+    ADD FOREIGN KEY (user_id) REFERENCES Users(user_id) ON DELETE CASCADE;
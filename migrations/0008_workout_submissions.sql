@@ -0,0 +1,14 @@
+-- Idempotency keys of logged workouts. A key is stored in the same transaction as its
+-- workout, so a submission retried after a failure or a lost commit (by WriteQueue's
+-- worker, or a form sent twice) is recognised and not written again. Keys are pruned
+-- after Backend.SUBMISSION_KEY_RETENTION_DAYS by Backend.prune_workout_submissions.
+
+CREATE TABLE IF NOT EXISTS WorkoutSubmissions (
+    submission_key TEXT PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
+    workout_id INT,
+    submitted_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS workout_submissions_applied_idx ON WorkoutSubmissions (applied_at);
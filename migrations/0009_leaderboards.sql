@@ -0,0 +1,53 @@
+-- Leaderboards over rolling windows and across all users.
+--
+-- WorkoutMinutesRollup gains per-day rows, which rolling windows (the last 30 days)
+-- are summed from. Only the last Backend.DAY_ROLLUP_DAYS days are kept; older ones are
+-- dropped by Backend.refresh_leaderboards.
+--
+-- Global leaderboards rank every user, which is too much work for a page load, so
+-- refresh_leaderboards ranks each window into LeaderboardRanks ahead of time and
+-- pages read the top of a window, or the rank of one user, straight from its indexes.
+
+ALTER TABLE WorkoutMinutesRollup DROP CONSTRAINT IF EXISTS workoutminutesrollup_period_check;
+ALTER TABLE WorkoutMinutesRollup ADD CONSTRAINT workoutminutesrollup_period_check
+    CHECK (period IN ('day', 'week', 'month'));
+
+-- The rows of one window across all users, for ranking it. total_minutes is left out so
+-- rollup updates stay HOT.
+CREATE INDEX IF NOT EXISTS workout_minutes_rollup_window_idx ON WorkoutMinutesRollup (period, period_start);
+
+-- Backfill the kept days (the last DAY_ROLLUP_DAYS = 92); re-running recomputes them from scratch.
+INSERT INTO WorkoutMinutesRollup (user_id, period, period_start, total_minutes, workout_count)
+SELECT user_id, 'day', workout_date, COALESCE(SUM(duration_minutes), 0), COUNT(*)
+FROM Workouts
+WHERE workout_date >= CURRENT_DATE - 91
+GROUP BY user_id, workout_date
+ON CONFLICT (user_id, period, period_start) DO UPDATE
+SET total_minutes = EXCLUDED.total_minutes, workout_count = EXCLUDED.workout_count;
+
+-- One row per ranked window. Users without minutes in it are not stored; they share
+-- rank ranked_users + 1 out of total_users.
+CREATE TABLE IF NOT EXISTS LeaderboardSnapshots (
+    period VARCHAR(8) NOT NULL,
+    period_start DATE NOT NULL,
+    ranked_users INT NOT NULL DEFAULT 0,
+    total_users INT NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (period, period_start)
+);
+
+CREATE TABLE IF NOT EXISTS LeaderboardRanks (
+    period VARCHAR(8) NOT NULL,
+    period_start DATE NOT NULL,
+    user_id INT NOT NULL,
+    total_minutes INT NOT NULL,
+    rank INT NOT NULL,
+    PRIMARY KEY (period, period_start, user_id)
+);
+-- No foreign keys: checking one costs more than inserting the row when a window of a
+-- million users is ranked, and the one to Users would need an index on user_id for
+-- deletes. Only refresh_leaderboards writes these tables, and it replaces the snapshot
+-- and the ranks of a window together. Reads join Users, so a deleted user drops off the board.
+
+-- The top of a window, in rank order
+CREATE INDEX IF NOT EXISTS leaderboard_ranks_rank_idx ON LeaderboardRanks (period, period_start, rank, user_id);
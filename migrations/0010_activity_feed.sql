@@ -0,0 +1,31 @@
+-- Fan-out inboxes for the activity feed, which lists the workouts of the friends of a user.
+--
+-- A feed is read by merging the newest workouts of every friend (Backend.FRIENDS_FEED_SQL),
+-- which costs one index probe per friend. Users with at least Backend.FEED_INBOX_MIN_FRIENDS
+-- friends get an inbox instead: each workout a friend logs is copied into the inboxes of
+-- the friends of its author as it is written, and their feed pages are one range scan of it.
+-- Inboxes are created and trimmed by Backend.refresh_feed_inboxes.
+
+-- One row per inbox. An inbox holds every workout of a friend from (horizon_date, horizon_id)
+-- on, or all of them while horizon_date is NULL; older pages are merged on read. Writers
+-- copy into an inbox as soon as its row exists; reads use it once built_at is set.
+CREATE TABLE IF NOT EXISTS FeedInboxes (
+    user_id INT PRIMARY KEY REFERENCES Users(user_id) ON DELETE CASCADE,
+    horizon_date DATE,
+    horizon_id INT,
+    built_at TIMESTAMP WITH TIME ZONE
+);
+
+-- The workouts in each inbox, with what a feed shows of them. A workout is keyed like
+-- the cursor of a feed page, so a page is an ordered range scan of the primary key.
+CREATE TABLE IF NOT EXISTS FeedItems (
+    user_id INT NOT NULL REFERENCES FeedInboxes(user_id) ON DELETE CASCADE,
+    workout_date DATE NOT NULL,
+    workout_id INT NOT NULL,
+    author_id INT NOT NULL REFERENCES Users(user_id) ON DELETE CASCADE,
+    duration_minutes INT,
+    PRIMARY KEY (user_id, workout_date, workout_id)
+);
+
+-- A deleted workout, or a deleted author, is removed from every inbox through this index
+CREATE INDEX IF NOT EXISTS feed_items_author_idx ON FeedItems (author_id, workout_id);
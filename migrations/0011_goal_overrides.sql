@@ -0,0 +1,14 @@
+-- Goal progress that outlives archiving, and completion set by hand.
+--
+-- archived_progress holds what the workouts of archived months added to a goal. It is
+-- folded in by Backend.archive_partitions in the transaction that moves a month out,
+-- as ArchivedExerciseStats is for exercise stats, and Backend.evaluate_goals adds it to
+-- the progress counted over the months still in the database. Months archived before
+-- this migration are not counted.
+--
+-- completion_overridden is set when a user marks a goal complete or open on the Goals
+-- page; evaluation keeps updating its progress but no longer changes is_completed.
+
+ALTER TABLE Goals
+    ADD COLUMN IF NOT EXISTS archived_progress NUMERIC NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS completion_overridden BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,71 @@
+import os
+import sys
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        if self.conn.closed or self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.statements.append(query)
+        self.conn.in_transaction = True
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Stands in for a psycopg2 connection: tracks its transaction, and can break like a dropped one."""
+
+    def __init__(self, server):
+        self.server = server
+        self.closed = 0
+        self.broken = False        # statements fail, as on a connection the server dropped
+        self.in_transaction = False
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        if self.in_transaction:
+            return psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        if self.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeDatabase:
+    """A connection factory for ConnectionPool that remembers every connection it opened."""
+
+    def __init__(self, name):
+        self.name = name
+        self.down = False          # refuse new connections, like a server that is unreachable
+        self.connections = []
+
+    def __call__(self):
+        if self.down:
+            raise psycopg2.OperationalError(f"could not connect to {self.name}")
+        conn = FakeConnection(self.name)
+        self.connections.append(conn)
+        return conn
+
+
+@pytest.fixture
+def make_database():
+    """Returns FakeDatabase, so a test can make as many fake servers as it needs."""
+    return FakeDatabase
@@ -0,0 +1,127 @@
+import csv
+import datetime
+import gzip
+import os
+
+import pytest
+
+import Backend as backend
+
+USER = 7
+
+
+def day(text):
+    return datetime.date.fromisoformat(text)
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    """Writes archived months the way archive_partitions does; returns a function that adds one part."""
+    directory = str(tmp_path)
+    manifest = {}
+    reads = []
+    read_archive_csv = backend._read_archive_csv
+    monkeypatch.setattr(backend, "_read_archive_csv", lambda directory, filename: (
+        reads.append(filename) or read_archive_csv(directory, filename)
+    ))
+
+    def add_part(label, workouts):
+        """Archives (workout_id, user_id, date, duration) rows as the next part of month `label`."""
+        parts = manifest.setdefault(label, [])
+        name = f"workouts_{label.replace('-', '_')}_{len(parts)}.csv.gz"
+        rows = sorted(workouts, key=lambda w: (w[1], -w[2].toordinal(), -w[0]))
+        with gzip.open(os.path.join(directory, name), "wt", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(backend.ARCHIVED_WORKOUT_COLUMNS)
+            for workout_id, user_id, date, duration in rows:
+                writer.writerow([workout_id, user_id, date.isoformat(), duration, f"{date}T12:00:00+00:00"])
+        parts.append({
+            "workouts": name,
+            "exercises": name.replace("workouts_", "exercises_"),
+            "first_workout_id": min(w[0] for w in workouts),
+            "last_workout_id": max(w[0] for w in workouts),
+        })
+        backend._write_manifest(directory, manifest)
+        backend._archive_manifest.pop(directory, None)
+
+    add_part.directory = directory
+    add_part.reads = reads
+    return add_part
+
+
+def merge(archive, workouts, limit, before=None):
+    return backend._merge_archived_workouts(USER, workouts, limit, before, directory=archive.directory)
+
+
+def test_no_archive_leaves_the_page_alone(tmp_path):
+    workouts = [(30, day("2024-06-03"), 45)]
+    assert backend._merge_archived_workouts(USER, workouts, 20, None, directory=str(tmp_path)) == workouts
+
+
+def test_archived_workouts_follow_the_live_ones(archive):
+    archive("2024-01", [(3, USER, day("2024-01-20"), 30), (2, 8, day("2024-01-21"), 60), (1, USER, day("2024-01-05"), None)])
+    live = [(30, day("2024-06-03"), 45)]
+    assert merge(archive, live, 20) == [
+        (30, day("2024-06-03"), 45),
+        (3, day("2024-01-20"), 30),
+        (1, day("2024-01-05"), None),
+    ]
+
+
+def test_full_page_of_live_workouts_skips_the_months_below_it(archive):
+    archive("2024-01", [(1, USER, day("2024-01-05"), 30)])
+    archive("2024-05", [(10, USER, day("2024-05-31"), 20), (9, USER, day("2024-05-01"), 20)])
+    live = [(32, day("2024-06-20"), 45), (31, day("2024-06-10"), 45), (30, day("2024-06-01"), 45)]
+    # The page ends at its lowest live row, so no archived month can reach it
+    assert merge(archive, live, 2) == [
+        (32, day("2024-06-20"), 45),
+        (31, day("2024-06-10"), 45),
+        (30, day("2024-06-01"), 45),
+    ]
+    assert archive.reads == []
+
+
+def test_archived_month_above_the_lowest_live_row_is_merged(archive):
+    archive("2024-05", [(10, USER, day("2024-05-31"), 20), (9, USER, day("2024-05-01"), 20)])
+    live = [(32, day("2024-06-20"), 45), (31, day("2024-05-20"), 45), (30, day("2024-05-10"), 45)]
+    assert merge(archive, live, 2) == [
+        (32, day("2024-06-20"), 45),
+        (10, day("2024-05-31"), 20),
+        (31, day("2024-05-20"), 45),
+    ]
+
+
+def test_cursor_inside_an_archived_month(archive):
+    archive("2024-02", [(6, USER, day("2024-02-10"), 30)])
+    archive("2024-01", [(3, USER, day("2024-01-20"), 30), (2, USER, day("2024-01-20"), 40), (1, USER, day("2024-01-05"), 50)])
+    # The last page ended at workout 3; same-day workouts are ordered by ID
+    before = (day("2024-01-20"), 3)
+    assert merge(archive, [], 20, before) == [(2, day("2024-01-20"), 40), (1, day("2024-01-05"), 50)]
+    assert archive.reads == ["workouts_2024_01_0.csv.gz"]
+
+
+def test_pages_of_archived_workouts_stop_once_full(archive):
+    archive("2023-12", [(1, USER, day("2023-12-05"), 30)])
+    archive("2024-01", [(3, USER, day("2024-01-20"), 30), (2, USER, day("2024-01-10"), 30)])
+    assert merge(archive, [], 1) == [(3, day("2024-01-20"), 30), (2, day("2024-01-10"), 30)]
+    assert archive.reads == ["workouts_2024_01_0.csv.gz"]
+
+
+def test_live_partition_recreated_for_an_archived_month(archive):
+    # Workouts logged into January after it was archived live in a new partition, and a
+    # second archive run adds them as the month's next part
+    archive("2024-01", [(3, USER, day("2024-01-20"), 30), (1, USER, day("2024-01-05"), 30)])
+    live = [(40, day("2024-01-25"), 45), (41, day("2024-01-10"), 45)]
+    assert merge(archive, live, 20) == [
+        (40, day("2024-01-25"), 45),
+        (3, day("2024-01-20"), 30),
+        (41, day("2024-01-10"), 45),
+        (1, day("2024-01-05"), 30),
+    ]
+    archive("2024-01", [(40, USER, day("2024-01-25"), 45), (41, USER, day("2024-01-10"), 45)])
+    assert merge(archive, [], 3) == [
+        (40, day("2024-01-25"), 45),
+        (3, day("2024-01-20"), 30),
+        (41, day("2024-01-10"), 45),
+        (1, day("2024-01-05"), 30),
+    ]
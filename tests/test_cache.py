@@ -0,0 +1,84 @@
+import time
+
+from Cache import MISS, LRUCache
+
+
+def load(cache, key, value):
+    """Looks a key up and stores `value` on a miss, as Backend's readers do."""
+    cached, version = cache.lookup(key)
+    if cached is MISS:
+        cache.store(key, value, version)
+        return value
+    return cached
+
+
+def test_least_recently_used_key_is_evicted():
+    cache = LRUCache(max_entries=2)
+    load(cache, ("user", 1), "a")
+    load(cache, ("user", 2), "b")
+    load(cache, ("user", 1), "unused")   # a hit makes user 1 the most recently used
+    load(cache, ("user", 3), "c")
+    assert cache.lookup(("user", 2))[0] is MISS
+    assert cache.lookup(("user", 1))[0] == "a"
+    assert cache.lookup(("user", 3))[0] == "c"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_their_namespace_ttl():
+    cache = LRUCache(ttls={"feed": 0.05}, default_ttl=60)
+    load(cache, ("feed", 1), "feed")
+    load(cache, ("user", 1), "user")
+    time.sleep(0.06)
+    assert cache.lookup(("feed", 1))[0] is MISS
+    assert cache.lookup(("user", 1))[0] == "user"
+    assert cache.stats()["expired"] == 1
+
+
+def test_invalidate_drops_every_key_with_the_prefix():
+    cache = LRUCache()
+    load(cache, ("leaderboard", 7, "week", 0), "this week")
+    load(cache, ("leaderboard", 7, "week", 1), "last week")
+    load(cache, ("leaderboard", 8, "week", 0), "someone else")
+    load(cache, ("friends", 7), "friends")
+    cache.invalidate("leaderboard", 7)
+    assert cache.lookup(("leaderboard", 7, "week", 0))[0] is MISS
+    assert cache.lookup(("leaderboard", 7, "week", 1))[0] is MISS
+    assert cache.lookup(("leaderboard", 8, "week", 0))[0] == "someone else"
+    assert cache.lookup(("friends", 7))[0] == "friends"
+
+
+def test_invalidate_namespace_drops_every_owner():
+    cache = LRUCache()
+    load(cache, ("feed", 7), "a")
+    load(cache, ("feed", 8), "b")
+    load(cache, ("user", 7), "c")
+    cache.invalidate_namespace("feed")
+    assert cache.lookup(("feed", 7))[0] is MISS
+    assert cache.lookup(("feed", 8))[0] is MISS
+    assert cache.lookup(("user", 7))[0] == "c"
+
+
+def test_value_read_before_a_concurrent_invalidate_is_not_stored():
+    cache = LRUCache()
+    value, version = cache.lookup(("goals", 7))
+    cache.invalidate_many(["goals"], [7])   # a write commits while the read is in flight
+    cache.store(("goals", 7), "stale", version)
+    assert cache.lookup(("goals", 7))[0] is MISS
+    assert cache.stats()["stale_stores"] == 1
+
+
+def test_value_read_before_a_clear_is_not_stored():
+    cache = LRUCache()
+    load(cache, ("goals", 7), "old")
+    value, version = cache.lookup(("goals", 8))
+    cache.clear()
+    cache.store(("goals", 8), "stale", version)
+    assert cache.lookup(("goals", 7))[0] is MISS
+    assert cache.lookup(("goals", 8))[0] is MISS
+
+
+def test_zero_entries_disables_caching():
+    cache = LRUCache(max_entries=0)
+    load(cache, ("user", 1), "a")
+    assert cache.lookup(("user", 1))[0] is MISS
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+import Backend as backend
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    """Writes a JSON settings file and returns its path."""
+    def write(settings):
+        path = tmp_path / "fitness.json"
+        path.write_text(json.dumps(settings), encoding="utf-8")
+        return str(path)
+    return write
+
+
+def test_nothing_set_is_an_empty_config():
+    assert backend.load_config(environ={}) == {}
+
+
+def test_settings_are_read_from_the_environment():
+    environ = {
+        "FITNESS_DB_HOST": "db.internal",
+        "FITNESS_DB_PORT": "6432",
+        "FITNESS_POOL_MAX_SIZE": "20",
+        "FITNESS_POOL_CHECKOUT_TIMEOUT": "2.5",
+        "FITNESS_PREPARE_STATEMENTS": "off",
+        "FITNESS_WRITE_BEHIND": " Yes ",
+        "HOME": "/root",
+    }
+    assert backend.load_config(environ=environ) == {
+        "host": "db.internal",
+        "port": "6432",
+        "pool_max_size": 20,
+        "pool_checkout_timeout": 2.5,
+        "prepare_statements": False,
+        "write_behind": True,
+    }
+
+
+def test_settings_are_read_from_the_file_named_by_the_environment(config_file):
+    path = config_file({"host": "db.internal", "port": 6432, "pool_max_size": 20, "write_behind": True})
+    assert backend.load_config(environ={backend.CONFIG_FILE_ENV: path}) == {
+        "host": "db.internal",
+        "port": "6432",
+        "pool_max_size": 20,
+        "write_behind": True,
+    }
+
+
+def test_environment_wins_over_the_file(config_file):
+    path = config_file({"host": "db.internal", "pool_max_size": 20})
+    config = backend.load_config(path, environ={"FITNESS_POOL_MAX_SIZE": "5"})
+    assert config == {"host": "db.internal", "pool_max_size": 5}
+
+
+def test_unknown_setting_in_the_file_is_refused(config_file):
+    with pytest.raises(ValueError, match="pool_size"):
+        backend.load_config(config_file({"pool_size": 20}), environ={})
+
+
+@pytest.mark.parametrize("name, value", [
+    ("pool_max_size", "twenty"),
+    ("pool_max_size", "2.5"),
+    ("pool_checkout_timeout", "soon"),
+    ("prepare_statements", "maybe"),
+])
+def test_value_of_the_wrong_type_is_refused(name, value):
+    with pytest.raises(ValueError):
+        backend._parse_setting(name, value)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1", True), ("true", True), ("ON", True), ("0", False), ("False", False), ("no", False),
+    (True, True), (False, False),
+])
+def test_boolean_settings_accept_the_usual_spellings(value, expected):
+    assert backend._parse_setting("prepare_statements", value) is expected
+
+
+@pytest.mark.parametrize("sql, body", [
+    ("SELECT 1;", "SELECT 1;"),
+    ("SELECT * FROM Users WHERE user_id = %s;", "SELECT * FROM Users WHERE user_id = $1;"),
+    ("SELECT %s, %s, %s;", "SELECT $1, $2, $3;"),
+    # %% is a literal % for psycopg2, and PREPARE takes it as is
+    ("SELECT name FROM Users WHERE name LIKE 'A%%' AND user_id > %s;",
+     "SELECT name FROM Users WHERE name LIKE 'A%' AND user_id > $1;"),
+    ("SELECT 100 %% %s, %s;", "SELECT 100 % $1, $2;"),
+    ("SELECT '%%s', %s;", "SELECT '%s', $1;"),
+])
+def test_placeholders_are_numbered_for_prepare(sql, body):
+    assert backend._as_prepared_body(sql) == body
@@ -0,0 +1,64 @@
+import psycopg2
+import pytest
+
+import Backend as backend
+
+# Exercise name -> its exercise_key, as migrations/0004_exercise_stats.sql computes it
+EXERCISE_KEYS = [
+    ("Squat", "squat"),
+    ("Squats", "squat"),
+    ("SQUATS", "squat"),
+    ("  Back  Squats ", "back squat"),
+    ("Back\tSquats", "back squat"),
+    ("\tRow\r\n", "row"),
+    ("Lunges\n", "lunge"),
+    ("Bench Press", "bench press"),
+    ("Dips ", "dip"),
+    ("abs", "ab"),
+    ("s", "s"),
+    ("ss", "ss"),
+    ("", ""),
+    ("   ", ""),
+    # Only spaces, tabs and line breaks are trimmed; vertical tabs and form feeds become spaces
+    ("\vSquat", " squat"),
+    ("Squat\f", "squat "),
+    ("Squat\fRows", "squat row"),
+    # Punctuation is kept, and hides a plural "s" before it
+    ("Pull-Ups", "pull-up"),
+    ("pull-ups!", "pull-ups!"),
+    ("Farmer's Walks", "farmer's walk"),
+    ("Curl's", "curl'"),
+    ("Curls.", "curls."),
+    ("T-Bar Rows (wide)", "t-bar rows (wide)"),
+    ("Push-ups, Wide", "push-ups, wide"),
+    ("Clean & Jerks", "clean & jerk"),
+    ("21s", "21"),
+]
+
+
+@pytest.mark.parametrize("name, key", EXERCISE_KEYS)
+def test_exercise_key(name, key):
+    assert backend.normalize_exercise_name(name) == key
+
+
+@pytest.fixture(scope="module")
+def cursor():
+    """A cursor on the configured database, or a skip when it is unreachable or not migrated."""
+    try:
+        conn = psycopg2.connect(connect_timeout=2, **backend.DB_CONFIG)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no database: {e}")
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT to_regprocedure('normalize_exercise_name(text)') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            pytest.skip("the database is not migrated")
+        yield cur
+    finally:
+        conn.close()
+
+
+def test_exercise_key_matches_the_database(cursor):
+    names = [name for name, _ in EXERCISE_KEYS]
+    cursor.execute("SELECT normalize_exercise_name(name) FROM unnest(%s::text[]) WITH ORDINALITY AS t(name, i) ORDER BY i;", (names,))
+    assert [row[0] for row in cursor.fetchall()] == [backend.normalize_exercise_name(name) for name in names]
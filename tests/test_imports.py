@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+@pytest.mark.parametrize("module", ["AsyncBackend", "Backend"])
+def test_module_imports_first_with_settings_from_the_environment(module):
+    # Settings from the environment make Backend's import-time configure() close the
+    # pools, AsyncBackend's included, while AsyncBackend may still be importing Backend
+    env = dict(os.environ, FITNESS_DB_HOST="db.example", FITNESS_POOL_MAX_SIZE="3")
+    env.pop("FITNESS_CONFIG", None)
+    result = subprocess.run(
+        [sys.executable, "-c", f"import {module}, Backend; print(Backend.DB_CONFIG['host'], Backend.POOL_MAX_SIZE)"],
+        cwd=REPO, env=env, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ["db.example", "3"]
@@ -0,0 +1,63 @@
+import datetime
+
+import pytest
+
+import Backend as backend
+
+WEDNESDAY = datetime.date(2024, 3, 13)
+
+
+@pytest.mark.parametrize("today, periods_ago, window", [
+    (WEDNESDAY, 0, (datetime.date(2024, 3, 11), datetime.date(2024, 3, 17))),
+    (datetime.date(2024, 3, 11), 0, (datetime.date(2024, 3, 11), datetime.date(2024, 3, 17))),   # Monday
+    (datetime.date(2024, 3, 17), 0, (datetime.date(2024, 3, 11), datetime.date(2024, 3, 17))),   # Sunday
+    (WEDNESDAY, 1, (datetime.date(2024, 3, 4), datetime.date(2024, 3, 10))),
+    (WEDNESDAY, 2, (datetime.date(2024, 2, 26), datetime.date(2024, 3, 3))),
+    # Across a year
+    (datetime.date(2025, 1, 1), 0, (datetime.date(2024, 12, 30), datetime.date(2025, 1, 5))),
+])
+def test_week_windows_run_monday_to_sunday(today, periods_ago, window):
+    assert backend.leaderboard_window("week", periods_ago, today) == window
+
+
+@pytest.mark.parametrize("today, periods_ago, window", [
+    (WEDNESDAY, 0, (datetime.date(2024, 3, 1), datetime.date(2024, 3, 31))),
+    (datetime.date(2024, 3, 1), 0, (datetime.date(2024, 3, 1), datetime.date(2024, 3, 31))),
+    (datetime.date(2024, 3, 31), 0, (datetime.date(2024, 3, 1), datetime.date(2024, 3, 31))),
+    (WEDNESDAY, 1, (datetime.date(2024, 2, 1), datetime.date(2024, 2, 29))),   # a leap year
+    (datetime.date(2023, 3, 31), 1, (datetime.date(2023, 2, 1), datetime.date(2023, 2, 28))),
+    (WEDNESDAY, 3, (datetime.date(2023, 12, 1), datetime.date(2023, 12, 31))),
+    (WEDNESDAY, 14, (datetime.date(2023, 1, 1), datetime.date(2023, 1, 31))),
+])
+def test_month_windows_are_calendar_months(today, periods_ago, window):
+    assert backend.leaderboard_window("month", periods_ago, today) == window
+
+
+@pytest.mark.parametrize("period, periods_ago, window", [
+    ("7d", 0, (datetime.date(2024, 3, 7), WEDNESDAY)),
+    ("7d", 1, (datetime.date(2024, 2, 29), datetime.date(2024, 3, 6))),
+    ("30d", 0, (datetime.date(2024, 2, 13), WEDNESDAY)),
+    ("30d", 2, (datetime.date(2023, 12, 15), datetime.date(2024, 1, 13))),
+])
+def test_rolling_windows_end_today_or_where_the_next_one_starts(period, periods_ago, window):
+    assert backend.leaderboard_window(period, periods_ago, WEDNESDAY) == window
+
+
+def test_rolling_windows_stop_at_the_kept_day_rollups():
+    last = backend.DAY_ROLLUP_DAYS // 30 - 1
+    first_day, _ = backend.leaderboard_window("30d", last, WEDNESDAY)
+    assert (WEDNESDAY - first_day).days < backend.DAY_ROLLUP_DAYS
+    with pytest.raises(ValueError):
+        backend.leaderboard_window("30d", last + 1, WEDNESDAY)
+
+
+@pytest.mark.parametrize("period, periods_ago", [("year", 0), ("week", -1), ("7d", -1)])
+def test_invalid_window_is_refused(period, periods_ago):
+    with pytest.raises(ValueError):
+        backend.leaderboard_window(period, periods_ago, WEDNESDAY)
+
+
+def test_window_defaults_to_today():
+    first_day, last_day = backend.leaderboard_window("week")
+    assert first_day <= datetime.date.today() <= last_day
+    assert first_day.weekday() == 0
@@ -0,0 +1,178 @@
+import threading
+import time
+
+import psycopg2
+import pytest
+
+import Backend as backend
+
+
+def test_returned_connection_is_reused(make_database):
+    database = make_database("primary")
+    pool = backend.ConnectionPool(database, min_size=0, max_size=2)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert len(database.connections) == 1
+
+
+def test_min_size_connections_are_opened_up_front(make_database):
+    database = make_database("primary")
+    pool = backend.ConnectionPool(database, min_size=2, max_size=4)
+    assert len(database.connections) == 2
+    assert pool.stats()["idle"] == 2
+
+
+def test_exhausted_pool_times_out(make_database):
+    pool = backend.ConnectionPool(make_database("primary"), min_size=0, max_size=1, timeout=0.05)
+    pool.getconn()
+    start = time.monotonic()
+    with pytest.raises(backend.PoolError):
+        pool.getconn()
+    assert time.monotonic() - start >= 0.05
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_waiter_gets_the_connection_returned_before_its_timeout(make_database):
+    pool = backend.ConnectionPool(make_database("primary"), min_size=0, max_size=1, timeout=5.0)
+    conn = pool.getconn()
+    threading.Timer(0.05, pool.putconn, (conn,)).start()
+    assert pool.getconn() is conn
+    assert pool.stats()["timeouts"] == 0
+
+
+def test_closed_connection_is_discarded_when_returned(make_database):
+    database = make_database("primary")
+    pool = backend.ConnectionPool(database, min_size=0, max_size=1)
+    conn = pool.getconn()
+    conn.close()
+    pool.putconn(conn)
+    replacement = pool.getconn()
+    assert replacement is not conn
+    assert len(database.connections) == 2
+    assert pool.stats()["connections_discarded"] == 1
+
+
+def test_connection_closed_while_idle_is_not_handed_out(make_database):
+    pool = backend.ConnectionPool(make_database("primary"), min_size=0, max_size=1)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.close()   # the server dropped it while it sat in the pool
+    assert pool.getconn() is not conn
+    assert pool.stats()["connections_discarded"] == 1
+
+
+def test_connection_failing_its_health_check_is_discarded(make_database):
+    pool = backend.ConnectionPool(make_database("primary"), min_size=0, max_size=1, health_check_interval=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.broken = True
+    replacement = pool.getconn()
+    assert replacement is not conn
+    assert conn.closed
+    assert pool.stats()["failed_health_checks"] == 1
+
+
+def test_recently_returned_connection_skips_the_health_check(make_database):
+    pool = backend.ConnectionPool(make_database("primary"), min_size=0, max_size=1, health_check_interval=60)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert conn.statements == []
+
+
+def test_connection_past_its_lifetime_is_recycled(make_database):
+    pool = backend.ConnectionPool(make_database("primary"), min_size=0, max_size=1, max_lifetime=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is not conn
+    assert conn.closed
+
+
+def test_open_transaction_is_rolled_back_when_returned(make_database):
+    pool = backend.ConnectionPool(make_database("primary"), min_size=0, max_size=1)
+    conn = pool.getconn()
+    conn.cursor().execute("SELECT 1;")
+    pool.putconn(conn)
+    assert not conn.in_transaction
+    assert pool.getconn() is conn
+
+
+def test_connection_that_cannot_roll_back_is_discarded(make_database):
+    pool = backend.ConnectionPool(make_database("primary"), min_size=0, max_size=1)
+    conn = pool.getconn()
+    conn.cursor().execute("SELECT 1;")
+    conn.broken = True
+    pool.putconn(conn)
+    assert pool.getconn() is not conn
+    assert pool.stats()["connections_discarded"] == 1
+
+
+def test_failed_connect_frees_its_slot(make_database):
+    database = make_database("primary")
+    pool = backend.ConnectionPool(database, min_size=0, max_size=1, timeout=0.05)
+    database.down = True
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
+    database.down = False
+    assert pool.getconn() is database.connections[0]
+
+
+def test_close_closes_idle_connections_and_refuses_checkouts(make_database):
+    database = make_database("primary")
+    pool = backend.ConnectionPool(database, min_size=2, max_size=2)
+    pool.close()
+    assert all(conn.closed for conn in database.connections)
+    with pytest.raises(backend.PoolError):
+        pool.getconn()
+
+
+def test_connection_returned_after_close_is_closed(make_database):
+    pool = backend.ConnectionPool(make_database("primary"), min_size=0, max_size=1)
+    conn = pool.getconn()
+    pool.close()
+    pool.putconn(conn)
+    assert conn.closed
+    assert pool.stats()["size"] == 0
+
+
+def test_close_pool_closes_the_process_wide_pool(make_database, monkeypatch):
+    database = make_database("primary")
+    monkeypatch.setattr(backend, "_pool", None)
+    monkeypatch.setattr(backend, "_replicas", None)
+    pool = backend.configure_pool(database, min_size=2, max_size=2)
+    conn = backend.get_db_connection()
+    backend.close_pool()
+    assert backend._pool is None
+    assert all(idle.closed for idle in database.connections if idle is not conn)
+    pool.putconn(conn)
+    assert conn.closed
+
+
+def test_connection_returned_after_close_pool_is_closed_not_pooled(make_database, monkeypatch):
+    database = make_database("primary")
+    monkeypatch.setattr(backend, "_pool", None)
+    monkeypatch.setattr(backend, "_replicas", None)
+    monkeypatch.setattr(backend, "_checked_out", {})
+    backend.configure_pool(database, min_size=0, max_size=2)
+    conn = backend.get_db_connection()
+    backend.close_pool()
+    new_pool = backend.configure_pool(make_database("primary"), min_size=0, max_size=2)
+    backend.close_db_connection(conn, None)
+    assert conn.closed
+    assert new_pool.stats()["idle"] == 0
+    assert new_pool.stats()["in_use"] == 0
+    assert backend._checked_out == {}
+
+
+def test_connection_returned_after_configure_pool_goes_back_to_its_own_pool(make_database, monkeypatch):
+    monkeypatch.setattr(backend, "_pool", None)
+    monkeypatch.setattr(backend, "_checked_out", {})
+    old_pool = backend.configure_pool(make_database("old"), min_size=0, max_size=2)
+    conn = backend.get_db_connection()
+    new_pool = backend.configure_pool(make_database("new"), min_size=0, max_size=2)
+    backend.close_db_connection(conn, None)
+    assert conn.closed
+    assert old_pool.stats()["size"] == 0
+    assert new_pool.stats()["size"] == 0
+    assert backend.get_db_connection().server == "new"
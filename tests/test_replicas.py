@@ -0,0 +1,203 @@
+import asyncio
+import itertools
+import time
+
+import pytest
+from psycopg_pool import PoolTimeout
+
+import AsyncBackend as async_backend
+import Backend as backend
+
+
+@pytest.fixture
+def servers(make_database, monkeypatch):
+    """Stubs Backend's primary and two replicas with fake pools, with fresh routing state."""
+    primary = make_database("primary")
+    replicas = [make_database("replica0"), make_database("replica1")]
+    monkeypatch.setattr(backend, "_pool", backend.ConnectionPool(primary, min_size=0, max_size=2, timeout=0.05))
+    monkeypatch.setattr(backend, "_replicas", [
+        backend.ConnectionPool(replica, min_size=0, max_size=2, timeout=0.05) for replica in replicas
+    ])
+    monkeypatch.setattr(backend, "REPLICA_CONFIGS", [{"port": "5433"}, {"port": "5434"}])
+    monkeypatch.setattr(backend, "_replica_down_until", {})
+    monkeypatch.setattr(backend, "_recent_writes", {})
+    monkeypatch.setattr(backend, "_checked_out", {})
+    monkeypatch.setattr(backend, "_next_replica", itertools.count())
+    monkeypatch.setattr(backend, "_routing_stats", dict.fromkeys(backend._routing_stats, 0))
+    return primary, replicas
+
+
+def read(owner=None):
+    """Checks out a read connection the way Backend's readers do, and returns the server that served it."""
+    conn = backend.get_read_connection(owner)
+    try:
+        return conn.server
+    finally:
+        backend.close_db_connection(conn, None)
+
+
+def test_reads_go_to_the_replicas_in_turn(servers):
+    assert [read() for _ in range(4)] == ["replica0", "replica1", "replica0", "replica1"]
+    stats = backend.replica_stats()
+    assert stats["replica_reads"] == 4
+    assert stats["primary_reads"] == 0
+
+
+def test_replica_connections_go_back_to_their_own_pool(servers):
+    read()
+    replica_pool = backend.get_replica_pools()[0]
+    assert replica_pool.stats()["idle"] == 1
+    assert backend._pool.stats()["idle"] == 0
+    assert backend._checked_out == {}
+
+
+def test_reads_use_the_primary_without_replicas(servers, monkeypatch):
+    monkeypatch.setattr(backend, "REPLICA_CONFIGS", [])
+    monkeypatch.setattr(backend, "_replicas", [])
+    assert read(7) == "primary"
+
+
+def test_owner_reads_stay_on_the_primary_after_a_write(servers):
+    backend._invalidate(["goals"], [7])
+    assert read(7) == "primary"
+    assert read(7) == "primary"
+    assert read(8).startswith("replica")
+    assert backend.replica_stats()["sticky_reads"] == 2
+
+
+def test_owner_reads_return_to_the_replicas_after_the_window(servers, monkeypatch):
+    monkeypatch.setattr(backend, "READ_YOUR_WRITES_WINDOW", 0.05)
+    backend._invalidate(["goals"], [7])
+    assert read(7) == "primary"
+    time.sleep(0.06)
+    assert read(7).startswith("replica")
+
+
+def test_down_replica_is_skipped(servers):
+    primary, replicas = servers
+    replicas[0].down = True
+    assert read() == "replica1"
+    assert read() == "replica1"
+    assert backend.replica_stats()["replicas_down"] == [0]
+    assert backend.replica_stats()["replica_failures"] == 1
+
+
+def test_reads_fall_back_to_the_primary_when_every_replica_is_down(servers):
+    primary, replicas = servers
+    for replica in replicas:
+        replica.down = True
+    assert read() == "primary"
+    assert backend.replica_stats()["replicas_down"] == [0, 1]
+    # Down replicas are not tried again until REPLICA_RETRY_INTERVAL has passed
+    assert read() == "primary"
+    assert backend.replica_stats()["replica_failures"] == 2
+
+
+def test_down_replica_is_retried_after_the_interval(servers, monkeypatch):
+    primary, replicas = servers
+    monkeypatch.setattr(backend, "REPLICA_RETRY_INTERVAL", 0.05)
+    for replica in replicas:
+        replica.down = True
+    assert read() == "primary"
+    for replica in replicas:
+        replica.down = False
+    time.sleep(0.06)
+    assert read().startswith("replica")
+    assert backend.replica_stats()["replicas_down"] == []
+
+
+def test_replica_that_drops_a_connection_mid_read_is_marked_down(servers):
+    conn = backend.get_read_connection()
+    assert conn.server == "replica0"
+    conn.close()
+    backend.close_db_connection(conn, None)
+    assert backend.replica_stats()["replicas_down"] == [0]
+    assert read() == "replica1"
+
+
+def test_exhausted_replica_sends_the_read_to_the_primary_without_marking_it_down(servers):
+    held = [backend.get_read_connection() for _ in range(4)]   # both connections of both replicas
+    assert read() == "primary"
+    stats = backend.replica_stats()
+    assert stats["replicas_down"] == []
+    assert stats["replica_failures"] == 0
+    assert stats["replica_busy"] == 1
+    for conn in held:
+        backend.close_db_connection(conn, None)
+    assert read().startswith("replica")
+
+
+def test_closed_replica_pool_is_not_marked_down(servers):
+    backend.get_replica_pools()[0].close()
+    assert read() == "primary"
+    assert backend.replica_stats()["replicas_down"] == []
+    assert read() == "replica1"
+
+
+class FakeAsyncPool:
+    """Stands in for a psycopg_pool pool, which connects in the background and only ever times out."""
+
+    def __init__(self, database):
+        self.database = database
+        self.busy = False          # every connection is checked out
+        self.stats = {}
+
+    async def getconn(self):
+        if self.database.down:
+            self.stats["connections_errors"] = self.stats.get("connections_errors", 0) + 1
+        if self.database.down or self.busy:
+            raise PoolTimeout("couldn't get a connection after 0.05 sec")
+        return self.database()
+
+    async def putconn(self, conn):
+        pass
+
+    def get_stats(self):
+        return dict(self.stats)
+
+
+@pytest.fixture
+def async_pools(servers, monkeypatch):
+    """Stubs AsyncBackend's pools with fake ones over the same fake servers."""
+    primary, replicas = servers
+    pools = [FakeAsyncPool(replica) for replica in replicas]
+
+    async def get_pool():
+        return FakeAsyncPool(primary)
+
+    async def get_replica_pool(index):
+        return pools[index]
+
+    monkeypatch.setattr(async_backend, "get_pool", get_pool)
+    monkeypatch.setattr(async_backend, "get_replica_pool", get_replica_pool)
+    return pools
+
+
+def async_read(owner=None):
+    """Checks out a read connection the way AsyncBackend's readers do, and returns the server that served it."""
+    async def checkout():
+        async with async_backend._read_connection(owner) as conn:
+            return conn.server
+    return asyncio.run(checkout())
+
+
+def test_async_reads_go_to_the_replicas_in_turn(async_pools):
+    assert [async_read() for _ in range(3)] == ["replica0", "replica1", "replica0"]
+
+
+def test_async_read_skips_a_replica_it_cannot_connect_to(servers, async_pools):
+    primary, replicas = servers
+    replicas[0].down = True
+    assert async_read() == "replica1"
+    assert backend.replica_stats()["replicas_down"] == [0]
+
+
+def test_async_read_of_an_exhausted_replica_goes_to_the_primary(async_pools):
+    async_pools[0].busy = True
+    assert async_read() == "primary"
+    stats = backend.replica_stats()
+    assert stats["replicas_down"] == []
+    assert stats["replica_busy"] == 1
+    async_pools[0].busy = False
+    assert async_read() == "replica1"
+    assert async_read() == "replica0"
@@ -0,0 +1,133 @@
+import datetime
+import decimal
+import json
+import threading
+import time
+
+import pytest
+
+import Cache
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Cache.SQLiteStore(str(tmp_path / "cache.db"))
+
+
+@pytest.fixture
+def cache(store):
+    return Cache.SharedCache(store, lease=5.0, poll_interval=0.01)
+
+
+def load(cache, key, loader):
+    """Reads a key through the cache the way Backend's readers do: store on a miss, release in a finally."""
+    value, version = cache.lookup(key)
+    if value is not Cache.MISS:
+        return value
+    try:
+        value = loader()
+        cache.store(key, value, version)
+        return value
+    finally:
+        cache.release(key, version)
+
+
+ROWS = [
+    (1, datetime.date(2024, 3, 1), 45, [("squat", 5, 5, decimal.Decimal("102.50"))]),
+    (2, datetime.datetime(2024, 3, 2, 7, 30), None, []),
+]
+
+
+def test_encoded_values_survive_json_with_their_types():
+    value = {"rows": ROWS, 7: ("week", 0), ("a", 1): 1.5}
+    assert Cache._decode(json.loads(json.dumps(Cache._encode(value)))) == value
+    decoded = Cache._decode(json.loads(json.dumps(Cache._encode(ROWS))))
+    assert isinstance(decoded[0], tuple)
+    assert isinstance(decoded[0][3][0][3], decimal.Decimal)
+    assert type(decoded[0][1]) is datetime.date
+    assert type(decoded[1][1]) is datetime.datetime
+
+
+def test_encode_refuses_values_json_cannot_hold():
+    with pytest.raises(TypeError):
+        Cache._encode({1, 2})
+
+
+def test_stored_value_comes_back_from_another_process(store, tmp_path):
+    load(Cache.SharedCache(store), ("workouts", 7, 20), lambda: ROWS)
+    other = Cache.SharedCache(Cache.SQLiteStore(str(tmp_path / "cache.db")))
+    value, _ = other.lookup(("workouts", 7, 20))
+    assert value == ROWS
+    assert other.stats()["hits"] == 1
+
+
+def test_invalidate_stops_serving_the_owner_only(cache):
+    load(cache, ("workouts", 7, 20), lambda: ROWS)
+    load(cache, ("workouts", 8, 20), lambda: ROWS)
+    cache.invalidate("workouts", 7)
+    assert load(cache, ("workouts", 7, 20), lambda: "reloaded") == "reloaded"
+    assert load(cache, ("workouts", 8, 20), lambda: "reloaded") == ROWS
+
+
+def test_invalidate_namespace_stops_serving_every_owner(cache):
+    load(cache, ("leaderboard", 7, "week", 0), lambda: [])
+    load(cache, ("leaderboard", 8, "week", 0), lambda: [])
+    cache.invalidate_namespace("leaderboard")
+    assert load(cache, ("leaderboard", 7, "week", 0), lambda: "reloaded") == "reloaded"
+    assert load(cache, ("leaderboard", 8, "week", 0), lambda: "reloaded") == "reloaded"
+
+
+def test_value_loaded_before_an_invalidate_is_not_served(cache):
+    key = ("goals", 7, 10, None)
+    value, version = cache.lookup(key)
+    cache.invalidate("goals", 7)   # a write commits while the read is in flight
+    cache.store(key, "stale", version)
+    cache.release(key, version)
+    value, version = cache.lookup(key)
+    assert value is Cache.MISS
+    cache.release(key, version)
+
+
+def test_concurrent_misses_load_once(cache):
+    loads = []
+    loading = threading.Event()
+
+    def loader():
+        loads.append(1)
+        loading.set()
+        time.sleep(0.1)
+        return ROWS
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(load(cache, ("feed", 7), loader)))
+    first.start()
+    loading.wait(1.0)
+    results.append(load(cache, ("feed", 7), loader))
+    first.join()
+    assert results == [ROWS, ROWS]
+    assert len(loads) == 1
+    assert cache.stats()["coalesced"] == 1
+
+
+def test_failed_load_releases_its_lease(cache):
+    def loader():
+        raise RuntimeError("database unavailable")
+
+    with pytest.raises(RuntimeError):
+        load(cache, ("user", 7), loader)
+    start = time.monotonic()
+    assert load(cache, ("user", 7), lambda: "Alice") == "Alice"
+    assert time.monotonic() - start < cache.lease / 2
+
+
+def test_clear_drops_the_entries(cache):
+    load(cache, ("user", 7), lambda: "Alice")
+    cache.clear()
+    assert load(cache, ("user", 7), lambda: "Bob") == "Bob"
+
+
+def test_store_errors_count_as_misses(cache, store):
+    load(cache, ("user", 7), lambda: "Alice")
+    store._db().execute("DROP TABLE entries;")
+    assert cache.lookup(("user", 7)) == (Cache.MISS, None)
+    assert cache.stats()["errors"] == 1
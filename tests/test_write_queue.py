@@ -0,0 +1,139 @@
+import datetime
+
+import pytest
+
+import Backend as backend
+import WriteQueue as write_queue
+
+EXERCISES = [{'name': " Squat ", 'sets': 5, 'reps': 5.0, 'weight': 102.555}]
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    """Points the write-behind queue at a fresh SQLite file, with no delay between retries."""
+    monkeypatch.setattr(backend, "QUEUE_PATH", str(tmp_path / "workouts.sqlite3"))
+    monkeypatch.setattr(write_queue, "_queue", None)
+    monkeypatch.setattr(write_queue, "QUEUE_RETRY_DELAY", 0.0)
+    return write_queue.get_queue()
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """Stands in for Backend.write_workout_submissions; `refuse` maps keys to errors, `down` fails every batch."""
+    class Database:
+        def __init__(self):
+            self.down = False
+            self.refuse = {}
+            self.batches = []
+
+        def write(self, submissions):
+            self.batches.append([s['key'] for s in submissions])
+            if self.down:
+                return None
+            refused = {s['key']: self.refuse[s['key']] for s in submissions if s['key'] in self.refuse}
+            return len(submissions) - len(refused), refused
+
+    database = Database()
+    monkeypatch.setattr(backend, "write_workout_submissions", database.write)
+    return database
+
+
+def test_validate_workout_normalizes_the_submission():
+    workout = write_queue.validate_workout(7, "2024-03-01", 45.0, EXERCISES)
+    assert workout == {
+        'user_id': 7,
+        'workout_date': "2024-03-01",
+        'duration_minutes': 45,
+        'exercises': [{'name': "Squat", 'sets': 5, 'reps': 5, 'weight': 102.56}],
+    }
+
+
+@pytest.mark.parametrize("user_id, workout_date, duration, exercise", [
+    (0, datetime.date(2024, 3, 1), 45, {'name': "Squat"}),
+    (7, "2024-02-30", 45, {'name': "Squat"}),
+    (7, 20240301, 45, {'name': "Squat"}),
+    (7, datetime.date(2024, 3, 1), 0, {'name': "Squat"}),
+    (7, datetime.date(2024, 3, 1), 45.5, {'name': "Squat"}),
+    (7, datetime.date(2024, 3, 1), True, {'name': "Squat"}),
+    (7, datetime.date(2024, 3, 1), 45, {'name': "  "}),
+    (7, datetime.date(2024, 3, 1), 45, {'name': "x" * 256}),
+    (7, datetime.date(2024, 3, 1), 45, {'name': "Squat", 'sets': -1}),
+    (7, datetime.date(2024, 3, 1), 45, {'name': "Squat", 'reps': "5"}),
+    (7, datetime.date(2024, 3, 1), 45, {'name': "Squat", 'weight': 1000}),
+    (7, datetime.date(2024, 3, 1), 45, {'name': "Squat", 'weight': -2.5}),
+])
+def test_invalid_workout_is_refused_at_enqueue(queue, user_id, workout_date, duration, exercise):
+    with pytest.raises(ValueError):
+        write_queue.enqueue_workout(user_id, workout_date, duration, [exercise])
+    assert queue.stats()["depth"] == 0
+
+
+def test_enqueueing_a_key_again_is_a_no_op(queue):
+    key = write_queue.enqueue_workout(7, "2024-03-01", 45, EXERCISES)
+    assert write_queue.enqueue_workout(7, "2024-03-01", 45, EXERCISES, submission_key=key) == key
+    write_queue.enqueue_workout(7, "2024-03-02", 30, [])
+    assert write_queue.pending_workouts(7) == (2, 0)
+
+
+def test_claimed_submissions_are_leased(queue):
+    write_queue.enqueue_workout(7, "2024-03-01", 45, EXERCISES)
+    write_queue.enqueue_workout(7, "2024-03-02", 30, [])
+    first = queue.claim(1)
+    assert [workout['workout_date'] for _, _, workout, _ in first] == ["2024-03-01"]
+    second = queue.claim(10)
+    assert [workout['workout_date'] for _, _, workout, _ in second] == ["2024-03-02"]
+    assert queue.claim(10) == []
+
+
+def test_expired_lease_returns_the_batch_to_the_queue(queue):
+    write_queue.enqueue_workout(7, "2024-03-01", 45, EXERCISES)
+    batch = queue.claim(10, lease=0)
+    assert queue.claim(10) == batch
+
+
+def test_drained_submissions_leave_the_queue(queue, database):
+    keys = [write_queue.enqueue_workout(7, "2024-03-01", 45, EXERCISES) for _ in range(3)]
+    assert write_queue.drain(batch_size=2) == 3
+    assert database.batches == [keys[:2], keys[2:]]
+    assert queue.stats() == {"depth": 0, "dead": 0, "oldest_age_s": 0.0}
+
+
+def test_refused_submission_is_kept_as_dead(queue, database):
+    good = write_queue.enqueue_workout(7, "2024-03-01", 45, EXERCISES)
+    bad = write_queue.enqueue_workout(7, "2024-03-02", 30, [])
+    database.refuse = {bad: "user 7 does not exist"}
+    assert write_queue.drain_once() == 2
+    assert write_queue.pending_workouts(7) == (0, 1)
+    assert write_queue.drain_once() == 0
+    assert database.batches == [[good, bad]]
+
+
+def test_failed_batch_is_retried(queue, database):
+    key = write_queue.enqueue_workout(7, "2024-03-01", 45, EXERCISES)
+    database.down = True
+    assert write_queue.drain_once() is None
+    assert write_queue.pending_workouts(7) == (1, 0)
+    database.down = False
+    assert write_queue.drain_once() == 1
+    assert database.batches == [[key], [key]]
+    assert write_queue.pending_workouts(7) == (0, 0)
+
+
+def test_failed_batch_is_kept_as_dead_after_the_max_attempts(queue, database):
+    write_queue.enqueue_workout(7, "2024-03-01", 45, EXERCISES)
+    database.down = True
+    for _ in range(write_queue.QUEUE_MAX_ATTEMPTS):
+        assert write_queue.drain_once() is None
+    assert write_queue.pending_workouts(7) == (0, 1)
+    assert write_queue.drain_once() == 0
+    assert len(database.batches) == write_queue.QUEUE_MAX_ATTEMPTS
+
+
+def test_retry_delay_grows_with_the_attempts(queue, monkeypatch):
+    monkeypatch.setattr(write_queue, "QUEUE_RETRY_DELAY", 60.0)
+    write_queue.enqueue_workout(7, "2024-03-01", 45, EXERCISES)
+    (id, _, _, _), = queue.claim(10)
+    queue.retry([id], "connection refused")
+    assert queue.claim(10) == []
+    (delay,) = queue._db().execute("SELECT available_at - enqueued_at FROM submissions;").fetchone()
+    assert 60.0 <= delay < 120.0